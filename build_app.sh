@@ -25,7 +25,7 @@ echo -e "${GREEN}✓ python3 found: $PYTHON_CMD${NC}"
 
 # Check required files
 echo "Checking files..."
-for file in wampytube.py requirements.txt ffmpeg icon.png; do
+for file in wampytube.py wampytube_core.py requirements.txt ffmpeg icon.png; do
     if [ ! -f "$file" ]; then
         echo -e "${RED}Error: $file not found!${NC}"
         exit 1
@@ -77,6 +77,7 @@ hiddenimports = [
     'tkinter.ttk',
     'tkinter.filedialog',
     'customtkinter',
+    'wampytube_core',
     'pytubefix',
     'requests',
     'psutil',
@@ -87,6 +88,8 @@ hiddenimports = [
     'subprocess',
     'pathlib',
     'logging',
+    'logging.handlers',
+    'sqlite3',
     'functools',
     're',
     'time',
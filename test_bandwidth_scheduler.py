@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+import unittest
+from wampytube_core import BandwidthScheduler, DownloadJob, JobCancelled, JobThrottle, TransferPaused, PRIORITY_WEIGHTS
+
+# Test configuration
+TEST_RATE = 2 * 1024 * 1024  # Global cap, bytes per second
+TEST_CHUNK = 16 * 1024  # Bytes per acquire, small next to the rate so turns interleave finely
+TEST_DURATION = 1.5  # Seconds the priority classes compete for the link
+TEST_TIMEOUT = 5  # Seconds before a blocked transfer counts as starved
+
+class BandwidthSchedulerTest(unittest.TestCase):
+    """BandwidthScheduler sharing a capped link between priority classes"""
+    
+    def setUp(self):
+        self.scheduler = BandwidthScheduler(rate=TEST_RATE, job_rate=0)
+        self.threads = []
+        self.stop = threading.Event()
+    
+    def tearDown(self):
+        self.stop.set()
+        for thread in self.threads:
+            thread.join(TEST_TIMEOUT)
+    
+    def job(self, priority):
+        return DownloadJob('https://example.com/watch?v=test', '.', priority=priority)
+    
+    def transfer(self, job, amount, received, hold=True):
+        """Acquire amount bytes for job until the test stops, adding each grant to received[job.priority]"""
+        def run():
+            try:
+                while not self.stop.is_set():
+                    self.scheduler.acquire(job, amount, hold)
+                    received[job.priority] += amount
+            except JobCancelled:
+                pass
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        return thread
+    
+    def test_priority_weights(self):
+        received = dict.fromkeys(PRIORITY_WEIGHTS, 0)
+        # Two transfers per class, so every class always has a waiter
+        jobs = [self.job(priority) for priority in PRIORITY_WEIGHTS for _ in range(2)]
+        for job in jobs:
+            self.transfer(job, TEST_CHUNK, received)
+        time.sleep(TEST_DURATION)
+        self.stop.set()
+        for job in jobs:
+            job.cancel_event.set()
+        
+        for priority, weight in PRIORITY_WEIGHTS.items():
+            share = received[priority] / received['low']
+            self.assertAlmostEqual(share, weight / PRIORITY_WEIGHTS['low'], delta=weight * 0.25)
+    
+    def test_paused_job_does_not_starve_others(self):
+        # A big chunk keeps the high-priority job waiting for tokens inside acquire when it is paused
+        scheduler = self.scheduler = BandwidthScheduler(rate=256 * 1024, job_rate=0)
+        high = self.job('high')
+        received = dict.fromkeys(PRIORITY_WEIGHTS, 0)
+        self.transfer(high, 256 * 1024, received)
+        time.sleep(0.3)
+        scheduler.pause(high)
+        
+        low = self.job('low')
+        done = threading.Event()
+        threading.Thread(target=lambda: (scheduler.acquire(low, 1024), done.set()), daemon=True).start()
+        self.assertTrue(done.wait(TEST_TIMEOUT), "Low priority transfer starved behind a paused job")
+        
+        paused_at = received['high']
+        time.sleep(0.5)
+        self.assertEqual(received['high'], paused_at)
+        scheduler.resume(high)
+        high.cancel_event.set()
+    
+    def test_throttle_raises_while_paused(self):
+        job = self.job('normal')
+        throttle = JobThrottle(self.scheduler, job)
+        self.scheduler.pause(job)
+        with self.assertRaises(TransferPaused):
+            throttle(TEST_CHUNK)
+        
+        job.cancel_event.set()
+        with self.assertRaises(JobCancelled):
+            throttle.wait()
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import shutil
+import tempfile
+import unittest
+from collections import namedtuple
+from unittest import mock
+from wampytube_core import DiskSpaceGate, DiskTooSmallError, DownloadJob
+
+# Test configuration
+MB = 1024 * 1024
+TEST_TOTAL = 1000 * MB  # Size of the simulated volume
+TEST_FREE = 300 * MB  # Free space on it
+TEST_RESERVE = 100 * MB  # Left free after every reservation, so 200 MB can be handed out
+
+DiskUsage = namedtuple('DiskUsage', 'total used free percent')
+
+class DiskSpaceGateTest(unittest.TestCase):
+    """DiskSpaceGate reserving space on a simulated volume"""
+    
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='wampytube_test_')
+        self.usage = DiskUsage(TEST_TOTAL, TEST_TOTAL - TEST_FREE, TEST_FREE, 70.0)
+        patcher = mock.patch('wampytube_core.psutil.disk_usage', side_effect=lambda folder: self.usage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Long poll interval, so only releases and wakes call waiters back during a test
+        self.gate = DiskSpaceGate(reserve=TEST_RESERVE, poll_interval=60)
+    
+    def tearDown(self):
+        if self.gate.poll_timer:
+            self.gate.poll_timer.cancel()
+        shutil.rmtree(self.folder, ignore_errors=True)
+    
+    def job(self):
+        return DownloadJob('https://example.com/watch?v=test', self.folder)
+    
+    def test_fits(self):
+        job = self.job()
+        self.assertEqual(self.gate.try_acquire(job, {self.folder: 150 * MB}), [])
+        self.assertEqual(sum(self.gate.reservations[job.id].values()), 150 * MB)
+    
+    def test_reservations_share_the_volume(self):
+        self.gate.try_acquire(self.job(), {self.folder: 150 * MB})
+        missing = self.gate.try_acquire(self.job(), {self.folder: 100 * MB})
+        self.assertEqual(missing, [(self.folder, 100 * MB, 50 * MB)])
+    
+    def test_deferred_job_wakes_on_release(self):
+        first, second = self.job(), self.job()
+        self.gate.try_acquire(first, {self.folder: 150 * MB})
+        called = []
+        self.gate.defer(second, {self.folder: 100 * MB}, lambda: called.append(second))
+        self.assertEqual(called, [])
+        self.assertNotIn(second.id, self.gate.reservations)
+        
+        # The freed space goes to the waiter, which is called back holding it
+        self.gate.release(first)
+        self.assertEqual(called, [second])
+        self.assertEqual(sum(self.gate.reservations[second.id].values()), 100 * MB)
+        self.assertEqual(self.gate.waiters, [])
+    
+    def test_cancelled_waiter_is_called_back(self):
+        job = self.job()
+        called = []
+        self.gate.defer(job, {self.folder: 250 * MB}, lambda: called.append(job))
+        self.assertEqual(called, [])
+        job.cancel_event.set()
+        self.gate.wake()
+        self.assertEqual(called, [job])
+    
+    def test_too_large_for_volume_fails_at_once(self):
+        with self.assertRaises(DiskTooSmallError):
+            self.gate.try_acquire(self.job(), {self.folder: TEST_TOTAL})
+        self.assertEqual(self.gate.reservations, {})
+        
+        # A waiter whose check can never pass is handed back rather than kept forever
+        job = self.job()
+        called = []
+        self.gate.defer(job, {self.folder: TEST_TOTAL}, lambda: called.append(job))
+        self.assertEqual(called, [job])
+        self.assertEqual(self.gate.waiters, [])
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+from wampytube_core import DownloadArchive, DownloadEngine, FFMPEG_PATH, archive_tag, metadata_args
+
+# Test configuration
+TEST_VIDEO_ID = 'dQw4w9WgXcQ'
+TEST_METADATA = {
+    'title': 'Test video', 'length': 1,
+    'quality_options': ['1080p', '720p', '360p'],
+    'stream_map': {'1080p': {'type': 'adaptive', 'itag': 137, 'resolution': '1080p'},
+                   '720p': {'type': 'adaptive', 'itag': 136, 'resolution': '720p'},
+                   '360p': {'type': 'progressive', 'itag': 18, 'resolution': '360p'}},
+    'audio_options': [], 'audio_map': {},
+}
+
+def has_ffmpeg():
+    try:
+        return subprocess.run([FFMPEG_PATH, '-version'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+    except OSError:
+        return False
+
+class DownloadArchiveTest(unittest.TestCase):
+    """DownloadArchive lookups and the engine's quality-aware archive checks"""
+    
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='wampytube_test_')
+        # Keep the engine's archive and metadata cache out of the user's own directories
+        for name in ('get_data_dir', 'get_cache_dir'):
+            patcher = mock.patch(f'wampytube_core.{name}', return_value=self.folder)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.engine = DownloadEngine()
+        self.archive = self.engine.archive
+        self.path = os.path.join(self.folder, 'Test video.mp4')
+    
+    def tearDown(self):
+        self.archive.connection.close()
+        self.engine.persistent_cache.connection.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+    
+    def test_find(self):
+        self.archive.add(TEST_VIDEO_ID, 137, 'remux', self.path)
+        self.assertEqual(self.archive.find(TEST_VIDEO_ID, 'remux', 137), self.path)
+        self.assertEqual(self.archive.find(TEST_VIDEO_ID, 'remux'), self.path)
+        self.assertIsNone(self.archive.find(TEST_VIDEO_ID, 'remux', 136))
+        self.assertIsNone(self.archive.find(TEST_VIDEO_ID, 'transcode'))
+        
+        # Entries survive a restart
+        reopened = DownloadArchive(self.archive.path)
+        self.assertEqual(reopened.find(TEST_VIDEO_ID, 'remux', 137), self.path)
+        reopened.connection.close()
+    
+    def test_lookup_without_cached_streams(self):
+        self.archive.add(TEST_VIDEO_ID, 137, 'remux', self.path)
+        self.assertEqual(self.engine.archive_lookup(TEST_VIDEO_ID, 'remux', 'best'), self.path)
+        # The archived quality is unknown, so a specific quality is downloaded rather than skipped
+        self.assertIsNone(self.engine.archive_lookup(TEST_VIDEO_ID, 'remux', '720'))
+    
+    def test_lookup_uses_cached_streams(self):
+        self.engine.persistent_cache.put(TEST_VIDEO_ID, TEST_METADATA)
+        self.archive.add(TEST_VIDEO_ID, 137, 'remux', self.path)
+        self.assertEqual(self.engine.archive_lookup(TEST_VIDEO_ID, 'remux', 'best'), self.path)
+        self.assertEqual(self.engine.archive_lookup(TEST_VIDEO_ID, 'remux', '1440'), self.path)
+        self.assertIsNone(self.engine.archive_lookup(TEST_VIDEO_ID, 'remux', '720'))
+        
+        self.archive.add(TEST_VIDEO_ID, 136, 'remux', self.path)
+        self.assertEqual(self.engine.archive_lookup(TEST_VIDEO_ID, 'remux', '720'), self.path)
+    
+    def test_lookup_prefers_chosen_stream(self):
+        self.engine.persistent_cache.put(TEST_VIDEO_ID, TEST_METADATA)
+        self.archive.add(TEST_VIDEO_ID, 137, 'remux', self.path)
+        self.assertIsNone(self.engine.archive_lookup(TEST_VIDEO_ID, 'remux', 'best', itag=18))
+    
+    def make_video(self, path, metadata=None):
+        subprocess.run([FFMPEG_PATH, '-v', 'error', '-f', 'lavfi', '-i', 'testsrc=duration=1:size=64x48:rate=5',
+                        *metadata_args(metadata), path], check=True)
+    
+    @unittest.skipUnless(has_ffmpeg(), "ffmpeg is not available")
+    def test_rebuild(self):
+        self.make_video(self.path, {'comment': archive_tag(TEST_VIDEO_ID, 18, 'remux')})
+        untagged = os.path.join(self.folder, 'Untagged.mp4')
+        self.make_video(untagged)
+        gone = os.path.join(self.folder, 'Deleted.mp4')
+        self.archive.add('aaaaaaaaaaa', 22, 'remux', untagged)
+        self.archive.add('bbbbbbbbbbb', 22, 'remux', gone)
+        
+        # Tagged files are found, untagged entries still on disk are kept and missing files dropped
+        self.assertEqual(self.archive.rebuild(self.folder), 2)
+        self.assertEqual(self.archive.find(TEST_VIDEO_ID, 'remux', 18), self.path)
+        self.assertEqual(self.archive.find('aaaaaaaaaaa', 'remux'), untagged)
+        self.assertIsNone(self.archive.find('bbbbbbbbbbb', 'remux'))
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+import unittest
+from unittest import mock
+from wampytube_core import (ENCODER_BACKENDS, ENCODE_MIN_BITRATE, codec_family, lookup_by_height,
+                            plan_video_encode, rate_control_args, target_bitrate)
+
+def backend(name):
+    return next(backend for backend in ENCODER_BACKENDS if backend['name'] == name)
+
+def source(codec='avc1.640028', height=1080, fps=30, bitrate=None):
+    return {'codecs': [codec], 'height': height, 'fps': fps, 'bitrate': bitrate}
+
+class EncodePolicyTest(unittest.TestCase):
+    """Per-source bitrate, CRF and skip decisions of the encode policy"""
+    
+    def test_codec_family(self):
+        self.assertEqual(codec_family(['avc1.640028']), 'h264')
+        self.assertEqual(codec_family(['hvc1.1.6.L120.90']), 'hevc')
+        self.assertEqual(codec_family(['vp09.00.40.08']), 'vp9')
+        self.assertEqual(codec_family(['av01.0.08M.08']), 'av1')
+        self.assertIsNone(codec_family(['mp4a.40.2']))
+        self.assertIsNone(codec_family(None))
+    
+    def test_lookup_by_height(self):
+        table = {480: 'sd', 1080: 'hd'}
+        self.assertEqual(lookup_by_height(table, 360), 'sd')
+        self.assertEqual(lookup_by_height(table, 720), 'hd')
+        self.assertEqual(lookup_by_height(table, 2160), 'hd')
+    
+    def test_target_bitrate_by_height_codec_and_fps(self):
+        self.assertEqual(target_bitrate(source(height=1080), 'hevc'), 5_000_000)
+        self.assertEqual(target_bitrate(source(height=720), 'hevc'), 2_500_000)
+        # H.264 needs more bits than HEVC for the same quality
+        self.assertEqual(target_bitrate(source(height=1080), 'h264'), 7_500_000)
+        self.assertEqual(target_bitrate(source(height=1080, fps=60), 'hevc'), 7_500_000)
+        # Unknown heights are sized as 1080p
+        self.assertEqual(target_bitrate(source(height=None), 'hevc'), 5_000_000)
+    
+    def test_target_bitrate_capped_by_source(self):
+        # 1.5 Mbps of H.264 is worth 1 Mbps of HEVC, so spending 5 Mbps would only waste space
+        self.assertEqual(target_bitrate(source(bitrate=1_500_000), 'hevc'), 1_000_000)
+        self.assertEqual(target_bitrate(source(bitrate=20_000), 'hevc'), ENCODE_MIN_BITRATE)
+    
+    def test_rate_control_args_bitrate_backend(self):
+        args, bitrate = rate_control_args(backend('hevc_nvenc'), source(height=720))
+        self.assertEqual(bitrate, 2_500_000)
+        self.assertEqual(args[args.index('-b:v') + 1], '2500000')
+        self.assertEqual(args[args.index('-maxrate') + 1], '3750000')
+        self.assertEqual(args[args.index('-bufsize') + 1], '5000000')
+    
+    def test_rate_control_args_crf_backend(self):
+        args, _ = rate_control_args(backend('libx265'), source(height=2160))
+        self.assertEqual(args[args.index('-crf') + 1], '28')
+        args, _ = rate_control_args(backend('libx264'), source(height=1080))
+        self.assertEqual(args[args.index('-crf') + 1], '23')
+        self.assertIn('-maxrate', args)
+    
+    def test_remux_copies_compatible_sources(self):
+        plan = plan_video_encode('remux', source())
+        self.assertIsNone(plan['encoder'])
+        self.assertEqual(plan['args'], ['-c:v', 'copy'])
+    
+    def test_transcode_skips_sources_already_in_target_codec(self):
+        with mock.patch('wampytube_core.select_video_encoder', return_value=backend('libx265')):
+            plan = plan_video_encode('transcode', source('hvc1.1.6.L120.90', bitrate=4_000_000))
+            self.assertIsNone(plan['encoder'])
+            self.assertIn('already HEVC', plan['summary'])
+            
+            # Well above the target the encode still pays off
+            plan = plan_video_encode('transcode', source('hvc1.1.6.L120.90', bitrate=12_000_000))
+            self.assertEqual(plan['encoder']['name'], 'libx265')
+    
+    def test_transcode_encodes_other_codecs(self):
+        with mock.patch('wampytube_core.select_video_encoder', return_value=backend('hevc_nvenc')):
+            plan = plan_video_encode('transcode', source('avc1.640028', bitrate=3_000_000))
+        self.assertEqual(plan['codec'], 'hevc')
+        self.assertEqual(plan['args'][plan['args'].index('-b:v') + 1], '2000000')
+        self.assertEqual(plan['summary'], 'HEVC at 2.0 Mbps')
+    
+    def test_copy_backend_when_no_encoder_works(self):
+        with mock.patch('wampytube_core.select_video_encoder', return_value=backend('copy')):
+            plan = plan_video_encode('transcode', source('vp09.00.40.08'))
+        self.assertIsNone(plan['encoder'])
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
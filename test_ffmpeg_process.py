@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from wampytube_core import FFMPEG_PATH, FFMPEG_STDERR_LINES, FFmpegProcess
+
+# Test configuration
+TEST_TIMEOUT = 10  # Seconds a cancelled or stalled ffmpeg may take to stop
+
+PROGRESS_OUTPUT = """frame=48
+fps=24.00
+out_time_us=2000000
+out_time_ms=2000000
+speed=1.98x
+progress=continue
+frame=96
+fps=N/A
+out_time_us=N/A
+speed=N/A
+progress=continue
+frame=120
+fps=24.00
+out_time_us=5000000
+speed=2.01x
+progress=end
+"""
+
+STDERR_OUTPUT = """Input #0, mov,mp4,m4a,3gp,3g2,mj2, from 'video.mp4':
+  Duration: 00:01:02.50, start: 0.000000, bitrate: 2000 kb/s
+  Stream #0:0(und): Video: h264 (avc1 / 0x31637661), yuv420p, 1920x1080, 30 fps
+"""
+
+def has_ffmpeg():
+    try:
+        return subprocess.run([FFMPEG_PATH, '-version'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+    except OSError:
+        return False
+
+def generated_input(seconds, realtime=False):
+    """ffmpeg input arguments for a generated clip"""
+    return [*(['-re'] if realtime else []), '-f', 'lavfi', '-i', f'testsrc=duration={seconds}:size=64x48:rate=10']
+
+class FFmpegProcessTest(unittest.TestCase):
+    """FFmpegProcess progress parsing, stderr handling, cancellation and timeouts"""
+    
+    def runner(self, duration=None, stdout='', stderr=''):
+        """A runner reading canned output instead of a live ffmpeg"""
+        updates = []
+        runner = FFmpegProcess([FFMPEG_PATH], duration, updates.append)
+        runner.process = SimpleNamespace(stdout=io.StringIO(stdout), stderr=io.StringIO(stderr))
+        return runner, updates
+    
+    def test_parse_progress(self):
+        runner, _ = self.runner(duration=4)
+        progress = runner.parse_progress({'frame': '48', 'fps': '24.00', 'out_time_us': '2000000',
+                                          'speed': '1.98x', 'progress': 'continue'})
+        self.assertEqual(progress, {'frame': 48, 'fps': 24.0, 'speed': 1.98, 'seconds': 2.0,
+                                    'percent': 50.0, 'done': False})
+    
+    def test_parse_progress_unknowns(self):
+        runner, _ = self.runner()
+        progress = runner.parse_progress({'frame': '96', 'fps': 'N/A', 'out_time_us': 'N/A', 'progress': 'continue'})
+        self.assertIsNone(progress['fps'])
+        self.assertIsNone(progress['seconds'])
+        self.assertIsNone(progress['percent'])
+        
+        # Older builds only print out_time_ms, which also counts microseconds
+        progress = runner.parse_progress({'out_time_ms': '1500000', 'progress': 'continue'})
+        self.assertEqual(progress['seconds'], 1.5)
+    
+    def test_read_progress_blocks(self):
+        runner, updates = self.runner(duration=10, stdout=PROGRESS_OUTPUT)
+        runner.read_progress()
+        self.assertEqual([update['frame'] for update in updates], [48, 96, 120])
+        self.assertEqual(updates[0]['percent'], 20.0)
+        self.assertIsNone(updates[1]['percent'])
+        self.assertEqual(updates[2]['percent'], 100.0)
+        self.assertTrue(updates[2]['done'])
+        self.assertEqual(runner.progress, updates[-1])
+    
+    def test_duration_from_stderr(self):
+        runner, _ = self.runner(stderr=STDERR_OUTPUT)
+        runner.read_stderr()
+        self.assertEqual(runner.duration, 62.5)
+        self.assertIn('Duration: 00:01:02.50', runner.error_text())
+    
+    def test_given_duration_wins(self):
+        runner, _ = self.runner(duration=30, stderr=STDERR_OUTPUT)
+        runner.read_stderr()
+        self.assertEqual(runner.duration, 30)
+    
+    def test_stderr_tail_is_bounded(self):
+        lines = ''.join(f"line {number}\n" for number in range(FFMPEG_STDERR_LINES * 2))
+        runner, _ = self.runner(stderr=lines)
+        runner.read_stderr()
+        self.assertEqual(len(runner.stderr_tail), FFMPEG_STDERR_LINES)
+        self.assertEqual(runner.stderr_tail[-1], f"line {FFMPEG_STDERR_LINES * 2 - 1}")
+    
+    @unittest.skipUnless(has_ffmpeg(), "ffmpeg is not available")
+    def test_run_reports_progress(self):
+        folder = tempfile.mkdtemp(prefix='wampytube_test_')
+        self.addCleanup(shutil.rmtree, folder, ignore_errors=True)
+        clip = os.path.join(folder, 'clip.mp4')
+        subprocess.run([FFMPEG_PATH, '-v', 'error', *generated_input(2), clip], check=True)
+        
+        # The duration comes from ffmpeg's input summary
+        updates = []
+        runner = FFmpegProcess([FFMPEG_PATH, '-i', clip, '-f', 'null', '-'], on_progress=updates.append)
+        self.assertEqual(runner.run(), 0)
+        self.assertAlmostEqual(runner.duration, 2, delta=0.1)
+        self.assertTrue(updates[-1]['done'])
+        self.assertEqual(updates[-1]['percent'], 100.0)
+    
+    @unittest.skipUnless(has_ffmpeg(), "ffmpeg is not available")
+    def test_cancel(self):
+        cancel = threading.Event()
+        runner = FFmpegProcess([FFMPEG_PATH, *generated_input(60, realtime=True), '-f', 'null', '-'], cancel_event=cancel)
+        threading.Timer(0.5, cancel.set).start()
+        started = time.monotonic()
+        runner.run()
+        self.assertTrue(runner.cancelled)
+        self.assertFalse(runner.timed_out)
+        self.assertLess(time.monotonic() - started, TEST_TIMEOUT)
+    
+    @unittest.skipUnless(has_ffmpeg(), "ffmpeg is not available")
+    def test_timeout(self):
+        runner = FFmpegProcess([FFMPEG_PATH, *generated_input(60, realtime=True), '-f', 'null', '-'], timeout=0.5)
+        started = time.monotonic()
+        runner.run()
+        self.assertTrue(runner.timed_out)
+        self.assertLess(time.monotonic() - started, TEST_TIMEOUT)
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+from wampytube_bench import FixtureServer, RangeRequestHandler
+from wampytube_core import SegmentedDownloader, create_http_session
+
+# Test configuration
+TEST_FILE_SIZE = 1024 * 1024 + 1234  # Not a multiple of the segment size, so the last range is short
+TEST_SEGMENT_SIZE = 128 * 1024  # Small segments so a test file spans several ranges
+TEST_CONNECTIONS = 2
+TEST_ITAG = 137
+
+class FlakyHandler(RangeRequestHandler):
+    """Range-capable handler that can ignore ranges, fail requests or cut a response short"""
+    requests = None  # Range header of every request received, None for plain GETs
+    fail_after = None  # Answer 503 to every request after this many
+    fail_plain = False  # Answer 503 to requests without a Range header
+    ignore_range = False  # Serve the whole file with 200, like a server without range support
+    cut_after = None  # Drop the connection after sending this many body bytes, once
+    
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionError:
+            pass  # The downloader dropped the connection on purpose
+    
+    def do_GET(self):
+        # Read and update state on the server's handler class, the one the test holds
+        handler = self.server.RequestHandlerClass
+        handler.requests.append(self.headers.get('Range'))
+        if handler.fail_after is not None and len(handler.requests) > handler.fail_after:
+            self.send_error(503)
+            return
+        if handler.fail_plain and 'Range' not in self.headers:
+            self.send_error(503)
+            return
+        if handler.ignore_range:
+            del self.headers['Range']
+        if handler.cut_after is not None:
+            handler.cut_after, limit = None, handler.cut_after
+            self.wfile = CutWriter(self.wfile, limit)
+            self.close_connection = True
+        super().do_GET()
+
+class CutWriter:
+    """Socket writer that breaks the pipe after limit bytes"""
+    
+    def __init__(self, wfile, limit):
+        self.wfile = wfile
+        self.limit = limit
+    
+    def write(self, data):
+        if len(data) <= self.limit:
+            self.limit -= len(data)
+            return self.wfile.write(data)
+        self.wfile.write(data[:self.limit])
+        self.limit = 0
+        raise BrokenPipeError("Test connection cut")
+    
+    def flush(self):
+        self.wfile.flush()
+    
+    def close(self):
+        self.wfile.close()
+    
+    @property
+    def closed(self):
+        return self.wfile.closed
+
+class SegmentedDownloadTest(unittest.TestCase):
+    """SegmentedDownloader against a local server with HTTP range support"""
+    
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='wampytube_test_')
+        self.data = os.urandom(TEST_FILE_SIZE)
+        source = os.path.join(self.folder, 'source.bin')
+        with open(source, 'wb') as f:
+            f.write(self.data)
+        
+        # Each server gets its own handler class, so state never leaks between tests
+        self.server = FixtureServer(self.folder, FlakyHandler)
+        self.handler = self.server.handler
+        self.handler.requests = []
+        self.url = self.server.url(source)
+        self.path = os.path.join(self.folder, 'download.bin')
+    
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
+    
+    def downloader(self, connections=TEST_CONNECTIONS):
+        # No automatic retries, so injected failures reach the downloader
+        return SegmentedDownloader(connections, TEST_SEGMENT_SIZE, create_http_session(connections, retries=0))
+    
+    def download(self, connections=TEST_CONNECTIONS):
+        return self.downloader(connections).download(self.url, self.path, TEST_FILE_SIZE, itag=TEST_ITAG)
+    
+    def assertDownloaded(self):
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertTrue(self.downloader().is_complete(self.path, TEST_FILE_SIZE, TEST_ITAG))
+    
+    def read_manifest(self):
+        return self.downloader().read_manifest(self.path)
+    
+    def test_segmented_download(self):
+        progress = []
+        self.downloader().download(self.url, self.path, TEST_FILE_SIZE, progress.append, TEST_ITAG)
+        self.assertDownloaded()
+        self.assertEqual(progress[-1], TEST_FILE_SIZE)
+        ranges = -(-TEST_FILE_SIZE // TEST_SEGMENT_SIZE)
+        self.assertEqual(len(self.handler.requests), ranges)
+        self.assertTrue(all(header and header.startswith('bytes=') for header in self.handler.requests))
+    
+    def test_complete_download_is_reused(self):
+        self.download()
+        self.handler.requests.clear()
+        self.download()
+        self.assertEqual(self.handler.requests, [])
+    
+    def test_resume_from_manifest(self):
+        self.handler.fail_after = 3
+        with self.assertRaises(Exception):
+            self.download()
+        manifest = self.read_manifest()
+        self.assertIsNotNone(manifest)
+        self.assertFalse(manifest.get('complete'))
+        done = len(manifest['completed'])
+        self.assertGreater(done, 0)
+        
+        # Only the missing ranges are fetched again
+        self.handler.fail_after = None
+        self.handler.requests.clear()
+        self.download()
+        self.assertDownloaded()
+        ranges = -(-TEST_FILE_SIZE // TEST_SEGMENT_SIZE)
+        self.assertEqual(len(self.handler.requests), ranges - done)
+    
+    def test_range_ignored_falls_back_to_single(self):
+        self.handler.ignore_range = True
+        self.download()
+        self.assertDownloaded()
+        self.assertIn(None, self.handler.requests)
+    
+    def test_range_ignored_fallback_failure_leaves_no_zeros(self):
+        # The preallocated file must not pass for a finished download after the fallback fails
+        self.handler.ignore_range = True
+        self.handler.fail_plain = True
+        with self.assertRaises(Exception):
+            self.download()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(self.downloader().is_complete(self.path, TEST_FILE_SIZE, TEST_ITAG))
+        
+        self.handler.fail_plain = False
+        self.download()
+        self.assertDownloaded()
+    
+    def test_single_connection_resume(self):
+        self.handler.cut_after = 3 * TEST_SEGMENT_SIZE + 1000
+        with self.assertRaises(Exception):
+            self.download(connections=1)
+        manifest = self.read_manifest()
+        self.assertIsNotNone(manifest)
+        self.assertEqual(manifest['mode'], 'single')
+        resume_at = manifest['completed'][0][1] + 1
+        self.assertGreater(resume_at, 0)
+        
+        self.handler.requests.clear()
+        self.download(connections=1)
+        self.assertDownloaded()
+        self.assertEqual(self.handler.requests[0], f'bytes={resume_at}-')
+    
+    def test_single_resume_after_range_ignored_and_cut(self):
+        # A saved prefix must not survive a restart from byte 0, or a later resume leaves zeros behind
+        self.handler.cut_after = 3 * TEST_SEGMENT_SIZE + 1000
+        with self.assertRaises(Exception):
+            self.download(connections=1)
+        self.assertTrue(self.read_manifest()['completed'])
+        
+        self.handler.ignore_range = True
+        self.handler.cut_after = TEST_SEGMENT_SIZE // 2
+        with self.assertRaises(Exception):
+            self.download(connections=1)
+        self.assertEqual(self.read_manifest()['completed'], [])
+        
+        self.handler.ignore_range = False
+        self.handler.requests.clear()
+        self.download(connections=1)
+        self.assertDownloaded()
+        self.assertIsNone(self.handler.requests[0])
+    
+    def test_truncated_partial_is_not_resumed(self):
+        self.handler.cut_after = 3 * TEST_SEGMENT_SIZE + 1000
+        with self.assertRaises(Exception):
+            self.download(connections=1)
+        with open(self.path, 'r+b') as f:
+            f.truncate(TEST_SEGMENT_SIZE)
+        
+        self.handler.requests.clear()
+        self.download(connections=1)
+        self.assertDownloaded()
+        self.assertIsNone(self.handler.requests[0])
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
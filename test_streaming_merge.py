@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from wampytube_bench import FixtureServer, make_fixtures
+from wampytube_core import FFMPEG_PATH, HostLimiter, StreamingMerger, create_http_session, probe_video_source
+
+# Test configuration
+TEST_HEIGHT = 360  # Fixture rendition, small enough to render in a moment
+TEST_DURATION = 10  # Seconds of synthetic media
+TEST_SEGMENT_SIZE = 256 * 1024  # Ranges larger than a pipe buffer, so a feeder can block mid-range
+TEST_TIMEOUT = 60  # Seconds before a merge counts as deadlocked
+
+def has_ffmpeg():
+    try:
+        return subprocess.run([FFMPEG_PATH, '-version'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+    except OSError:
+        return False
+
+@unittest.skipUnless(has_ffmpeg() and StreamingMerger.supported(), "ffmpeg and named pipes are required")
+class StreamingMergeTest(unittest.TestCase):
+    """StreamingMerger feeding ffmpeg from a local range server"""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp(prefix='wampytube_test_')
+        fixtures = make_fixtures(cls.folder, TEST_HEIGHT, TEST_DURATION)
+        cls.video = fixtures[TEST_HEIGHT]['path']
+        cls.audio = fixtures['audio']['path']
+        cls.server = FixtureServer(cls.folder)
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+        shutil.rmtree(cls.folder, ignore_errors=True)
+    
+    def merge(self, output_path):
+        """Run a streaming merge on a thread, returning False if it doesn't finish in time"""
+        merger = StreamingMerger(TEST_SEGMENT_SIZE, create_http_session())
+        thread = threading.Thread(target=merger.merge, daemon=True, args=(
+            self.server.url(self.video), os.path.getsize(self.video),
+            self.server.url(self.audio), os.path.getsize(self.audio), output_path))
+        thread.start()
+        thread.join(TEST_TIMEOUT)
+        return not thread.is_alive()
+    
+    def test_merge(self):
+        output_path = os.path.join(self.folder, 'merged.mp4')
+        self.assertTrue(self.merge(output_path))
+        self.assertEqual(probe_video_source(output_path)['height'], TEST_HEIGHT)
+    
+    def test_merge_with_one_host_slot(self):
+        # A feeder blocked on its pipe must not hold the only slot its partner stream needs
+        output_path = os.path.join(self.folder, 'merged_one_slot.mp4')
+        with mock.patch('wampytube_core.HOST_LIMITER', HostLimiter(1)):
+            self.assertTrue(self.merge(output_path), "Streaming merge deadlocked on the host limit")
+        self.assertEqual(probe_video_source(output_path)['height'], TEST_HEIGHT)
+
+if __name__ == '__main__':
+    unittest.main()
\ No newline at end of file
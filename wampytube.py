@@ -1,122 +1,51 @@
 #!/usr/bin/env python3
 
 import customtkinter as ctk
-from pytubefix import YouTube
-import requests
-import threading
+import json
 import os
 import subprocess
-import re
-from pathlib import Path
 import logging
 import concurrent.futures
+import threading
 import time
-from functools import lru_cache
-import psutil
+import queue
 import sys
 from tkinter import filedialog
 from PIL import Image
 import tkinter as tk
+from wampytube_core import (
+    SCRIPT_DIR, SYSTEM_CORES, SYSTEM_THREADS, PROGRESS_LOG_STEP, OUTPUT_MODES, DEFAULT_OUTPUT_MODE,
+    GPU_PROBE, FFMPEG_PROBE, STARTUP_TIMER, DownloadEngine, JsonLinesSink, DownloadJob, DownloadQueue, ProgressAggregator,
+    choose_audio, choose_quality, format_bytes, format_duration, get_collection_type, get_data_dir, start_probes
+)
+
+STARTUP_TIMER.mark('gui_import')
 
 # Configure CustomTkinter
 ctk.set_appearance_mode("dark")  # Modes: "System" (standard), "Dark", "Light"
 ctk.set_default_color_theme("blue")  # Themes: "blue" (standard), "green", "dark-blue"
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Shared logger, configured in wampytube_core
 logger = logging.getLogger("WampyTube")
-logger.handlers = []
-logger.propagate = False
-
-# System resources configuration
-SYSTEM_CORES = psutil.cpu_count(logical=False) or 4
-SYSTEM_THREADS = psutil.cpu_count(logical=True) or 8
-DOWNLOAD_THREADS = min(4, SYSTEM_THREADS // 2)
-CPU_THREADS = SYSTEM_THREADS - 1
-
-# FFmpeg configuration
-SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-FFMPEG_PATH = os.path.join(SCRIPT_DIR, 'ffmpeg')
-
-# Check if our local ffmpeg exists
-if not os.path.exists(FFMPEG_PATH):
-    FFMPEG_PATH = 'ffmpeg'
-    logger.warning(f"Local ffmpeg not found in {SCRIPT_DIR}, using system ffmpeg")
-else:
-    logger.info(f"Using local ffmpeg from {SCRIPT_DIR}")
 
-# Check for GPU and hardware acceleration on macOS
-def check_macos_gpu():
-    """Check for GPU and VideoToolbox support on macOS"""
-    try:
-        result = subprocess.run(['system_profiler', 'SPDisplaysDataType'], 
-                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        
-        gpu_info = {'available': False, 'hevc_encoding': False, 'model': 'Unknown', 'videotoolbox': False}
-        
-        if result.returncode == 0:
-            output = result.stdout
-            
-            if 'AMD' in output or 'Radeon' in output:
-                if 'RX 6600' in output:
-                    gpu_info['model'] = 'AMD RX 6600'
-                elif 'Radeon' in output:
-                    gpu_info['model'] = 'AMD Radeon'
-                else:
-                    gpu_info['model'] = 'AMD GPU'
-                gpu_info['available'] = True
-            elif 'Intel' in output:
-                gpu_info['model'] = 'Intel GPU'
-                gpu_info['available'] = True
-            elif 'Apple' in output or 'M1' in output or 'M2' in output or 'M3' in output:
-                if 'M1' in output:
-                    gpu_info['model'] = 'Apple M1'
-                elif 'M2' in output:
-                    gpu_info['model'] = 'Apple M2'
-                elif 'M3' in output:
-                    gpu_info['model'] = 'Apple M3'
-                else:
-                    gpu_info['model'] = 'Apple Silicon'
-                gpu_info['available'] = True
-                gpu_info['hevc_encoding'] = True
-        
-        gpu_info['videotoolbox'] = True
-        if gpu_info['available']:
-            gpu_info['hevc_encoding'] = True
-        
-        return gpu_info
-        
-    except Exception as e:
-        logger.error(f"Error checking macOS GPU: {e}")
-        return {'model': 'Unknown', 'available': False, 'hevc_encoding': False, 'videotoolbox': False}
+# Activity log configuration
+LOG_MAX_LINES = 1000  # Lines kept in the activity log widget
+LOG_FLUSH_INTERVAL = 100  # Milliseconds between activity log flushes
 
-# Get hardware acceleration information
-MACOS_GPU = check_macos_gpu()
-logger.info(f"Detected GPU: {MACOS_GPU}")
+# Progress reporting configuration
+PROGRESS_FPS = 10  # UI progress refreshes per second
 
-# Check FFmpeg capabilities
-def check_ffmpeg():
-    """Check FFmpeg version and available encoders"""
-    try:
-        version_result = subprocess.run([FFMPEG_PATH, '-version'], 
-                                      stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        
-        if version_result.returncode != 0:
-            return {'available': False}
-        
-        version_match = re.search(r'ffmpeg version ([^ ]+)', version_result.stdout)
-        version = version_match.group(1) if version_match else "Unknown"
-        
-        return {
-            'available': True,
-            'version': version
-        }
-    except Exception as e:
-        logger.error(f"Error checking FFmpeg: {e}")
-        return {'available': False}
+# Settings configuration
+SETTINGS_FILENAME = 'settings.json'  # Preferences kept between sessions, in the data directory
 
-FFMPEG_INFO = check_ffmpeg()
-logger.info(f"FFmpeg information: {FFMPEG_INFO}")
+# Speed limit choices shown in the options, in bytes per second
+SPEED_LIMITS = {
+    "Unlimited": 0,
+    "1 MB/s": 1024 * 1024,
+    "5 MB/s": 5 * 1024 * 1024,
+    "10 MB/s": 10 * 1024 * 1024,
+    "25 MB/s": 25 * 1024 * 1024
+}
 
 # Global variables for progress tracking
 current_download = {
@@ -134,14 +63,47 @@ class WampyTubeApp(ctk.CTk):
         # Set application name for macOS menu bar (must be done early)
         self.set_app_name()
         
+        # Hardware and ffmpeg probes run in the background instead of delaying the window
+        start_probes()
+        
         # Configure window
         self.title("WampyTube")
-        self.geometry("800x800")  # Increased default height
-        self.minsize(700, 700)    # Increased minimum height
+        self.geometry("800x950")  # Room for the download queue
+        self.minsize(700, 800)    # Increased minimum height
         
         # Track if video info is shown to adjust window size
         self.video_info_shown = False
         
+        # Log messages from any thread are queued and flushed on the main loop
+        self.log_queue = queue.Queue()
+        
+        # Download queue and per-job widgets
+        self.download_queue = DownloadQueue(self.download_in_thread)
+        self.job_rows = {}
+        self.analyzed_url = None
+        
+        # Jobs resolved by playlist/channel batches, added to the queue on the main loop
+        self.batch_jobs = queue.Queue()
+        # Finished analyses as (future, url, generation), shown on the main loop
+        self.finished_analyses = queue.Queue()
+        self.progress_aggregator = ProgressAggregator()
+        
+        # Downloads, stream selection and merging run in the GUI-free engine
+        self.engine = DownloadEngine(log=self.log_message, on_update=self.progress_aggregator.update)
+        # Preferences from earlier sessions
+        self.settings = self.load_settings()
+        self.apply_settings()
+        # Phase timings for every job go to metrics.jsonl next to wampytube.log
+        try:
+            self.engine.tracer.add_sink(JsonLinesSink())
+        except Exception as e:
+            logger.warning(f"Metrics log unavailable: {e}")
+        
+        # Background metadata resolution; only the newest request is shown
+        self.analysis_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="metadata")
+        self.analysis_generation = 0
+        self.analysis_future = None
+        
         # Set icon if available
         self.set_app_icon()
         
@@ -154,6 +116,20 @@ class WampyTubeApp(ctk.CTk):
         # Detect system theme
         self.detect_system_theme()
         
+        # Start polling job progress at a fixed frame rate
+        self.after(1000 // PROGRESS_FPS, self.poll_progress)
+        
+        # Start flushing queued log messages into the activity log
+        self.after(LOG_FLUSH_INTERVAL, self.flush_log)
+        
+        STARTUP_TIMER.mark('window_created')
+        self.after_idle(self.report_startup)
+        
+    def report_startup(self):
+        """Record the first idle main loop iteration and write the startup timing report"""
+        STARTUP_TIMER.mark('first_idle')
+        STARTUP_TIMER.report('gui')
+    
     def create_menu_bar(self):
         """Create custom menu bar with About dialog"""
         try:
@@ -182,8 +158,11 @@ class WampyTubeApp(ctk.CTk):
             file_menu = tk.Menu(menubar, tearoff=0)
             menubar.add_cascade(label="File", menu=file_menu)
             file_menu.add_command(label="Select Output Folder...", command=self.select_output_folder, accelerator="Cmd+O")
+            file_menu.add_command(label="Select Scratch Folder...", command=self.select_scratch_folder)
+            file_menu.add_command(label="Use Output Folder for Partial Downloads", command=lambda: self.set_scratch_folder(None))
             file_menu.add_separator()
             file_menu.add_command(label="Clear Log", command=self.clear_log)
+            file_menu.add_command(label="Rebuild Download Archive", command=self.rebuild_archive)
             
             # Create Edit menu
             edit_menu = tk.Menu(menubar, tearoff=0)
@@ -289,12 +268,12 @@ class WampyTubeApp(ctk.CTk):
                                       font=ctk.CTkFont(size=14, weight="bold"))
             system_title.pack(pady=(12, 8))
             
-            # Truncate long GPU names
-            gpu_name = MACOS_GPU['model']
+            # Truncate long GPU names; don't hold the dialog up on a probe that is still running
+            gpu_name = GPU_PROBE.result(timeout=1)['model']
             if len(gpu_name) > 25:
                 gpu_name = gpu_name[:22] + "..."
             
-            ffmpeg_version = FFMPEG_INFO.get('version', 'Not found')
+            ffmpeg_version = FFMPEG_PROBE.result(timeout=1).get('version', 'Not found')
             if len(ffmpeg_version) > 25:
                 ffmpeg_version = ffmpeg_version[:22] + "..."
             
@@ -355,7 +334,10 @@ FFmpeg: {ffmpeg_version}"""
             # Clear stored data
             self.available_streams = {}
             self.available_audio = {}
-            self.current_video = None
+            self.current_metadata = None
+            self.analyzed_url = None
+            # Drop results of any analysis still in flight
+            self.analysis_generation += 1
         except Exception as e:
             logger.error(f"Failed to clear URL: {e}")
     
@@ -372,10 +354,10 @@ FFmpeg: {ffmpeg_version}"""
             # Calculate required height based on content
             if self.video_info_shown:
                 # When video info is shown, we need more height
-                target_height = max(850, current_height)
+                target_height = max(1000, current_height)
             else:
                 # When video info is hidden, we can use original height
-                target_height = 800
+                target_height = 950
             
             # Only adjust if there's a significant difference
             if abs(current_height - target_height) > 30:
@@ -478,15 +460,10 @@ FFmpeg: {ffmpeg_version}"""
                 logger.error(f"Fallback icon method also failed: {fallback_error}")
     
     def detect_system_theme(self):
-        """Detect if macOS is using dark mode"""
-        try:
-            result = subprocess.run(['defaults', 'read', '-g', 'AppleInterfaceStyle'], 
-                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            if result.returncode == 0:
-                ctk.set_appearance_mode("dark")
-            else:
-                ctk.set_appearance_mode("light")
-        except:
+        """Follow the macOS appearance through CustomTkinter's own detection instead of forking `defaults`"""
+        if sys.platform == 'darwin':
+            ctk.set_appearance_mode("system")
+        else:
             ctk.set_appearance_mode("dark")
     
     def create_widgets(self):
@@ -551,10 +528,29 @@ FFmpeg: {ffmpeg_version}"""
         self.audio_selector = ctk.CTkComboBox(audio_section, width=200, state="readonly")
         self.audio_selector.pack(fill="x")
         
+        # Output Mode Section (Below)
+        mode_section = ctk.CTkFrame(options_frame, fg_color="transparent")
+        mode_section.pack(fill="x", padx=15, pady=(0, 15))
+        
+        mode_label = ctk.CTkLabel(mode_section, text="Output Mode:", font=ctk.CTkFont(size=13, weight="bold"))
+        mode_label.pack(side="left", padx=(0, 10))
+        
+        self.mode_selector = ctk.CTkComboBox(mode_section, width=220, state="readonly", values=list(OUTPUT_MODES))
+        self.mode_selector.pack(side="left")
+        self.mode_selector.set(next(label for label, mode in OUTPUT_MODES.items() if mode == DEFAULT_OUTPUT_MODE))
+        
+        self.speed_selector = ctk.CTkComboBox(mode_section, width=130, state="readonly", values=list(SPEED_LIMITS),
+                                              command=self.on_speed_limit_change)
+        self.speed_selector.pack(side="right")
+        self.speed_selector.set("Unlimited")
+        
+        speed_label = ctk.CTkLabel(mode_section, text="Speed Limit:", font=ctk.CTkFont(size=13, weight="bold"))
+        speed_label.pack(side="right", padx=(0, 10))
+        
         # Store available streams for later use
         self.available_streams = {}
         self.available_audio = {}
-        self.current_video = None
+        self.current_metadata = None
         
         # Output Folder Section
         folder_frame = ctk.CTkFrame(main_container)
@@ -596,6 +592,16 @@ FFmpeg: {ffmpeg_version}"""
         self.progress_label = ctk.CTkLabel(progress_frame, text="", font=ctk.CTkFont(size=12))
         self.progress_label.pack(padx=15, pady=(0, 15))
         
+        # Download Queue Section
+        queue_frame = ctk.CTkFrame(main_container)
+        queue_frame.pack(fill="x", pady=(0, 15))
+        
+        queue_label = ctk.CTkLabel(queue_frame, text="Download Queue", font=ctk.CTkFont(size=14, weight="bold"))
+        queue_label.pack(anchor="w", padx=15, pady=(15, 5))
+        
+        self.queue_list = ctk.CTkScrollableFrame(queue_frame, height=130)
+        self.queue_list.pack(fill="x", padx=15, pady=(0, 15))
+        
         # Activity Log Section
         log_frame = ctk.CTkFrame(main_container)
         log_frame.pack(fill="both", expand=True)
@@ -612,8 +618,11 @@ FFmpeg: {ffmpeg_version}"""
         
         # Initial log messages
         self.log_message("WampyTube initialized successfully", "success")
-        self.log_message(f"System: {MACOS_GPU['model']} • {SYSTEM_CORES} cores, {SYSTEM_THREADS} threads")
-        self.log_message(f"FFmpeg: {FFMPEG_INFO.get('version', 'Not found')}")
+        # Probe results arrive from background threads once they finish
+        GPU_PROBE.add_done_callback(
+            lambda gpu: self.log_message(f"System: {gpu['model']} • {SYSTEM_CORES} cores, {SYSTEM_THREADS} threads"))
+        FFMPEG_PROBE.add_done_callback(
+            lambda info: self.log_message(f"FFmpeg: {info.get('version', 'Not found')}"))
     
     def log_message(self, message, level="info"):
         """Add message to activity log"""
@@ -629,13 +638,36 @@ FFmpeg: {ffmpeg_version}"""
         
         formatted_message = f"[{timestamp}] {icon} {message}\n"
         
-        # Add to text widget
-        self.log_text.insert("end", formatted_message)
-        self.log_text.see("end")
+        # Queue for the text widget, this may be called from worker threads
+        self.log_queue.put(formatted_message)
         
-        # Also log to console
+        # Also log to console and the log file
         logger.info(f"{icon} {message}")
     
+    def flush_log(self):
+        """Insert queued log messages in one batch and trim the widget to LOG_MAX_LINES"""
+        try:
+            messages = []
+            while True:
+                try:
+                    messages.append(self.log_queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            if messages:
+                self.log_text.insert("end", "".join(messages))
+                
+                # Drop the oldest lines so redraws stay fast in long sessions
+                line_count = int(self.log_text.index("end-1c").split(".")[0])
+                if line_count > LOG_MAX_LINES:
+                    self.log_text.delete("1.0", f"{line_count - LOG_MAX_LINES + 1}.0")
+                
+                self.log_text.see("end")
+        except Exception as e:
+            logger.error(f"Failed to flush activity log: {e}")
+        finally:
+            self.after(LOG_FLUSH_INTERVAL, self.flush_log)
+    
     def paste_from_clipboard(self):
         """Paste clipboard content into URL field"""
         try:
@@ -649,6 +681,23 @@ FFmpeg: {ffmpeg_version}"""
         except:
             pass
     
+    def rebuild_archive(self):
+        """Rescan the output folder for tagged downloads in the background"""
+        folder = self.output_entry.get().strip()
+        if not self.engine.archive or not os.path.isdir(folder):
+            self.log_message("Select an existing output folder to rebuild the download archive", "warning")
+            return
+        
+        def rebuild():
+            try:
+                count = self.engine.archive.rebuild(folder)
+                self.log_message(f"Download archive rebuilt: {count} video(s) found in {folder}", "success")
+            except Exception as e:
+                self.log_message(f"Failed to rebuild download archive: {str(e)}", "error")
+        
+        self.log_message(f"Rebuilding download archive from {folder}...")
+        threading.Thread(target=rebuild, name="archive-rebuild", daemon=True).start()
+    
     def select_output_folder(self):
         """Open dialog to select output folder"""
         folder_selected = filedialog.askdirectory()
@@ -656,409 +705,366 @@ FFmpeg: {ffmpeg_version}"""
             self.output_entry.delete(0, "end")
             self.output_entry.insert(0, folder_selected)
     
+    def select_scratch_folder(self):
+        """Choose a fast folder for partial downloads of jobs that start from now on"""
+        folder_selected = filedialog.askdirectory(title="Scratch folder for partial downloads")
+        if folder_selected:
+            self.set_scratch_folder(folder_selected)
+    
+    def set_scratch_folder(self, folder):
+        """Keep partial downloads of new jobs in folder, or in the output folder for None, and remember the choice"""
+        self.engine.scratch_dir = folder
+        self.settings['scratch_dir'] = folder
+        self.save_settings()
+        if folder:
+            self.log_message(f"Partial downloads of new jobs will be kept in {folder}")
+        else:
+            self.log_message("Partial downloads of new jobs will be kept in the output folder")
+    
+    @staticmethod
+    def settings_path():
+        return os.path.join(get_data_dir(), SETTINGS_FILENAME)
+    
+    def load_settings(self):
+        """Read saved preferences, or none when the file is missing or unreadable"""
+        try:
+            with open(self.settings_path(), 'r') as f:
+                settings = json.load(f)
+            return settings if isinstance(settings, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable settings: {e}")
+            return {}
+    
+    def save_settings(self):
+        """Atomically write the preferences for the next session"""
+        try:
+            path = self.settings_path()
+            temp_file = f"{path}.tmp"
+            with open(temp_file, 'w') as f:
+                json.dump(self.settings, f, indent=2)
+            os.replace(temp_file, path)
+        except OSError as e:
+            logger.warning(f"Could not save settings: {e}")
+    
+    def apply_settings(self):
+        """Apply saved preferences to the engine; a saved choice overrides WAMPYTUBE_SCRATCH_DIR"""
+        if 'scratch_dir' in self.settings:
+            folder = self.settings['scratch_dir']
+            if folder and not os.path.isdir(folder):
+                logger.warning(f"Saved scratch folder {folder} is missing, keeping partial downloads in the output folder")
+                folder = None
+            self.engine.scratch_dir = folder
+    
     def analyze_url(self):
-        """Analyze YouTube URL and show video info"""
+        """Resolve video info in the background, keeping only the latest request"""
         url = self.url_entry.get().strip()
         if not url:
             return
         
+        # A newer paste supersedes any analysis still queued or running
+        self.analysis_generation += 1
+        generation = self.analysis_generation
+        if self.analysis_future:
+            self.analysis_future.cancel()
+        
+        # Playlists, channels and URL lists are expanded and resolved when they are queued
+        if len(url.split()) > 1:
+            self.log_message(f"{len(url.split())} URLs entered, click Download to queue them all")
+            return
+        collection_type = get_collection_type(url)
+        if collection_type:
+            self.log_message(f"{collection_type.capitalize()} URL detected, click Download to queue all of its videos")
+            return
+        
+        # Previously seen videos are shown straight from the on-disk cache
+        metadata = self.engine.cached_metadata(url)
+        if metadata:
+            self.show_metadata(metadata, url)
+            self.log_message(f"Loaded from cache: {metadata['title']}", "success")
+            return
+        
+        self.log_message("Analyzing video streams...")
+        future = self.analysis_executor.submit(self.engine.resolve_metadata, url,
+                                               lambda: self.is_stale_analysis(generation))
+        # Done callbacks run on the executor thread, which must not touch Tk
+        future.add_done_callback(lambda done: self.finished_analyses.put((done, url, generation)))
+        self.analysis_future = future
+    
+    def is_stale_analysis(self, generation):
+        """True when a newer analysis request has been made"""
+        return generation != self.analysis_generation
+    
+    def on_analysis_done(self, future, url, generation):
+        """Show analysis results on the main thread unless a newer request replaced them"""
+        if future.cancelled() or self.is_stale_analysis(generation):
+            return
+        
         try:
-            self.log_message("Analyzing video streams...")
-            yt = YouTube(url, use_oauth=False, allow_oauth_cache=True)
-            yt.check_availability()
-            
-            # Store current video for later use
-            self.current_video = yt
-            
-            # Update video info display
-            title_text = yt.title[:60] + "..." if len(yt.title) > 60 else yt.title
-            self.video_title_label.configure(text=title_text)
-            self.video_duration_label.configure(text=f"⏱️ {self.format_duration(yt.length)}")
-            
-            # Get all available streams
-            self.populate_quality_options(yt)
-            self.populate_audio_options(yt)
-            
-            # Show video info frame
-            self.video_info_frame.pack(fill="x", pady=(0, 15), after=self.children['!ctkframe'].children['!ctkframe'])
-            
-            # Adjust window size if needed
-            if not self.video_info_shown:
-                self.video_info_shown = True
-                self.after(100, self.adjust_window_size)  # Small delay to let the UI update
-            
-            self.log_message(f"Analyzed: {yt.title}", "success")
+            metadata = future.result()
         except Exception as e:
             self.log_message(f"Failed to analyze URL: {str(e)}", "error")
+            return
+        
+        if metadata is None:
+            return
+        
+        self.show_metadata(metadata, url)
+        self.log_message(f"Analyzed: {metadata['title']}", "success")
+    
+    def show_metadata(self, metadata, url):
+        """Display resolved video info and stream options"""
+        # Store current video for later use
+        self.current_metadata = metadata
+        self.analyzed_url = url
+        
+        # Update video info display
+        title = metadata['title']
+        title_text = title[:60] + "..." if len(title) > 60 else title
+        self.video_title_label.configure(text=title_text)
+        self.video_duration_label.configure(text=f"⏱️ {format_duration(metadata['length'])}")
+        
+        # Show all available streams
+        self.populate_quality_options(metadata['quality_options'], metadata['stream_map'])
+        self.populate_audio_options(metadata['audio_options'], metadata['audio_map'])
+        
+        # Show video info frame
+        self.video_info_frame.pack(fill="x", pady=(0, 15), after=self.children['!ctkframe'].children['!ctkframe'])
+        
+        # Adjust window size if needed
+        if not self.video_info_shown:
+            self.video_info_shown = True
+            self.after(100, self.adjust_window_size)  # Small delay to let the UI update
     
-    def populate_quality_options(self, yt):
+    def populate_quality_options(self, sorted_resolutions, stream_map):
         """Populate quality selector with available resolutions"""
-        try:
-            # Get all video streams (both progressive and adaptive)
-            progressive_streams = yt.streams.filter(progressive=True, file_extension="mp4").order_by("resolution").desc()
-            adaptive_streams = yt.streams.filter(adaptive=True, only_video=True, file_extension="mp4").order_by("resolution").desc()
-            
-            # Collect unique resolutions
-            resolutions = set()
-            stream_map = {}
-            
-            # Add progressive streams
-            for stream in progressive_streams:
-                if stream.resolution:
-                    res_key = f"{stream.resolution} (Progressive)"
-                    resolutions.add(res_key)
-                    stream_map[res_key] = {'type': 'progressive', 'stream': stream}
-            
-            # Add adaptive streams (higher quality)
-            for stream in adaptive_streams:
-                if stream.resolution:
-                    res_key = f"{stream.resolution} (Best Quality)"
-                    resolutions.add(res_key)
-                    stream_map[res_key] = {'type': 'adaptive', 'stream': stream}
-            
-            # Sort resolutions by quality (descending)
-            sorted_resolutions = sorted(list(resolutions), key=lambda x: int(x.split('p')[0]), reverse=True)
-            
-            # Update selector
-            self.quality_selector.configure(values=sorted_resolutions)
-            if sorted_resolutions:
-                self.quality_selector.set(sorted_resolutions[0])  # Select highest quality by default
-            
-            # Store stream mapping
-            self.available_streams = stream_map
-            
-            self.log_message(f"Found {len(sorted_resolutions)} quality options")
-            
-        except Exception as e:
-            self.log_message(f"Error getting quality options: {str(e)}", "error")
-            self.quality_selector.configure(values=["Best Available"])
-            self.quality_selector.set("Best Available")
+        self.quality_selector.configure(values=sorted_resolutions)
+        if sorted_resolutions:
+            # Same default the command line applies: highest resolution, adaptive first
+            self.quality_selector.set(choose_quality(sorted_resolutions, stream_map) or sorted_resolutions[0])
+        
+        # Store stream mapping
+        self.available_streams = stream_map
+        
+        self.log_message(f"Found {len(stream_map)} quality options")
     
-    def populate_audio_options(self, yt):
+    def populate_audio_options(self, audio_options, audio_map):
         """Populate audio selector with available languages"""
-        try:
-            # Language code to name mapping
-            language_names = {
-                'en': 'English',
-                'es': 'Spanish', 
-                'es-ES': 'Spanish',
-                'es-419': 'Spanish (Latin America)',
-                'fr': 'French',
-                'de': 'German',
-                'it': 'Italian',
-                'pt': 'Portuguese',
-                'pt-BR': 'Portuguese (Brazil)',
-                'ru': 'Russian',
-                'ja': 'Japanese',
-                'ko': 'Korean',
-                'zh': 'Chinese',
-                'zh-CN': 'Chinese (Simplified)',
-                'zh-TW': 'Chinese (Traditional)',
-                'ar': 'Arabic',
-                'hi': 'Hindi',
-                'tr': 'Turkish',
-                'pl': 'Polish',
-                'nl': 'Dutch',
-                'sv': 'Swedish',
-                'da': 'Danish',
-                'no': 'Norwegian',
-                'fi': 'Finnish'
-            }
-            
-            audio_options = []
-            audio_map = {}
-            
-            # Try to get language info from video metadata first
-            try:
-                # Access the video's raw data to get language information
-                if hasattr(yt, 'vid_info') and yt.vid_info:
-                    # Look for adaptive formats which might have language info
-                    adaptive_formats = yt.vid_info.get('streamingData', {}).get('adaptiveFormats', [])
-                    
-                    for fmt in adaptive_formats:
-                        if fmt.get('mimeType', '').startswith('audio/'):
-                            lang_code = fmt.get('languageCode', '').lower()
-                            quality = fmt.get('averageBitrate', 0)
-                            quality_str = f"{quality//1000}kbps" if quality > 0 else "Unknown"
-                            
-                            if lang_code and lang_code in language_names:
-                                lang_name = language_names[lang_code]
-                                label = f"{lang_name} ({quality_str})"
-                                
-                                # Create a corresponding stream object
-                                audio_streams = yt.streams.filter(only_audio=True, file_extension="mp4")
-                                if audio_streams:
-                                    # Match by quality or use best available
-                                    matching_stream = None
-                                    for stream in audio_streams:
-                                        if stream.abr and quality_str in stream.abr:
-                                            matching_stream = stream
-                                            break
-                                    
-                                    if not matching_stream:
-                                        matching_stream = audio_streams.order_by("abr").desc().first()
-                                    
-                                    if matching_stream and label not in [opt for opt in audio_options]:
-                                        audio_options.append(label)
-                                        audio_map[label] = matching_stream
-            except Exception as e:
-                self.log_message(f"Could not extract language info from metadata: {str(e)}", "warning")
-            
-            # If no languages found from metadata, fall back to stream analysis
-            if not audio_options:
-                audio_streams = yt.streams.filter(only_audio=True, file_extension="mp4").order_by("abr").desc()
-                
-                # Try to detect language from video title or description
-                detected_lang = self.detect_video_language(yt)
-                
-                for i, stream in enumerate(audio_streams[:3]):  # Limit to top 3
-                    quality = stream.abr or 'Unknown'
-                    
-                    if i == 0 and detected_lang:
-                        # Use detected language for the first (best quality) stream
-                        lang_name = language_names.get(detected_lang, detected_lang.upper())
-                        label = f"{lang_name} ({quality})"
-                    elif i == 0:
-                        label = f"Default ({quality})"
-                    else:
-                        label = f"Alternative {i} ({quality})"
-                    
-                    audio_options.append(label)
-                    audio_map[label] = stream
-            
-            # Update selector
-            self.audio_selector.configure(values=audio_options)
-            if audio_options:
-                self.audio_selector.set(audio_options[0])  # Select best quality by default
-            
-            # Store audio mapping
-            self.available_audio = audio_map
-            
-            self.log_message(f"Found {len(audio_options)} audio tracks")
-            
-        except Exception as e:
-            self.log_message(f"Error getting audio options: {str(e)}", "error")
-            self.audio_selector.configure(values=["Default Audio"])
-            self.audio_selector.set("Default Audio")
-    
-    def detect_video_language(self, yt):
-        """Try to detect video language from title, description, or channel"""
-        try:
-            # Simple language detection based on common patterns
-            title = yt.title.lower() if yt.title else ""
-            description = yt.description.lower() if yt.description else ""
-            
-            # Spanish indicators
-            spanish_words = ['español', 'spanish', 'latino', 'castellano', 'méxico', 'argentina', 'colombia']
-            if any(word in title or word in description for word in spanish_words):
-                return 'es'
-            
-            # English is default for most content
-            return 'en'
-            
-        except Exception:
-            return 'en'  # Default to English
-    
-    def format_duration(self, seconds):
-        """Format duration in seconds to readable string"""
-        if not seconds:
-            return "Unknown"
-        
-        hours = seconds // 3600
-        minutes = (seconds % 3600) // 60
-        secs = seconds % 60
-        
-        if hours > 0:
-            return f"{hours}h {minutes}m {secs}s"
-        elif minutes > 0:
-            return f"{minutes}m {secs}s"
-        else:
-            return f"{secs}s"
+        self.audio_selector.configure(values=audio_options)
+        if audio_options:
+            self.audio_selector.set(choose_audio(audio_options, audio_map) or audio_options[0])  # Best quality by default
+        
+        # Store audio mapping
+        self.available_audio = audio_map
+        
+        self.log_message(f"Found {len(audio_map)} audio tracks")
     
     def update_progress(self, percentage, message=""):
         """Update progress bar and label"""
         self.progress_bar.set(percentage / 100)
         self.progress_label.configure(text=message)
-        if percentage % 10 == 0:  # Log every 10%
-            self.log_message(f"Progress: {percentage:.0f}% - {message}")
     
     def download_video(self):
-        """Start video download in separate thread"""
-        url = self.url_entry.get().strip()
+        """Add the current URL, or every video behind playlist/channel/multiple URLs, to the download queue"""
+        urls = self.url_entry.get().split()
         output_folder = self.output_entry.get().strip()
         
-        if not url:
+        if not urls:
             self.log_message("Please enter a valid URL", "error")
             return
         if not output_folder:
             self.log_message("Please select an output folder", "error")
             return
         
-        # Disable download button
-        self.download_button.configure(state="disabled")
-        self.status_label.configure(text="Downloading...")
+        output_mode = OUTPUT_MODES.get(self.mode_selector.get(), DEFAULT_OUTPUT_MODE)
+        if len(urls) > 1 or get_collection_type(urls[0]):
+            quality, language = self.selection_policy()
+            self.log_message(f"Resolving videos for {len(urls)} URL(s)...")
+            threading.Thread(target=self.queue_batch, args=(urls, output_folder, output_mode, quality, language),
+                             name="batch", daemon=True).start()
+            return
         
-        # Start download in thread
-        thread = threading.Thread(target=self.download_in_thread, args=(url, output_folder))
-        thread.daemon = True
-        thread.start()
+        url = urls[0]
+        # Snapshot the current selection so later changes don't affect this job
+        video_choice = None
+        audio_choice = None
+        title = None
+        if url == self.analyzed_url and self.current_metadata:
+            video_choice = self.available_streams.get(self.quality_selector.get())
+            audio_choice = self.available_audio.get(self.audio_selector.get())
+            title = self.current_metadata['title']
+        
+        job = DownloadJob(url, output_folder, video_choice, audio_choice, title, output_mode)
+        self.add_job_row(job)
+        self.download_queue.submit(job)
+        self.log_message(f"Queued: {job.title}")
+        self.refresh_queue_status()
     
-    def download_in_thread(self, url, output_folder):
-        """Handle the download in a separate thread"""
-        try:
-            self.log_message("Starting download process...")
-            
-            # Create output directory if needed
-            os.makedirs(output_folder, exist_ok=True)
-            
-            # Get YouTube object
-            yt = YouTube(url, on_progress_callback=self.on_download_progress, use_oauth=False, allow_oauth_cache=True)
-            yt.check_availability()
-            
-            # Get selected streams
-            self.log_message("Preparing selected streams...")
-            video_stream, audio_stream, needs_merge = self.get_selected_streams(yt)
-            
-            if not video_stream:
-                raise Exception("No suitable stream found")
-            
-            resolution = video_stream.resolution
-            self.log_message(f"Best quality found: {resolution}")
-            
-            if needs_merge:
-                # Download video and audio separately
-                self.after(0, lambda: self.status_label.configure(text=f"Downloading video ({resolution})..."))
-                video_path = video_stream.download(output_folder, filename_prefix="video_")
-                
-                self.after(0, lambda: self.status_label.configure(text="Downloading audio..."))
-                audio_path = audio_stream.download(output_folder, filename_prefix="audio_")
-                
-                # Merge with ffmpeg
-                self.after(0, lambda: self.status_label.configure(text="Encoding with VideoToolbox..."))
-                final_path = Path(video_path).parent / f"{Path(video_path).stem.replace('video_', '')}_HEVC.mp4"
-                
-                success = self.merge_audio_video(video_path, audio_path, str(final_path))
-                
-                if success:
-                    # Clean up temp files
-                    os.remove(video_path)
-                    os.remove(audio_path)
-                    self.log_message(f"Download complete! Saved to: {final_path.name}", "success")
-                else:
-                    raise Exception("Failed to merge audio and video")
-            else:
-                # Direct download
-                final_path = video_stream.download(output_folder)
-                self.log_message(f"Download complete! Saved to: {Path(final_path).name}", "success")
-            
-            # Update UI
-            self.after(0, lambda: self.download_complete())
-            
-        except Exception as e:
-            self.log_message(f"Download failed: {str(e)}", "error")
-            self.after(0, lambda: self.download_failed())
+    def selection_policy(self):
+        """Turn the analyzed video's selectors into (quality, audio language) rules for batch entries"""
+        if not self.current_metadata:
+            return 'best', None
+        
+        # Keeping the default pick means "best" for every entry rather than this video's resolution
+        quality = 'best'
+        quality_label = self.quality_selector.get()
+        if quality_label in self.available_streams and \
+                quality_label != choose_quality(self.current_metadata['quality_options'], self.available_streams):
+            quality = self.available_streams[quality_label]['resolution']
+        
+        audio_choice = self.available_audio.get(self.audio_selector.get()) or {}
+        return quality, audio_choice.get('language')
     
-    def get_selected_streams(self, yt):
-        """Get streams based on user selection"""
+    def queue_batch(self, urls, output_folder, output_mode, quality, language):
+        """Resolve batch entries on a worker thread, handing each job to the main loop as it resolves"""
+        count = 0
         try:
-            selected_quality = self.quality_selector.get()
-            selected_audio = self.audio_selector.get()
-            
-            # Get video stream based on selection
-            if selected_quality in self.available_streams:
-                stream_info = self.available_streams[selected_quality]
-                video_stream = stream_info['stream']
-                needs_merge = stream_info['type'] == 'adaptive'
-            else:
-                # Fallback to best available
-                video_stream = yt.streams.get_highest_resolution()
-                needs_merge = False
-            
-            # Get audio stream based on selection
-            audio_stream = None
-            if needs_merge or selected_quality == "Best Available":
-                if hasattr(self, 'available_audio') and selected_audio in self.available_audio:
-                    audio_stream = self.available_audio[selected_audio]
-                else:
-                    # Fallback to best audio
-                    audio_stream = yt.streams.filter(only_audio=True, file_extension="mp4")\
-                                        .order_by("abr").desc().first()
-                needs_merge = True
-            
-            return video_stream, audio_stream, needs_merge
-            
+            for job in self.engine.resolve_jobs(urls, output_folder, output_mode, quality, language):
+                self.batch_jobs.put(job)
+                count += 1
         except Exception as e:
-            self.log_message(f"Error getting selected streams, using defaults: {str(e)}", "warning")
-            # Fallback to original logic
-            return self.get_best_streams_fallback(yt)
+            self.log_message(f"Batch failed: {str(e)}", "error")
+        self.log_message(f"Resolved {count} video(s) from the batch", "success" if count else "warning")
     
-    def get_best_streams_fallback(self, yt):
-        """Fallback method for getting streams"""
-        streams = yt.streams.filter(progressive=True, file_extension="mp4").order_by("resolution").desc()
+    def add_job_row(self, job):
+        """Create the queue entry widgets for a job"""
+        row = ctk.CTkFrame(self.queue_list)
+        row.pack(fill="x", pady=(0, 5))
         
-        if not streams:
-            return None, None, False
-            
-        best_progressive = streams.first()
-        progressive_resolution = int(best_progressive.resolution[:-1]) if best_progressive else 0
-        
-        # If best progressive is less than 1080p, try adaptive
-        if progressive_resolution < 1080:
-            video_stream = yt.streams.filter(adaptive=True, file_extension="mp4", only_video=True)\
-                                .order_by("resolution").desc().first()
-            audio_stream = yt.streams.filter(only_audio=True, file_extension="mp4")\
-                                .order_by("abr").desc().first()
-            
-            if video_stream and audio_stream:
-                return video_stream, audio_stream, True
+        header = ctk.CTkFrame(row, fg_color="transparent")
+        header.pack(fill="x", padx=10, pady=(5, 0))
+        
+        pause_button = ctk.CTkButton(header, text="Pause", width=60, height=22, font=ctk.CTkFont(size=11),
+                                     command=lambda: self.toggle_pause(job))
+        pause_button.pack(side="right")
+        
+        cancel_button = ctk.CTkButton(header, text="Cancel", width=60, height=22, font=ctk.CTkFont(size=11),
+                                      fg_color="gray40", command=lambda: self.engine.cancel_job(job))
+        cancel_button.pack(side="right", padx=(0, 5))
+        
+        title_text = job.title[:50] + "..." if len(job.title) > 50 else job.title
+        title_label = ctk.CTkLabel(header, text=title_text, font=ctk.CTkFont(size=12, weight="bold"), anchor="w")
+        title_label.pack(side="left", fill="x", expand=True)
         
-        return best_progressive, None, False
+        progress_bar = ctk.CTkProgressBar(row, height=10)
+        progress_bar.pack(fill="x", padx=10, pady=(3, 0))
+        progress_bar.set(0)
+        
+        status_label = ctk.CTkLabel(row, text=job.message, font=ctk.CTkFont(size=11), anchor="w")
+        status_label.pack(fill="x", padx=10, pady=(0, 5))
+        
+        self.job_rows[job.id] = {'frame': row, 'progress': progress_bar, 'status': status_label,
+                                 'pause': pause_button, 'cancel': cancel_button, 'title': title_text,
+                                 'logged_milestone': 0}
     
-    def on_download_progress(self, stream, chunk, bytes_remaining):
-        """Progress callback for download"""
-        total_size = stream.filesize
-        bytes_downloaded = total_size - bytes_remaining
-        percentage = (bytes_downloaded / total_size) * 100
-        
-        # Update progress in main thread
-        self.after(0, lambda: self.update_progress(percentage, f"Downloading: {percentage:.1f}%"))
+    def toggle_pause(self, job):
+        """Pause or resume a job from its queue entry"""
+        widgets = self.job_rows.get(job.id)
+        if self.engine.scheduler.is_paused(job):
+            self.engine.resume_job(job)
+            text = "Pause"
+        else:
+            self.engine.pause_job(job)
+            text = "Resume"
+        if widgets:
+            widgets['pause'].configure(text=text)
     
-    def merge_audio_video(self, video_path, audio_path, output_path):
-        """Merge audio and video using FFmpeg with VideoToolbox"""
+    def on_speed_limit_change(self, choice):
+        """Apply the selected global speed limit to running and future downloads"""
+        self.engine.scheduler.set_rate(SPEED_LIMITS.get(choice, 0))
+        self.log_message(f"Speed limit: {choice}")
+    
+    def poll_progress(self):
+        """Redraw changed jobs and apply worker threads' results at a fixed frame rate, independent of download speed"""
         try:
-            command = [
-                FFMPEG_PATH,
-                '-y',
-                '-i', video_path,
-                '-i', audio_path,
-                '-c:v', 'hevc_videotoolbox',
-                '-b:v', '6M',
-                '-c:a', 'aac',
-                '-b:a', '192k',
-                output_path
-            ]
-            
-            result = subprocess.run(command, capture_output=True, text=True)
-            return result.returncode == 0
-            
+            # Queue jobs resolved by batch threads; widgets may only be created here
+            queued = False
+            while True:
+                try:
+                    job = self.batch_jobs.get_nowait()
+                except queue.Empty:
+                    break
+                self.add_job_row(job)
+                self.download_queue.submit(job)
+                self.log_message(f"Queued: {job.title}")
+                queued = True
+            
+            # Show analyses finished by metadata threads
+            while True:
+                try:
+                    future, url, generation = self.finished_analyses.get_nowait()
+                except queue.Empty:
+                    break
+                self.on_analysis_done(future, url, generation)
+            
+            changed = self.progress_aggregator.collect()
+            for job_id, state in changed.items():
+                self.refresh_job_row(job_id, state)
+            if changed or queued:
+                self.refresh_queue_status()
         except Exception as e:
-            logger.error(f"Error merging: {str(e)}")
-            return False
+            logger.error(f"Failed to refresh progress: {e}")
+        finally:
+            self.after(1000 // PROGRESS_FPS, self.poll_progress)
+    
+    def refresh_job_row(self, job_id, state):
+        """Redraw a job's queue entry from its latest progress state"""
+        widgets = self.job_rows.get(job_id)
+        if not widgets:
+            return
+        
+        widgets['progress'].set(state['progress'] / 100)
+        status_text = state['message']
+        if state['status'] == 'running' and state['speed'] > 0:
+            status_text += f" • {format_bytes(state['speed'])}/s"
+            if state['eta'] is not None:
+                status_text += f" • ETA {format_duration(int(state['eta']))}"
+        widgets['status'].configure(text=status_text)
+        if state['status'] in ('completed', 'skipped', 'failed', 'cancelled'):
+            widgets['pause'].pack_forget()
+            widgets['cancel'].pack_forget()
+        
+        # Log progress milestones once per job instead of on every update
+        milestone = int(state['progress'] // PROGRESS_LOG_STEP) * PROGRESS_LOG_STEP
+        if state['status'] == 'running' and 0 < milestone < 100 and milestone > widgets['logged_milestone']:
+            widgets['logged_milestone'] = milestone
+            self.log_message(f"Progress: {milestone}% - {widgets['title']}")
     
-    def download_complete(self):
-        """Reset UI after successful download"""
-        self.download_button.configure(state="normal")
-        self.status_label.configure(text="Download complete!")
-        self.progress_bar.set(1.0)
-        self.progress_label.configure(text="100% - Complete")
+    def refresh_queue_status(self):
+        """Show overall progress, speed and ETA across unfinished jobs"""
+        running, queued = self.download_queue.counts()
+        active = self.download_queue.active_jobs()
+        
+        if active:
+            overall = sum(job.progress for job in active) / len(active)
+            speed, remaining = self.progress_aggregator.totals([job.id for job in active])
+            speed_text = f"{format_bytes(speed)}/s" if speed > 0 else ''
+            eta_text = format_duration(int(remaining / speed)) if speed > 0 and remaining else ''
+            
+            current_download.update({
+                'status': 'downloading' if running else 'queued',
+                'progress': overall,
+                'message': f"{running} downloading, {queued} queued",
+                'speed': speed_text,
+                'eta': eta_text
+            })
+            
+            self.status_label.configure(text=current_download['message'])
+            progress_text = f"Overall: {overall:.1f}%"
+            if speed_text:
+                progress_text += f" • {speed_text}"
+            if eta_text:
+                progress_text += f" • ETA {eta_text}"
+            self.update_progress(overall, progress_text)
+        else:
+            current_download.update({'status': 'idle', 'progress': 0, 'message': '', 'speed': '', 'eta': ''})
+            self.status_label.configure(text="Ready to download")
+    
+    def download_in_thread(self, job):
+        """Handle a queued download on a worker thread"""
+        return self.engine.download_in_thread(job)
     
-    def download_failed(self):
-        """Reset UI after failed download"""
-        self.download_button.configure(state="normal")
-        self.status_label.configure(text="Download failed")
-        self.progress_bar.set(0)
-        self.progress_label.configure(text="")
-
 def set_process_name():
     """Set process name before creating the app to change menu bar name"""
     try:
@@ -1126,6 +1132,7 @@ def set_process_name():
 if __name__ == "__main__":
     # Set process name before creating the app
     set_process_name()
+    start_probes()
     
     # Create and run the app
     app = WampyTubeApp()
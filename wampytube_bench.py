@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+
+import argparse
+import concurrent.futures
+import http.server
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+import psutil
+from wampytube_core import (
+    CPU_THREADS, FFMPEG_PATH, FFMPEG_PROBE, SYSTEM_CORES, SYSTEM_THREADS, DownloadEngine, DownloadJob,
+    log_to_logger, select_video_encoder
+)
+
+# Benchmark configuration
+BENCH_DURATION = 20  # Seconds of synthetic media in each fixture
+BENCH_HEIGHT = 1080  # Height of the top video rendition
+BENCH_RUNS = 5  # Timed runs per scenario
+BENCH_WARMUP_RUNS = 1  # Untimed runs before each scenario
+BENCH_SELECT_ITERATIONS = 500  # Stream selections timed in the select scenario
+BENCH_SAMPLE_INTERVAL = 0.05  # Seconds between RSS and I/O samples
+BENCH_REGRESSION_THRESHOLD = 0.10  # Allowed p50 slowdown against a baseline before --compare fails
+BENCH_URL = 'https://www.youtube.com/watch?v=benchmark01'
+BENCH_TITLE = 'WampyTube Benchmark'
+RESULTS_VERSION = 1
+
+SCENARIOS = ['select', 'download_streaming', 'download_files', 'download_transcode', 'merge_remux', 'merge_transcode']
+
+def log(message):
+    """Progress and results go to stderr, keeping stdout clean"""
+    print(message, file=sys.stderr, flush=True)
+
+def run_ffmpeg(args):
+    """Run ffmpeg quietly, raising with its error output on failure"""
+    result = subprocess.run([FFMPEG_PATH, '-hide_banner', '-loglevel', 'error', '-y', *args],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.strip()[-500:]}")
+
+def make_fixtures(folder, height=BENCH_HEIGHT, duration=BENCH_DURATION):
+    """Render fragmented MP4 video renditions and an AAC track with lavfi, reusing earlier renders"""
+    os.makedirs(folder, exist_ok=True)
+    # Fragmented like YouTube's DASH streams, so the streaming merge can read them from a pipe
+    fragmented = ['-movflags', 'frag_keyframe+empty_moov+default_base_moof']
+    fixtures = {}
+    for rendition in sorted({height, 360}, reverse=True):
+        width = rendition * 16 // 9 // 2 * 2
+        bitrate = max(500, rendition * 5)  # kbit/s, roughly YouTube's H.264 ladder
+        path = os.path.join(folder, f'video_{rendition}p_{duration}s.mp4')
+        if not os.path.exists(path):
+            log(f"Rendering {rendition}p fixture...")
+            run_ffmpeg(['-f', 'lavfi', '-i', f'testsrc2=size={width}x{rendition}:rate=30:duration={duration}',
+                        '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', '-g', '60',
+                        '-b:v', f'{bitrate}k', *fragmented, f'{path}.part.mp4'])
+            os.replace(f'{path}.part.mp4', path)
+        fixtures[rendition] = {'path': path, 'bitrate': bitrate * 1000}
+    
+    path = os.path.join(folder, f'audio_{duration}s.m4a')
+    if not os.path.exists(path):
+        log("Rendering audio fixture...")
+        run_ffmpeg(['-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=44100:duration={duration}',
+                    '-c:a', 'aac', '-b:a', '128k', *fragmented, f'{path}.part.m4a'])
+        os.replace(f'{path}.part.m4a', path)
+    fixtures['audio'] = {'path': path, 'bitrate': 128000}
+    return fixtures
+
+class RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Serve fixture files with keep-alive and single byte-range support, like googlevideo"""
+    protocol_version = 'HTTP/1.1'
+    root = None
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_GET(self):
+        path = os.path.join(self.root, os.path.basename(self.path.split('?')[0]))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or end), end)
+            if start > end:
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        
+        remaining = end - start + 1
+        try:
+            with open(path, 'rb') as f:
+                f.seek(start)
+                while remaining > 0:
+                    chunk = f.read(min(256 * 1024, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+class FixtureServer:
+    """Local HTTP server for the fixture folder, running on a daemon thread"""
+    
+    def __init__(self, folder, handler=RangeRequestHandler):
+        self.handler = type('FixtureHandler', (handler,), {'root': folder})
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), self.handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name='bench-http', daemon=True)
+        self.thread.start()
+    
+    def url(self, path):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/{os.path.basename(path)}"
+    
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class BenchStream:
+    """Stand-in for a pytubefix Stream backed by a fixture file"""
+    
+    def __init__(self, itag, path, url, codecs, resolution=None, abr=None, fps=None, bitrate=None):
+        self.itag = itag
+        self.path = path
+        self.url = url
+        self.filesize = os.path.getsize(path)
+        self.codecs = codecs
+        self.resolution = resolution
+        self.abr = abr
+        self.fps = fps
+        self.bitrate = bitrate
+        self.is_adaptive = True
+        self.is_progressive = False
+        self.includes_audio_track = abr is not None
+        self.includes_video_track = resolution is not None
+        self.subtype = 'mp4'
+        self.mime_type = f"{'video' if resolution else 'audio'}/mp4"
+        self.expiration = None
+    
+    def get_file_path(self, filename=None, output_path=None, filename_prefix=None, **kwargs):
+        # Like pytubefix, an explicit filename is used as given
+        filename = filename or f"{BENCH_TITLE}.{'mp4' if self.resolution else 'm4a'}"
+        return os.path.join(output_path or '', f"{filename_prefix or ''}{filename}")
+    
+    def download(self, output_path=None, filename=None, filename_prefix=None, **kwargs):
+        """pytubefix fallback path: copy the fixture into place"""
+        path = self.get_file_path(filename, output_path, filename_prefix)
+        shutil.copyfile(self.path, path)
+        return path
+
+class BenchStreamQuery(list):
+    """The subset of pytubefix's StreamQuery the engine uses"""
+    
+    def filter(self, progressive=None, adaptive=None, only_video=None, only_audio=None, file_extension=None, **kwargs):
+        streams = list(self)
+        if progressive:
+            streams = [stream for stream in streams if stream.is_progressive]
+        if adaptive:
+            streams = [stream for stream in streams if stream.is_adaptive]
+        if only_video:
+            streams = [stream for stream in streams if stream.resolution]
+        if only_audio:
+            streams = [stream for stream in streams if stream.abr]
+        if file_extension:
+            streams = [stream for stream in streams if stream.subtype == file_extension]
+        return BenchStreamQuery(streams)
+    
+    def order_by(self, attribute):
+        def key(stream):
+            digits = re.sub(r'\D', '', str(getattr(stream, attribute) or ''))
+            return int(digits) if digits else 0
+        return BenchStreamQuery(sorted(self, key=key))
+    
+    def desc(self):
+        return BenchStreamQuery(reversed(self))
+    
+    def first(self):
+        return self[0] if self else None
+    
+    def get_by_itag(self, itag):
+        return next((stream for stream in self if stream.itag == itag), None)
+
+class BenchVideo:
+    """Stand-in for a pytubefix YouTube object whose streams are the fixtures"""
+    
+    def __init__(self, fixtures, server, duration):
+        self.title = BENCH_TITLE
+        self.length = duration
+        self.description = ''
+        self.vid_info = None
+        itags = {2160: 401, 1440: 400, 1080: 137, 720: 136, 480: 135, 360: 134}
+        streams = []
+        for height, fixture in fixtures.items():
+            if height == 'audio':
+                continue
+            streams.append(BenchStream(itags.get(height, 137), fixture['path'], server.url(fixture['path']),
+                                       ['avc1.640028'], f'{height}p', fps=30, bitrate=fixture['bitrate']))
+        audio = fixtures['audio']
+        streams.append(BenchStream(140, audio['path'], server.url(audio['path']), ['mp4a.40.2'],
+                                   abr='128kbps', bitrate=audio['bitrate']))
+        self.streams = BenchStreamQuery(streams)
+    
+    def register_on_progress_callback(self, callback):
+        pass
+    
+    def check_availability(self):
+        pass
+
+class BenchEngine(DownloadEngine):
+    """Download engine wired to the fixture video, with the streaming merge switchable"""
+    
+    def __init__(self, video, log=None):
+        super().__init__(log=log or (lambda message, level="info": None), use_archive=False)
+        self.video = video
+        self.streaming = True
+    
+    def get_video(self, url):
+        return self.video, False
+    
+    def can_stream_merge(self, job, video_stream, audio_stream):
+        return self.streaming and super().can_stream_merge(job, video_stream, audio_stream)
+
+class ResourceSampler:
+    """Track peak RSS and bytes written across this process and its ffmpeg children"""
+    
+    def __init__(self, interval=BENCH_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak_rss = 0
+        self.written = {}  # Latest write_bytes per pid, so children that exit keep their total
+        self.io_supported = hasattr(self.process, 'io_counters')
+        self.stop_event = threading.Event()
+        self.thread = None
+    
+    def __enter__(self):
+        self.baseline = self.process.io_counters().write_bytes if self.io_supported else 0
+        self.thread = threading.Thread(target=self.run, name='bench-sampler', daemon=True)
+        self.thread.start()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.stop_event.set()
+        self.thread.join()
+        self.sample()
+    
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+    
+    def sample(self):
+        rss = 0
+        for process in [self.process, *self.process.children(recursive=True)]:
+            try:
+                rss += process.memory_info().rss
+                if self.io_supported:
+                    self.written[process.pid] = process.io_counters().write_bytes
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        self.peak_rss = max(self.peak_rss, rss)
+    
+    @property
+    def bytes_written(self):
+        """Bytes written to storage, None where the platform doesn't report per-process I/O"""
+        if not self.io_supported:
+            return None
+        return sum(self.written.values()) - self.baseline
+
+def percentile(values, fraction):
+    """Linearly interpolated percentile of already sorted values"""
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+def summarize(latencies, payload_bytes, sampler, output_bytes):
+    """Reduce one scenario's timings and resource samples to the stored result, byte counts per run"""
+    ordered = sorted(latencies)
+    written = sampler.bytes_written
+    total_time = sum(ordered)
+    return {
+        'runs': len(ordered),
+        'latency': {
+            'min': ordered[0],
+            'p50': percentile(ordered, 0.5),
+            'p90': percentile(ordered, 0.9),
+            'p99': percentile(ordered, 0.99),
+            'max': ordered[-1],
+            'mean': total_time / len(ordered)
+        },
+        'throughput_bytes_per_second': payload_bytes * len(ordered) / total_time if payload_bytes and total_time else None,
+        'peak_rss_bytes': sampler.peak_rss,
+        'disk_bytes_written': written // len(ordered) if written is not None else None,
+        'output_bytes': output_bytes
+    }
+
+class Benchmark:
+    """Time stream selection, full downloads and merges against the local fixtures"""
+    
+    def __init__(self, args):
+        self.args = args
+        self.workdir = tempfile.mkdtemp(prefix='wampytube_bench_')
+        self.fixture_dir = args.fixtures or os.path.join(tempfile.gettempdir(), 'wampytube_bench_fixtures')
+        self.fixtures = make_fixtures(self.fixture_dir, args.height, args.duration)
+        self.server = FixtureServer(self.fixture_dir)
+        self.video = BenchVideo(self.fixtures, self.server, args.duration)
+        self.engine = BenchEngine(self.video, log_to_logger if args.verbose else None)
+        top = self.fixtures[max(key for key in self.fixtures if key != 'audio')]
+        self.video_path = top['path']
+        self.audio_path = self.fixtures['audio']['path']
+        self.media_bytes = os.path.getsize(self.video_path) + os.path.getsize(self.audio_path)
+    
+    def close(self):
+        self.server.close()
+        self.engine.postprocessor.shutdown()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+    
+    def measure(self, name, step, runs, payload_bytes=None):
+        """Run step warmup + runs times, returning the scenario summary"""
+        for _ in range(self.args.warmup):
+            step()
+        latencies = []
+        output_bytes = 0
+        with ResourceSampler() as sampler:
+            for _ in range(runs):
+                started = time.perf_counter()
+                output_bytes += step() or 0
+                latencies.append(time.perf_counter() - started)
+        result = summarize(latencies, payload_bytes, sampler, output_bytes // runs)
+        log(f"{name:20} p50 {result['latency']['p50'] * 1000:9.2f} ms  p90 {result['latency']['p90'] * 1000:9.2f} ms"
+            + (f"  {result['throughput_bytes_per_second'] / 1e6:8.1f} MB/s" if result['throughput_bytes_per_second'] else ""))
+        return result
+    
+    def select(self):
+        job = DownloadJob(BENCH_URL, self.workdir, quality='best')
+        video_stream, audio_stream, _ = self.engine.get_selected_streams(self.video, job)
+        if not video_stream or not audio_stream:
+            raise RuntimeError("Stream selection found no streams")
+    
+    def download(self, mode, streaming):
+        """One full download_in_thread run into a fresh folder, returning the output size"""
+        folder = tempfile.mkdtemp(dir=self.workdir)
+        self.engine.streaming = streaming
+        job = DownloadJob(BENCH_URL, folder, output_mode=mode, title=BENCH_TITLE)
+        try:
+            outcome = self.engine.download_in_thread(job)
+            if isinstance(outcome, concurrent.futures.Future):
+                # Callbacks run in order, so this fires after the engine has recorded the result
+                settled = threading.Event()
+                outcome.add_done_callback(lambda _: settled.set())
+                settled.wait()
+            if job.status != 'completed':
+                raise RuntimeError(f"Download {job.status}: {job.error}")
+            return os.path.getsize(job.final_path)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+    
+    def merge(self, mode):
+        """One merge_audio_video run on the local fixtures, returning the output size"""
+        output_path = os.path.join(self.workdir, f'merge_{mode}.mp4')
+        if not self.engine.merge_audio_video(self.video_path, self.audio_path, output_path, mode,
+                                             ['avc1.640028'], ['mp4a.40.2']):
+            raise RuntimeError(f"{mode} merge failed")
+        size = os.path.getsize(output_path)
+        os.remove(output_path)
+        return size
+    
+    def run(self, scenarios):
+        # Resolve the encoder before timing so probes don't land in the first run
+        encoder = select_video_encoder()
+        runs = self.args.runs
+        steps = {
+            'select': (self.select, self.args.select_iterations, None),
+            'download_streaming': (lambda: self.download('remux', True), runs, self.media_bytes),
+            'download_files': (lambda: self.download('remux', False), runs, self.media_bytes),
+            'download_transcode': (lambda: self.download('transcode', False), runs, self.media_bytes),
+            'merge_remux': (lambda: self.merge('remux'), runs, self.media_bytes),
+            'merge_transcode': (lambda: self.merge('transcode'), runs, self.media_bytes)
+        }
+        results = {}
+        for name in scenarios:
+            step, count, payload = steps[name]
+            results[name] = self.measure(name, step, count, payload)
+        
+        return {
+            'version': RESULTS_VERSION,
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'system': {
+                'platform': platform.platform(),
+                'machine': platform.machine(),
+                'python': platform.python_version(),
+                'cores': SYSTEM_CORES,
+                'threads': SYSTEM_THREADS,
+                'cpu_threads': CPU_THREADS,
+                'ffmpeg': FFMPEG_PROBE.result().get('version'),
+                'video_encoder': encoder['name']
+            },
+            'config': {
+                'height': self.args.height,
+                'duration': self.args.duration,
+                'runs': runs,
+                'warmup': self.args.warmup,
+                'media_bytes': self.media_bytes
+            },
+            'scenarios': results
+        }
+
+def compare(results, baseline, threshold):
+    """Print p50 changes against a baseline, returning the names of regressed scenarios"""
+    regressions = []
+    for name, result in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        before = previous['latency']['p50']
+        after = result['latency']['p50']
+        change = (after - before) / before if before else 0
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        log(f"{name:20} p50 {before * 1000:9.2f} ms -> {after * 1000:9.2f} ms  {change:+7.1%}"
+            + ("  REGRESSION" if regressed else ""))
+    return regressions
+
+def build_parser():
+    """Command-line options for the benchmark"""
+    parser = argparse.ArgumentParser(
+        prog='wampytube_bench',
+        description="Benchmark the download and merge pipeline against synthetic media served from localhost.")
+    parser.add_argument('scenarios', nargs='*', metavar='SCENARIO',
+                        help=f"scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument('-o', '--output', default='wampytube-bench.json',
+                        help="where to write the JSON results (default: %(default)s)")
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help="compare against an earlier results file and exit 1 on regressions")
+    parser.add_argument('--threshold', type=float, default=BENCH_REGRESSION_THRESHOLD,
+                        help="p50 slowdown that counts as a regression (default: %(default)s)")
+    parser.add_argument('-n', '--runs', type=int, default=BENCH_RUNS, help="timed runs per scenario (default: %(default)s)")
+    parser.add_argument('--warmup', type=int, default=BENCH_WARMUP_RUNS,
+                        help="untimed runs before each scenario (default: %(default)s)")
+    parser.add_argument('--select-iterations', type=int, default=BENCH_SELECT_ITERATIONS,
+                        help="stream selections timed by the select scenario (default: %(default)s)")
+    parser.add_argument('--height', type=int, default=BENCH_HEIGHT, help="fixture video height (default: %(default)s)")
+    parser.add_argument('--duration', type=int, default=BENCH_DURATION,
+                        help="fixture length in seconds (default: %(default)s)")
+    parser.add_argument('--fixtures', metavar='DIR', help="where rendered fixtures are kept between runs")
+    parser.add_argument('--verbose', action='store_true', help="log engine messages")
+    return parser
+
+def main(argv=None):
+    """Run the selected scenarios, write the results and return the exit status"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario {unknown[0]!r}, choose from {', '.join(SCENARIOS)}")
+    if args.runs < 1 or args.select_iterations < 1:
+        log("--runs and --select-iterations must be at least 1")
+        return 2
+    
+    baseline = None
+    if args.compare:
+        try:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            log(f"Could not read baseline {args.compare}: {e}")
+            return 2
+    
+    benchmark = Benchmark(args)
+    try:
+        results = benchmark.run(args.scenarios or SCENARIOS)
+    finally:
+        benchmark.close()
+    
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    log(f"Results written to {args.output}")
+    
+    if baseline and compare(results, baseline, args.threshold):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+import threading
+import time
+from wampytube_core import (
+    DEFAULT_OUTPUT_MODE, DEFAULT_PRIORITY, DOWNLOAD_THREADS, HTTP_HOST_CONCURRENCY, OUTPUT_MODES, PRIORITY_WEIGHTS,
+    PROGRESS_LOG_STEP, SCRATCH_DIR, STARTUP_TIMER, DownloadEngine, JsonLinesSink, PrometheusSink, DownloadJob, DownloadQueue,
+    get_collection_type
+)
+
+MAX_JOBS = max(1, HTTP_HOST_CONCURRENCY // 2)  # Each job fetches its video and audio from the same host at once
+
+class ConsoleReporter:
+    """Print engine messages and per-job progress milestones to stderr"""
+    
+    def __init__(self, quiet=False):
+        self.quiet = quiet
+        self.milestones = {}
+        self.lock = threading.Lock()
+    
+    def log(self, message, level="info"):
+        """Print an activity message, only warnings and errors when quiet"""
+        if self.quiet and level not in ("warning", "error"):
+            return
+        prefix = {"warning": "warning: ", "error": "error: "}.get(level, "")
+        with self.lock:
+            print(f"[{time.strftime('%H:%M:%S')}] {prefix}{message}", file=sys.stderr, flush=True)
+    
+    def on_update(self, job):
+        """Log each job's progress every PROGRESS_LOG_STEP percent"""
+        if job.status != 'running':
+            return
+        milestone = int(job.progress // PROGRESS_LOG_STEP) * PROGRESS_LOG_STEP
+        with self.lock:
+            if not 0 < milestone < 100 or milestone <= self.milestones.get(job.id, 0):
+                return
+            self.milestones[job.id] = milestone
+        self.log(f"Progress: {milestone}% - {job.title}")
+
+def parse_quality(value):
+    """Accept 'best' or a maximum height such as 720 or 1080p"""
+    if value.lower() == 'best':
+        return 'best'
+    if not value.lower().rstrip('p').isdigit():
+        raise argparse.ArgumentTypeError(f"expected 'best' or a height like 1080p, got {value!r}")
+    return value.lower()
+
+def parse_rate(value):
+    """Accept a byte rate such as 500K, 5M or 1.5G per second, 0 for unlimited"""
+    units = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    number, unit = value.upper().rstrip('B'), ''
+    if number[-1:] in units:
+        number, unit = number[:-1], number[-1]
+    try:
+        rate = float(number) * units[unit]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a rate like 500K or 5M, got {value!r}")
+    if rate < 0:
+        raise argparse.ArgumentTypeError(f"rate can't be negative: {value!r}")
+    return int(rate)
+
+def read_urls(lines):
+    """Yield URLs from text lines, skipping blanks and # comments"""
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+def iter_urls(args):
+    """Yield URLs from the arguments, input files and stdin, in that order"""
+    yield from args.urls
+    for path in args.input or []:
+        if path == '-':
+            yield from read_urls(sys.stdin)
+        else:
+            with open(path, encoding='utf-8') as f:
+                yield from read_urls(f)
+    # Piped input is read as it arrives, so `tail -f urls.txt | wampytube` keeps ingesting
+    if not args.urls and not args.input and not sys.stdin.isatty():
+        yield from read_urls(sys.stdin)
+
+def build_parser():
+    """Command-line options, sharing the GUI's defaults"""
+    parser = argparse.ArgumentParser(
+        prog='wampytube',
+        description="Download YouTube videos without the GUI. URLs come from arguments, "
+                    "--input files or stdin (one per line).")
+    parser.add_argument('urls', nargs='*', metavar='URL', help="video URLs to download")
+    parser.add_argument('-i', '--input', action='append', metavar='FILE',
+                        help="read URLs from FILE, one per line ('-' for stdin); may be repeated")
+    parser.add_argument('-o', '--output', default=os.path.expanduser("~/Downloads"),
+                        help="output folder (default: %(default)s)")
+    parser.add_argument('-q', '--quality', type=parse_quality, default='best',
+                        help="'best' or the maximum height, e.g. 1080p (default: best)")
+    parser.add_argument('-a', '--audio', metavar='LANG',
+                        help="preferred audio language code, e.g. en or es (default: best track)")
+    parser.add_argument('-m', '--mode', choices=sorted(set(OUTPUT_MODES.values())), default=DEFAULT_OUTPUT_MODE,
+                        help="remux keeps the original streams, transcode re-encodes to HEVC (default: %(default)s)")
+    parser.add_argument('-j', '--jobs', type=int, default=max(1, DOWNLOAD_THREADS),
+                        help=f"concurrent downloads, at most {MAX_JOBS} (default: %(default)s)")
+    parser.add_argument('--limit-rate', type=parse_rate, default=0, metavar='RATE',
+                        help="total download speed cap in bytes per second, e.g. 5M (default: unlimited)")
+    parser.add_argument('--job-limit-rate', type=parse_rate, default=0, metavar='RATE',
+                        help="speed cap for each download, e.g. 1M (default: unlimited)")
+    parser.add_argument('--priority', choices=list(PRIORITY_WEIGHTS), default=DEFAULT_PRIORITY,
+                        help="share of a capped link these downloads get next to others (default: %(default)s)")
+    parser.add_argument('--scratch-dir', default=SCRATCH_DIR, metavar='DIR',
+                        help="keep partial downloads and merge inputs in DIR, e.g. a local SSD or tmpfs, "
+                             "and move finished files into the output folder (default: $WAMPYTUBE_SCRATCH_DIR "
+                             "or the output folder)")
+    parser.add_argument('--metrics-file', metavar='FILE',
+                        help="append a JSON line per job phase (resolve, select, download, merge...) to FILE")
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics while running")
+    parser.add_argument('--no-archive', action='store_true',
+                        help="download even if the archive says a video was already downloaded")
+    parser.add_argument('--rebuild-archive', action='store_true',
+                        help="rebuild the archive from the files in the output folder before downloading")
+    parser.add_argument('--quiet', action='store_true', help="only print warnings, errors and results")
+    return parser
+
+def main(argv=None):
+    """Queue every URL, wait for the downloads and return the exit status"""
+    args = build_parser().parse_args(argv)
+    
+    reporter = ConsoleReporter(args.quiet)
+    if args.jobs > MAX_JOBS:
+        reporter.log(f"--jobs {args.jobs} needs more than the {HTTP_HOST_CONCURRENCY} connections allowed per host, "
+                     f"using {MAX_JOBS}", "warning")
+        args.jobs = MAX_JOBS
+    engine = DownloadEngine(log=reporter.log, on_update=reporter.on_update, use_archive=not args.no_archive,
+                            scratch_dir=args.scratch_dir)
+    if args.rebuild_archive and engine.archive and os.path.isdir(args.output):
+        count = engine.archive.rebuild(args.output)
+        reporter.log(f"Archive rebuilt: {count} download(s) found in {args.output}")
+    if args.metrics_file:
+        engine.tracer.add_sink(JsonLinesSink(args.metrics_file))
+    if args.metrics_port is not None:
+        try:
+            engine.tracer.add_sink(PrometheusSink(args.metrics_port))
+        except OSError as e:
+            reporter.log(f"Could not serve metrics on port {args.metrics_port}: {e}", "error")
+            return 2
+    engine.scheduler.set_rate(args.limit_rate)
+    engine.scheduler.job_rate = args.job_limit_rate
+    download_queue = DownloadQueue(engine.download_in_thread, max_workers=args.jobs)
+    STARTUP_TIMER.mark('cli_ready')
+    STARTUP_TIMER.report('cli')
+    
+    jobs = []
+    try:
+        for url in iter_urls(args):
+            if get_collection_type(url):
+                # Playlist and channel entries are resolved in parallel and queued as each one resolves
+                batch = engine.resolve_jobs([url], args.output, args.mode, args.quality, args.audio)
+            else:
+                batch = [DownloadJob(url, args.output, output_mode=args.mode,
+                                     quality=args.quality, audio_language=args.audio)]
+            for job in batch:
+                job.priority = args.priority
+                jobs.append(download_queue.submit(job))
+                reporter.log(f"Queued: {job.title}")
+    except OSError as e:
+        reporter.log(f"Could not read URLs: {e}", "error")
+        return 2
+    
+    if not jobs:
+        if args.rebuild_archive:
+            return 0
+        build_parser().print_usage(sys.stderr)
+        reporter.log("No URLs given", "error")
+        return 2
+    
+    try:
+        download_queue.pending.join()
+    except KeyboardInterrupt:
+        # Stops running transfers and ffmpeg children instead of waiting for them
+        for job in download_queue.active_jobs():
+            engine.cancel_job(job)
+        reporter.log("Interrupted, partial downloads will resume on the next run", "warning")
+        return 130
+    
+    failed = [job for job in jobs if job.status not in ('completed', 'skipped')]
+    skipped = [job for job in jobs if job.status == 'skipped']
+    for job in jobs:
+        if job.status == 'completed':
+            print(job.final_path, flush=True)
+    reporter.log(f"{len(jobs) - len(failed) - len(skipped)} of {len(jobs)} downloads completed, "
+                 f"{len(skipped)} already downloaded", "error" if failed else "info")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3285 @@
+"""WampyTube download engine: everything that runs without a display"""
+
+from pytubefix import YouTube, Playlist, Channel, extract
+import requests
+import threading
+import os
+import subprocess
+import re
+import urllib.parse
+import urllib.error
+import http.client
+import random
+from pathlib import Path
+import logging
+import logging.handlers
+import concurrent.futures
+import time
+import queue
+import itertools
+import json
+import errno
+import shutil
+import tempfile
+import sqlite3
+import platform
+import psutil
+import sys
+import collections
+import contextlib
+import http.server
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("WampyTube")
+logger.handlers = []
+logger.propagate = False
+
+# Log file configuration
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024  # Rotate the log file at this size
+LOG_FILE_BACKUPS = 3  # Rotated log files to keep
+
+def get_log_dir():
+    """Per-user directory for WampyTube's log files"""
+    if sys.platform == 'darwin':
+        log_dir = os.path.expanduser('~/Library/Logs/WampyTube')
+    else:
+        base = os.environ.get('XDG_STATE_HOME') or os.path.expanduser('~/.local/state')
+        log_dir = os.path.join(base, 'WampyTube')
+    os.makedirs(log_dir, exist_ok=True)
+    return log_dir
+
+def get_cache_dir():
+    """Per-user cache directory for WampyTube's persistent state"""
+    if sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    cache_dir = os.path.join(base, 'WampyTube')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+def get_data_dir():
+    """Per-user directory for state that must not be thrown away with the cache"""
+    if sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Application Support')
+    else:
+        base = os.environ.get('XDG_DATA_HOME') or os.path.expanduser('~/.local/share')
+    data_dir = os.path.join(base, 'WampyTube')
+    os.makedirs(data_dir, exist_ok=True)
+    return data_dir
+
+# Keep the full history in a rotating file, the UI only shows the latest lines
+try:
+    file_handler = logging.handlers.RotatingFileHandler(
+        os.path.join(get_log_dir(), 'wampytube.log'),
+        maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(threadName)s - %(message)s'))
+    logger.addHandler(file_handler)
+except Exception as e:
+    logger.warning(f"Could not open log file: {e}")
+
+# Startup timing configuration
+STARTUP_REPORT_FILE = 'startup.jsonl'  # Per-launch phase timings, kept next to the log file
+STARTUP_REPORT_MAX_ENTRIES = 500  # Launches kept in the startup history
+
+class StartupTimer:
+    """Record when each startup phase finished, measured from process creation"""
+    
+    def __init__(self):
+        try:
+            self.origin = psutil.Process().create_time()
+        except Exception:
+            self.origin = time.time()
+        self.marks = {}
+        self.lock = threading.Lock()
+    
+    def mark(self, phase):
+        """Record the first time a phase completes, in seconds since the process started"""
+        with self.lock:
+            self.marks.setdefault(phase, round(time.time() - self.origin, 3))
+    
+    def report(self, entry):
+        """Log the phases so far and append them to the startup history for regression tracking"""
+        with self.lock:
+            marks = dict(self.marks)
+        logger.info(f"Startup timing ({entry}): " +
+                    ", ".join(f"{phase} {seconds * 1000:.0f}ms" for phase, seconds in marks.items()))
+        try:
+            path = os.path.join(get_log_dir(), STARTUP_REPORT_FILE)
+            lines = []
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    lines = f.readlines()[-(STARTUP_REPORT_MAX_ENTRIES - 1):]
+            lines.append(json.dumps({'timestamp': round(time.time()), 'entry': entry,
+                                     'platform': sys.platform, 'marks': marks}) + '\n')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+        except Exception as e:
+            logger.warning(f"Could not write startup report: {e}")
+        return marks
+
+STARTUP_TIMER = StartupTimer()
+
+# System resources configuration
+SYSTEM_CORES = psutil.cpu_count(logical=False) or 4
+SYSTEM_THREADS = psutil.cpu_count(logical=True) or 8
+DOWNLOAD_THREADS = min(4, SYSTEM_THREADS // 2)
+CPU_THREADS = SYSTEM_THREADS - 1
+
+# Post-processing configuration
+REMUX_WORKERS = max(1, DOWNLOAD_THREADS)  # Concurrent stream-copy merges, bound by disk rather than CPU
+HARDWARE_ENCODE_SESSIONS = 2  # Concurrent GPU encodes; consumer GPUs only allow a few sessions
+SOFTWARE_ENCODE_THREADS = 4  # ffmpeg threads per CPU encode, so concurrent encodes split CPU_THREADS
+
+# Segmented download configuration
+SEGMENT_CONNECTIONS = 4  # Parallel range requests per stream
+SEGMENT_SIZE = 8 * 1024 * 1024  # Bytes per range request
+DOWNLOAD_CHUNK_SIZE = 256 * 1024  # Bytes read per network chunk
+DOWNLOAD_RETRIES = 3  # Resume attempts after a network failure
+MANIFEST_SUFFIX = '.wampy.json'  # Sidecar file tracking partial downloads
+STREAMING_MERGE = True  # Remux straight from the network through named pipes when possible
+SCRATCH_DIR = os.environ.get('WAMPYTUBE_SCRATCH_DIR') or None  # Fast local folder for partial downloads and merge inputs, None keeps them in the output folder
+PARTIAL_SUFFIX = '.part'  # Added to the hidden name outputs are written under until they are complete
+
+# HTTP configuration
+HTTP_POOL_SIZE = 32  # Keep-alive connections kept open per host in the shared pool
+HTTP_HOST_CONCURRENCY = 8  # Simultaneous requests allowed to any one host
+HTTP_TIMEOUT = 30  # Seconds to wait for a connection or the next chunk
+HTTP_RETRIES = 3  # Automatic retries for failed connections and retryable statuses
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)  # Statuses worth retrying after a pause
+HTTP_BACKOFF_BASE = 0.5  # Seconds before the first retry, doubled on every attempt
+HTTP_BACKOFF_MAX = 30  # Longest pause between two attempts
+
+# Bandwidth configuration
+BANDWIDTH_LIMIT = 0  # Bytes per second shared by all downloads, 0 for unlimited
+JOB_BANDWIDTH_LIMIT = 0  # Default bytes per second for a single job, 0 for unlimited
+PRIORITY_WEIGHTS = {'high': 4, 'normal': 2, 'low': 1}  # Share of a capped link each priority class gets
+DEFAULT_PRIORITY = 'normal'
+
+# Metadata cache configuration
+METADATA_TTL = 6 * 3600  # Fallback lifetime when stream URLs carry no expiry
+METADATA_CACHE_MAX_ENTRIES = 200  # Resolved YouTube objects kept in memory, least recently used evicted first
+URL_EXPIRY_MARGIN = 300  # Refresh this many seconds before signed URLs expire
+PERSISTENT_CACHE_MAX_ENTRIES = 2000  # Videos kept in the on-disk metadata cache
+PERSISTENT_CACHE_MAX_AGE = 7 * 24 * 3600  # Re-resolve cached videos after a week
+BATCH_RESOLVE_THREADS = 8  # Playlist/channel entries resolved concurrently
+
+# Download archive configuration
+ARCHIVE_TAG_PREFIX = 'wampytube:'  # Comment tag written into merged files, used to rebuild the archive
+
+# Disk space configuration
+DISK_SPACE_RESERVE = 512 * 1024 * 1024  # Free space always left on a volume after a job's estimate
+DISK_SPACE_POLL_INTERVAL = 5  # Seconds between free-space checks while a job waits for room
+MERGE_SIZE_FACTOR = 1.05  # Merged output size relative to its inputs, allowing for container overhead
+
+# Metrics configuration
+METRICS_FILE = 'metrics.jsonl'  # Span log written next to wampytube.log
+METRICS_FILE_MAX_BYTES = 5 * 1024 * 1024  # Rotate the span log at this size
+METRICS_PORT = 9464  # Default port for the Prometheus text endpoint
+METRICS_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)  # Phase duration histogram bounds in seconds
+
+# Progress reporting configuration
+PROGRESS_LOG_STEP = 25  # Log each job's progress every this many percent
+SPEED_SMOOTHING = 0.3  # Weight of the newest sample in the speed moving average
+SPEED_SAMPLE_INTERVAL = 0.5  # Seconds between speed samples
+
+# FFmpeg configuration
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+FFMPEG_PATH = os.path.join(SCRIPT_DIR, 'ffmpeg')
+
+# Check if our local ffmpeg exists
+if not os.path.exists(FFMPEG_PATH):
+    FFMPEG_PATH = 'ffmpeg'
+    logger.warning(f"Local ffmpeg not found in {SCRIPT_DIR}, using system ffmpeg")
+else:
+    logger.info(f"Using local ffmpeg from {SCRIPT_DIR}")
+
+FFMPEG_STDERR_LINES = 40  # Lines of ffmpeg stderr kept for error reports
+FFMPEG_STALL_TIMEOUT = 300  # Seconds without any ffmpeg output before a run is considered hung
+FFMPEG_STOP_GRACE = 5  # Seconds ffmpeg gets to exit after SIGTERM before it is killed
+
+# Hardware and ffmpeg probe configuration
+PROBE_CACHE_FILE = 'probes.json'  # Probe results kept in the cache directory
+
+class ProbeCache:
+    """JSON file of slow probe results, each stored with the key it was computed for"""
+    
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+    
+    def load(self):
+        """Read every cached probe, treating a missing or corrupt file as empty"""
+        if not self.path:
+            self.path = os.path.join(get_cache_dir(), PROBE_CACHE_FILE)
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def get(self, name, key):
+        """Return the cached value for a probe, or None if missing or computed for another key"""
+        with self.lock:
+            entry = self.load().get(name)
+        if entry and entry.get('key') == key:
+            return entry.get('value')
+        return None
+    
+    def put(self, name, key, value):
+        """Store a probe result, replacing the file atomically"""
+        with self.lock:
+            probes = self.load()
+            probes[name] = {'key': key, 'value': value}
+            try:
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(probes, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Could not save probe cache: {e}")
+
+PROBE_CACHE = ProbeCache()
+
+class LazyProbe:
+    """Run a slow probe at most once, on a background thread, with its result cached on disk"""
+    
+    def __init__(self, name, probe, cache_key, default):
+        self.name = name
+        self.probe = probe
+        self.cache_key = cache_key
+        self.default = default
+        self.value = default
+        self.done = threading.Event()
+        self.callbacks = []
+        self.thread = None
+        self.lock = threading.Lock()
+    
+    def start(self):
+        """Begin probing unless it is already running or finished"""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name=f"probe-{self.name}", daemon=True)
+                self.thread.start()
+        return self
+    
+    def run(self):
+        """Use the cached result when its key still matches, otherwise probe and cache"""
+        started = time.perf_counter()
+        cached = False
+        try:
+            key = self.cache_key()
+            value = PROBE_CACHE.get(self.name, key) if key else None
+            cached = value is not None
+            if not cached:
+                value = self.probe()
+                if key:
+                    PROBE_CACHE.put(self.name, key, value)
+        except Exception as e:
+            logger.error(f"Probe {self.name} failed: {e}")
+            value = self.default
+        
+        self.value = value
+        elapsed = (time.perf_counter() - started) * 1000
+        logger.info(f"Probe {self.name} took {elapsed:.0f}ms{' (cached)' if cached else ''}: {value}")
+        STARTUP_TIMER.mark(f"probe_{self.name}")
+        self.done.set()
+        
+        with self.lock:
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(value)
+    
+    def result(self, timeout=None):
+        """Wait for the probe, returning the default if it hasn't finished within timeout seconds"""
+        self.start()
+        if not self.done.wait(timeout):
+            return self.default
+        return self.value
+    
+    def add_done_callback(self, callback):
+        """Call callback(value) from the probe thread once it finishes, or now if it already has"""
+        with self.lock:
+            if not self.done.is_set():
+                self.callbacks.append(callback)
+                return
+        callback(self.value)
+
+def ffmpeg_probe_key():
+    """Identify the ffmpeg binary by resolved path and mtime, so an upgrade invalidates cached probes"""
+    path = shutil.which(FFMPEG_PATH)
+    if not path:
+        return None
+    path = os.path.realpath(path)
+    return f"{path}:{os.path.getmtime(path)}"
+
+def gpu_probe_key():
+    """GPU details only change with the machine or its OS version"""
+    return f"{platform.node()}:{platform.platform()}"
+
+# Check for GPU and hardware acceleration on macOS
+def check_macos_gpu():
+    """Check for GPU and VideoToolbox support on macOS"""
+    if sys.platform != 'darwin':
+        return {'model': 'Unknown', 'available': False, 'hevc_encoding': False, 'videotoolbox': False}
+    try:
+        result = subprocess.run(['system_profiler', 'SPDisplaysDataType'], 
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        
+        gpu_info = {'available': False, 'hevc_encoding': False, 'model': 'Unknown', 'videotoolbox': False}
+        
+        if result.returncode == 0:
+            output = result.stdout
+            
+            if 'AMD' in output or 'Radeon' in output:
+                if 'RX 6600' in output:
+                    gpu_info['model'] = 'AMD RX 6600'
+                elif 'Radeon' in output:
+                    gpu_info['model'] = 'AMD Radeon'
+                else:
+                    gpu_info['model'] = 'AMD GPU'
+                gpu_info['available'] = True
+            elif 'Intel' in output:
+                gpu_info['model'] = 'Intel GPU'
+                gpu_info['available'] = True
+            elif 'Apple' in output or 'M1' in output or 'M2' in output or 'M3' in output:
+                if 'M1' in output:
+                    gpu_info['model'] = 'Apple M1'
+                elif 'M2' in output:
+                    gpu_info['model'] = 'Apple M2'
+                elif 'M3' in output:
+                    gpu_info['model'] = 'Apple M3'
+                else:
+                    gpu_info['model'] = 'Apple Silicon'
+                gpu_info['available'] = True
+                gpu_info['hevc_encoding'] = True
+        
+        gpu_info['videotoolbox'] = True
+        if gpu_info['available']:
+            gpu_info['hevc_encoding'] = True
+        
+        return gpu_info
+        
+    except Exception as e:
+        logger.error(f"Error checking macOS GPU: {e}")
+        return {'model': 'Unknown', 'available': False, 'hevc_encoding': False, 'videotoolbox': False}
+
+# Check FFmpeg capabilities
+def get_ffmpeg_encoders():
+    """Parse `ffmpeg -encoders` into the set of encoder names this build provides"""
+    try:
+        result = subprocess.run([FFMPEG_PATH, '-hide_banner', '-encoders'],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            return []
+        
+        # Encoder lines look like " V....D libx264   libx264 H.264 / AVC / MPEG-4 AVC"
+        encoders = re.findall(r'^\s*[VAS][A-Z.]{5}\s+(\S+)', result.stdout, re.MULTILINE)
+        return sorted(set(encoders) - {'='})
+    except Exception as e:
+        logger.error(f"Error listing FFmpeg encoders: {e}")
+        return []
+
+def check_ffmpeg():
+    """Check FFmpeg version and available encoders"""
+    try:
+        version_result = subprocess.run([FFMPEG_PATH, '-version'], 
+                                      stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        
+        if version_result.returncode != 0:
+            return {'available': False}
+        
+        version_match = re.search(r'ffmpeg version ([^ ]+)', version_result.stdout)
+        version = version_match.group(1) if version_match else "Unknown"
+        
+        return {
+            'available': True,
+            'version': version,
+            'encoders': get_ffmpeg_encoders()
+        }
+    except Exception as e:
+        logger.error(f"Error checking FFmpeg: {e}")
+        return {'available': False}
+
+def video_encoder_probe_key():
+    """Usable hardware encoders depend on both the ffmpeg build and the machine"""
+    ffmpeg_key = ffmpeg_probe_key()
+    return f"{ffmpeg_key}|{gpu_probe_key()}" if ffmpeg_key else None
+
+# Probes run lazily on first use, or in the background once start_probes() is called
+GPU_PROBE = LazyProbe('gpu', check_macos_gpu, gpu_probe_key,
+                      {'model': 'Unknown', 'available': False, 'hevc_encoding': False, 'videotoolbox': False})
+FFMPEG_PROBE = LazyProbe('ffmpeg', check_ffmpeg, ffmpeg_probe_key, {'available': False})
+
+def start_probes():
+    """Kick off the hardware and ffmpeg probes without waiting for them"""
+    GPU_PROBE.start()
+    FFMPEG_PROBE.start()
+
+# Output modes for merging adaptive video and audio streams
+OUTPUT_MODES = {
+    'Remux (Original Quality)': 'remux',
+    'Transcode (HEVC)': 'transcode'
+}
+DEFAULT_OUTPUT_MODE = 'remux'
+
+# Codecs each output container can hold without re-encoding
+CONTAINER_CODECS = {
+    'mp4': ('avc1', 'avc3', 'hev1', 'hvc1', 'av01', 'vp09', 'mp4a', 'opus', 'ac-3', 'ec-3')
+}
+
+# Video encoder backends ranked fastest first: hardware encoders, then software fallbacks
+ENCODER_BACKENDS = [
+    {'name': 'hevc_videotoolbox', 'label': 'VideoToolbox', 'codec': 'hevc', 'hardware': True,
+     'args': ['-c:v', 'hevc_videotoolbox', '-b:v', '6M']},
+    {'name': 'hevc_nvenc', 'label': 'NVENC', 'codec': 'hevc', 'hardware': True,
+     'args': ['-c:v', 'hevc_nvenc', '-preset', 'p4', '-b:v', '6M']},
+    {'name': 'hevc_qsv', 'label': 'Quick Sync', 'codec': 'hevc', 'hardware': True,
+     'args': ['-c:v', 'hevc_qsv', '-b:v', '6M']},
+    {'name': 'hevc_amf', 'label': 'AMF', 'codec': 'hevc', 'hardware': True,
+     'args': ['-c:v', 'hevc_amf', '-b:v', '6M']},
+    {'name': 'hevc_vaapi', 'label': 'VA-API', 'codec': 'hevc', 'hardware': True,
+     'input_args': ['-vaapi_device', '/dev/dri/renderD128'],
+     'args': ['-vf', 'format=nv12,hwupload', '-c:v', 'hevc_vaapi', '-b:v', '6M']},
+    {'name': 'libx265', 'label': 'libx265', 'codec': 'hevc', 'hardware': False,
+     'args': ['-c:v', 'libx265', '-preset', 'medium', '-crf', '26']},
+    {'name': 'libx264', 'label': 'libx264', 'codec': 'h264', 'hardware': False,
+     'args': ['-c:v', 'libx264', '-preset', 'medium', '-crf', '23']},
+    {'name': 'copy', 'label': 'Stream Copy', 'codec': None, 'hardware': False,
+     'args': ['-c:v', 'copy']}
+]
+
+def probe_encoder(backend):
+    """Run a tiny test encode to confirm a hardware encoder actually works on this machine"""
+    try:
+        command = [
+            FFMPEG_PATH, '-hide_banner', '-loglevel', 'error',
+            *backend.get('input_args', []),
+            '-f', 'lavfi', '-i', 'color=c=black:s=256x256:d=0.1',
+            *backend['args'],
+            '-frames:v', '1', '-f', 'null', '-'
+        ]
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=15)
+        return result.returncode == 0
+    except Exception as e:
+        logger.warning(f"Encoder probe for {backend['name']} failed: {e}")
+        return False
+
+def find_video_encoder():
+    """Name the fastest encoder backend available in this ffmpeg build"""
+    available = set(FFMPEG_PROBE.result().get('encoders', []))
+    
+    for backend in ENCODER_BACKENDS:
+        if backend['name'] == 'copy':
+            break
+        if backend['name'] not in available:
+            continue
+        # Hardware encoders can be compiled in without a usable device, so test them
+        if backend['hardware'] and not probe_encoder(backend):
+            logger.info(f"Encoder {backend['name']} is listed but not usable, skipping")
+            continue
+        logger.info(f"Selected video encoder: {backend['name']}")
+        return backend['name']
+    
+    logger.warning("No video encoder available, falling back to stream copy")
+    return 'copy'
+
+# Test encodes fork ffmpeg once per hardware backend, so the winner is cached too
+ENCODER_PROBE = LazyProbe('video_encoder', find_video_encoder, video_encoder_probe_key, 'copy')
+
+def select_video_encoder():
+    """Pick the fastest encoder backend available in this ffmpeg build"""
+    name = ENCODER_PROBE.result()
+    return next((backend for backend in ENCODER_BACKENDS if backend['name'] == name), ENCODER_BACKENDS[-1])
+
+def can_stream_copy(codecs, container='mp4'):
+    """Check whether every codec in a stream can be copied into the container as-is"""
+    allowed = CONTAINER_CODECS.get(container, ())
+    return bool(codecs) and all(codec.split('.')[0].lower() in allowed for codec in codecs)
+
+class JobCancelled(Exception):
+    """Raised inside a job's transfers and ffmpeg runs once the job has been cancelled"""
+
+class JobDeferred(Exception):
+    """Raised by a queue runner to park a job without holding a worker
+    
+    The queue passes a callback to register(callback); calling it puts the
+    job back in line to run again from the start.
+    """
+    
+    def __init__(self, message, register):
+        super().__init__(message)
+        self.register = register
+
+class TransferPaused(Exception):
+    """Raised inside a job's transfers once it is paused, so they close their connection until it resumes"""
+
+class FFmpegProcess:
+    """Run ffmpeg as a managed child process with live progress, cancellation and timeouts
+    
+    Progress comes from `-progress pipe:1` blocks on stdout and is passed to
+    on_progress as a dict with frame, fps, speed, seconds and percent (of
+    `duration`, or of the first input's duration as ffmpeg reports it).
+    Only the last FFMPEG_STDERR_LINES lines of stderr are kept, so a long
+    encode can't pile up its log in memory.
+    """
+    
+    def __init__(self, command, duration=None, on_progress=None, cancel_event=None, timeout=None,
+                 stall_timeout=FFMPEG_STALL_TIMEOUT):
+        self.command = [command[0], '-nostats', '-progress', 'pipe:1', *command[1:]]
+        self.duration = duration
+        self.on_progress = on_progress
+        self.cancel_event = cancel_event
+        self.timeout = timeout
+        self.stall_timeout = stall_timeout
+        self.stderr_tail = collections.deque(maxlen=FFMPEG_STDERR_LINES)
+        self.progress = {}
+        self.cancelled = False
+        self.timed_out = False
+        self.last_output = time.monotonic()
+        self.process = None
+    
+    def run(self):
+        """Run ffmpeg to completion, returning its exit code"""
+        self.process = subprocess.Popen(self.command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE, text=True, errors='replace')
+        readers = [threading.Thread(target=self.read_progress, daemon=True),
+                   threading.Thread(target=self.read_stderr, daemon=True)]
+        for reader in readers:
+            reader.start()
+        
+        started = time.monotonic()
+        try:
+            while True:
+                try:
+                    self.process.wait(timeout=0.25)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                
+                now = time.monotonic()
+                if self.cancel_event and self.cancel_event.is_set():
+                    self.cancelled = True
+                elif self.timeout and now - started > self.timeout:
+                    self.timed_out = True
+                elif self.stall_timeout and now - self.last_output > self.stall_timeout:
+                    self.timed_out = True
+                if self.cancelled or self.timed_out:
+                    self.stop()
+                    break
+        finally:
+            if self.process.poll() is None:
+                self.process.kill()
+                self.process.wait()
+            for reader in readers:
+                reader.join(timeout=FFMPEG_STOP_GRACE)
+        return self.process.returncode
+    
+    def stop(self):
+        """Ask ffmpeg to exit, killing it if it doesn't within FFMPEG_STOP_GRACE seconds"""
+        if not self.process or self.process.poll() is not None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=FFMPEG_STOP_GRACE)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+    
+    def read_progress(self):
+        """Parse key=value progress blocks, each ending with a progress= line"""
+        block = {}
+        for line in self.process.stdout:
+            self.last_output = time.monotonic()
+            key, _, value = line.strip().partition('=')
+            block[key] = value
+            if key == 'progress':
+                self.progress = self.parse_progress(block)
+                block = {}
+                if self.on_progress:
+                    try:
+                        self.on_progress(self.progress)
+                    except Exception as e:
+                        logger.warning(f"FFmpeg progress callback failed: {e}")
+    
+    def read_stderr(self):
+        """Keep a bounded tail of stderr, picking up the input duration when none was given"""
+        for line in self.process.stderr:
+            self.last_output = time.monotonic()
+            line = line.rstrip()
+            if line:
+                self.stderr_tail.append(line)
+            if not self.duration:
+                match = re.search(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)', line)
+                if match:
+                    hours, minutes, seconds = match.groups()
+                    self.duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    
+    def parse_progress(self, block):
+        """Turn one raw progress block into numbers, None where ffmpeg reports N/A"""
+        def number(key, cast=float):
+            try:
+                return cast(block.get(key, '').rstrip('x'))
+            except ValueError:
+                return None
+        
+        # out_time_ms is also in microseconds in every ffmpeg that prints it
+        out_time = number('out_time_us', int)
+        if out_time is None:
+            out_time = number('out_time_ms', int)
+        seconds = out_time / 1e6 if out_time is not None else None
+        percent = None
+        if seconds is not None and self.duration:
+            percent = max(0.0, min(100.0, seconds / self.duration * 100))
+        return {
+            'frame': number('frame', int),
+            'fps': number('fps'),
+            'speed': number('speed'),
+            'seconds': seconds,
+            'percent': 100.0 if block.get('progress') == 'end' else percent,
+            'done': block.get('progress') == 'end'
+        }
+    
+    def error_text(self):
+        """The captured stderr tail as one string"""
+        return '\n'.join(self.stderr_tail)
+
+class PostProcessor:
+    """Run ffmpeg merges on worker pools separate from downloads, so networking and encoding overlap
+    
+    Each kind of work gets its own lane: stream-copy remuxes are cheap and
+    disk-bound, hardware encoders only offer a few concurrent sessions, and
+    CPU encodes split CPU_THREADS between them instead of oversubscribing.
+    """
+    
+    def __init__(self):
+        self.lanes = {
+            'remux': REMUX_WORKERS,
+            'hardware': HARDWARE_ENCODE_SESSIONS,
+            'software': max(1, CPU_THREADS // SOFTWARE_ENCODE_THREADS)
+        }
+        self.executors = {}
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def lane_for(encoder):
+        """Lane for a merge whose video uses the given encoder backend, None meaning stream copy"""
+        if not encoder or encoder['name'] == 'copy':
+            return 'remux'
+        return 'hardware' if encoder['hardware'] else 'software'
+    
+    @staticmethod
+    def encoder_threads(encoder):
+        """ffmpeg -threads value for an encode, 0 letting ffmpeg decide"""
+        if encoder and not encoder['hardware'] and encoder['name'] != 'copy':
+            return SOFTWARE_ENCODE_THREADS
+        return 0
+    
+    def submit(self, lane, fn, *args, **kwargs):
+        """Queue fn on the lane's pool, returning its Future"""
+        with self.lock:
+            executor = self.executors.get(lane)
+            if executor is None:
+                executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.lanes[lane],
+                                                                 thread_name_prefix=f'postprocess-{lane}')
+                self.executors[lane] = executor
+        return executor.submit(fn, *args, **kwargs)
+    
+    def shutdown(self, wait=True):
+        """Stop accepting work, optionally waiting for queued merges"""
+        with self.lock:
+            executors = list(self.executors.values())
+            self.executors.clear()
+        for executor in executors:
+            executor.shutdown(wait=wait)
+
+# Encode policy configuration
+ENCODE_BITRATES = {  # HEVC target bits per second at up to 30 fps, by the smallest height that fits
+    144: 200_000, 240: 400_000, 360: 700_000, 480: 1_200_000, 720: 2_500_000,
+    1080: 5_000_000, 1440: 9_000_000, 2160: 16_000_000, 4320: 40_000_000
+}
+ENCODE_CRF = {360: 24, 480: 24, 720: 25, 1080: 26, 1440: 27, 2160: 28, 4320: 28}  # libx265 CRF by height
+CRF_OFFSETS = {'hevc': 0, 'h264': -3}  # Shift from the HEVC CRF scale to the encoder's codec
+CODEC_EFFICIENCY = {'h264': 1.0, 'hevc': 1.5, 'vp9': 1.5, 'av1': 2.0}  # Quality per bit relative to H.264
+HIGH_FPS_BITRATE_FACTOR = 1.5  # Extra bitrate for sources above 30 fps
+ENCODE_SKIP_TOLERANCE = 1.15  # Copy a source already in the target codec unless it exceeds the target by more than this
+ENCODE_MIN_BITRATE = 100_000  # Floor for tiny or very low bitrate sources
+CODEC_FAMILIES = {'avc1': 'h264', 'avc3': 'h264', 'h264': 'h264', 'hvc1': 'hevc', 'hev1': 'hevc', 'hevc': 'hevc',
+                  'vp09': 'vp9', 'vp9': 'vp9', 'av01': 'av1', 'av1': 'av1'}
+
+def codec_family(codecs):
+    """Map codec strings such as avc1.640028 or ffmpeg names such as hevc to a codec family"""
+    for codec in codecs or ():
+        family = CODEC_FAMILIES.get(codec.split('.')[0].lower())
+        if family:
+            return family
+    return None
+
+def video_source(stream):
+    """Describe a pytubefix video stream for the encode policy, None where a field is unknown"""
+    resolution = getattr(stream, 'resolution', None) or ''
+    height = resolution.rstrip('p')
+    return {
+        'codecs': list(getattr(stream, 'codecs', None) or []),
+        'height': int(height) if height.isdigit() else None,
+        'fps': getattr(stream, 'fps', None),
+        'bitrate': getattr(stream, 'bitrate', None)
+    }
+
+def probe_video_source(path):
+    """Read a local file's video codec, height, fps and bitrate from ffmpeg's input summary"""
+    source = {'codecs': [], 'height': None, 'fps': None, 'bitrate': None}
+    try:
+        result = subprocess.run([FFMPEG_PATH, '-hide_banner', '-i', path], stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, text=True, errors='replace', timeout=30)
+    except Exception as e:
+        logger.warning(f"Could not probe {os.path.basename(path)}: {e}")
+        return source
+    
+    for line in result.stderr.splitlines():
+        match = re.search(r'Stream #\d+:\d+.*?: Video: (\w+)', line)
+        if not match:
+            continue
+        # Prefer the container tag (hvc1, avc1) over the ffmpeg codec name, as stream metadata uses
+        tag = re.search(r'\((\w{4}) / 0x', line)
+        source['codecs'] = [tag.group(1) if tag else match.group(1)]
+        size = re.search(r', (\d{2,5})x(\d{2,5})', line)
+        fps = re.search(r', ([\d.]+) fps', line)
+        bitrate = re.search(r', (\d+) kb/s', line)
+        source['height'] = int(size.group(2)) if size else None
+        source['fps'] = float(fps.group(1)) if fps else None
+        source['bitrate'] = int(bitrate.group(1)) * 1000 if bitrate else None
+        break
+    return source
+
+def lookup_by_height(table, height):
+    """Value for the smallest height in table that fits, the largest entry for anything bigger"""
+    for limit in sorted(table):
+        if height <= limit:
+            return table[limit]
+    return table[max(table)]
+
+def target_bitrate(source, codec):
+    """Bits per second worth spending on source in codec, never more than the source itself carries"""
+    target = lookup_by_height(ENCODE_BITRATES, source.get('height') or 1080)
+    target *= CODEC_EFFICIENCY['hevc'] / CODEC_EFFICIENCY.get(codec, 1.0)
+    if (source.get('fps') or 0) > 30:
+        target *= HIGH_FPS_BITRATE_FACTOR
+    
+    # Re-encoding can't add detail, so cap at the source's bitrate converted to the target codec
+    source_codec = codec_family(source.get('codecs'))
+    if source.get('bitrate') and source_codec:
+        equivalent = source['bitrate'] * CODEC_EFFICIENCY.get(source_codec, 1.0) / CODEC_EFFICIENCY.get(codec, 1.0)
+        target = min(target, equivalent)
+    return int(max(ENCODE_MIN_BITRATE, target))
+
+def rate_control_args(backend, source):
+    """The backend's video arguments with bitrate or CRF scaled to the source"""
+    args = list(backend['args'])
+    bitrate = target_bitrate(source, backend['codec'])
+    if '-b:v' in args:
+        args[args.index('-b:v') + 1] = str(bitrate)
+    if '-crf' in args:
+        crf = lookup_by_height(ENCODE_CRF, source.get('height') or 1080) + CRF_OFFSETS.get(backend['codec'], 0)
+        args[args.index('-crf') + 1] = str(crf)
+    # Cap peaks so constant-quality encodes of noisy sources can't balloon past the target
+    return [*args, '-maxrate', str(int(bitrate * 1.5)), '-bufsize', str(bitrate * 2)], bitrate
+
+def plan_video_encode(mode, source, container='mp4'):
+    """Decide how a merge treats the video: stream copy, or an encode sized to the source
+    
+    Returns a dict with the encoder backend (None for copy), the resulting
+    codec family, the ffmpeg input and video arguments, and a short summary.
+    """
+    copy = {'encoder': None, 'codec': codec_family(source.get('codecs')), 'input_args': [],
+            'args': ['-c:v', 'copy'], 'summary': 'stream copy'}
+    copyable = can_stream_copy(source.get('codecs'), container)
+    if mode == 'remux' and copyable:
+        return copy
+    
+    encoder = select_video_encoder()
+    if encoder['name'] == 'copy':
+        return copy
+    
+    # A source already in the target codec at or below the target bitrate gains nothing from re-encoding
+    if copyable and copy['codec'] == encoder['codec']:
+        bitrate = source.get('bitrate')
+        if not bitrate or bitrate <= target_bitrate(source, encoder['codec']) * ENCODE_SKIP_TOLERANCE:
+            copy['summary'] = f"stream copy, source is already {encoder['codec'].upper()}"
+            return copy
+    
+    args, bitrate = rate_control_args(encoder, source)
+    return {'encoder': encoder, 'codec': encoder['codec'], 'input_args': encoder.get('input_args', []),
+            'args': args, 'summary': f"{encoder['codec'].upper()} at {bitrate / 1e6:.1f} Mbps"}
+
+def check_writable(folder):
+    """Fail fast with a clear error when files can't be created in folder"""
+    try:
+        with tempfile.TemporaryFile(dir=folder):
+            pass
+    except OSError as e:
+        raise OSError(e.errno, f"Can't write to {folder}: {e.strerror or e}") from e
+
+def partial_path(path):
+    """Hidden name a file is written under until it is complete, keeping the extension ffmpeg picks the muxer from"""
+    path = Path(path)
+    return path.with_name(f".{path.stem}{PARTIAL_SUFFIX}{path.suffix}")
+
+def atomic_move(source, destination):
+    """Move a finished file into place so destination only ever appears complete
+    
+    A rename is atomic within a volume. Across volumes the file is first
+    copied to a hidden partial name next to destination and then renamed.
+    """
+    try:
+        os.replace(source, destination)
+        return destination
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    
+    staging = partial_path(destination)
+    try:
+        shutil.copyfile(source, staging)
+        os.replace(staging, destination)
+    except Exception:
+        with contextlib.suppress(OSError):
+            os.remove(staging)
+        raise
+    os.remove(source)
+    return destination
+
+class DiskTooSmallError(OSError):
+    """Raised when a job needs more space than a volume could ever free, so waiting for room is pointless"""
+
+class DiskSpaceGate:
+    """Reserve disk space for jobs before they transfer anything, parking jobs until their volumes have room
+    
+    Reservations are kept per device, so concurrent jobs writing to the same
+    volume can't each see the same free space and overfill it together.
+    A job holds its reservation until it completes or fails. Jobs that don't
+    fit are deferred: the gate calls them back once space frees up, from a
+    release or a poll every poll_interval seconds, so no worker waits on them.
+    Jobs larger than a whole volume, less the reserve, fail with DiskTooSmallError.
+    """
+    
+    def __init__(self, reserve=DISK_SPACE_RESERVE, poll_interval=DISK_SPACE_POLL_INTERVAL):
+        self.reserve = reserve
+        self.poll_interval = poll_interval
+        self.reservations = {}  # job id -> {device: bytes}
+        self.waiters = []  # (job, needs, callback) in the order they were deferred
+        self.poll_timer = None
+        self.lock = threading.RLock()
+    
+    def shortfalls(self, job_id, needs):
+        """(folder, needed, available) for each volume in needs that lacks room
+        
+        Raises DiskTooSmallError when a volume could not hold the job even if it were empty.
+        """
+        # Folders on the same volume draw on the same free space
+        volumes = {}
+        for folder, size in needs.items():
+            device = os.stat(folder).st_dev
+            first, total = volumes.get(device, (folder, 0))
+            volumes[device] = (first, total + size)
+        
+        missing = []
+        for device, (folder, size) in volumes.items():
+            with self.lock:
+                reserved = sum(devices.get(device, 0) for other, devices in self.reservations.items() if other != job_id)
+            usage = psutil.disk_usage(folder)
+            if size > usage.total - self.reserve:
+                raise DiskTooSmallError(f"Not enough room on the volume of {folder}: needs {format_bytes(size)}, "
+                                        f"but it holds {format_bytes(usage.total)} and {format_bytes(self.reserve)} is kept free")
+            available = usage.free - reserved - self.reserve
+            if size > available:
+                missing.append((folder, size, max(0, available)))
+        return missing
+    
+    def try_acquire(self, job, needs):
+        """Hold the space in needs ({folder: bytes}) for the job if every folder has room, returning the shortfalls"""
+        with self.lock:
+            missing = self.shortfalls(job.id, needs)
+            if not missing:
+                devices = collections.Counter()
+                for folder, size in needs.items():
+                    devices[os.stat(folder).st_dev] += size
+                self.reservations[job.id] = dict(devices)
+            return missing
+    
+    def defer(self, job, needs, callback):
+        """Call callback() once needs fits, with the space already held, or once the job is cancelled"""
+        with self.lock:
+            self.waiters.append((job, needs, callback))
+        self.check_waiters()
+    
+    def check_waiters(self):
+        """Call back deferred jobs that fit now, in the order they were deferred"""
+        ready = []
+        with self.lock:
+            for waiter in list(self.waiters):
+                job, needs, callback = waiter
+                try:
+                    fits = job.cancel_event.is_set() or not self.try_acquire(job, needs)
+                except OSError as e:
+                    # Let the job run again and report the problem itself, including a volume that is too small
+                    logger.warning(f"Disk space check failed for job {job.id}: {e}")
+                    fits = True
+                if fits:
+                    self.waiters.remove(waiter)
+                    ready.append(callback)
+            
+            if self.waiters and not self.poll_timer:
+                # Space can also be freed outside the app, so keep polling while jobs wait
+                self.poll_timer = threading.Timer(self.poll_interval, self.poll)
+                self.poll_timer.daemon = True
+                self.poll_timer.start()
+        
+        for callback in ready:
+            callback()
+    
+    def poll(self):
+        with self.lock:
+            self.poll_timer = None
+        self.check_waiters()
+    
+    def release(self, job):
+        """Give back a finished job's space and let deferred jobs re-check"""
+        with self.lock:
+            self.reservations.pop(job.id, None)
+        self.check_waiters()
+    
+    def wake(self):
+        """Make deferred jobs re-check now, e.g. after a cancellation"""
+        self.check_waiters()
+
+class RangeNotSupportedError(Exception):
+    """Raised when a server ignores HTTP Range requests"""
+
+def backoff_delay(attempt, base=HTTP_BACKOFF_BASE, maximum=HTTP_BACKOFF_MAX):
+    """Exponential backoff with jitter, so parallel transfers don't retry in lockstep"""
+    delay = min(maximum, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def create_http_session(pool_size=HTTP_POOL_SIZE, retries=HTTP_RETRIES):
+    """Create a keep-alive session that retries failed connections and retryable statuses with backoff"""
+    retry_options = dict(total=retries, status_forcelist=HTTP_RETRY_STATUSES, allowed_methods=['GET', 'HEAD'],
+                         backoff_factor=HTTP_BACKOFF_BASE, raise_on_status=False, respect_retry_after_header=True)
+    try:
+        retry = requests.adapters.Retry(**retry_options, backoff_max=HTTP_BACKOFF_MAX, backoff_jitter=HTTP_BACKOFF_BASE)
+    except TypeError:
+        # urllib3 1.x has no jitter or configurable maximum
+        retry = requests.adapters.Retry(**retry_options)
+    
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    """Session shared by every transfer, so connections and TLS sessions stay warm between requests"""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            _http_session = create_http_session()
+        return _http_session
+
+class HostLimiter:
+    """Cap the number of simultaneous requests to each host"""
+    
+    def __init__(self, limit=HTTP_HOST_CONCURRENCY):
+        self.limit = max(1, limit)
+        self.slots = {}
+        self.lock = threading.Lock()
+    
+    def slot(self, url):
+        """Semaphore for url's host, held with `with limiter.slot(url):` for the whole request"""
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            if host not in self.slots:
+                self.slots[host] = threading.BoundedSemaphore(self.limit)
+            return self.slots[host]
+
+HOST_LIMITER = HostLimiter()
+
+class TokenBucket:
+    """Token bucket refilled at `rate` bytes per second, holding at most `burst`; a rate of 0 is unlimited"""
+    
+    def __init__(self, rate=0, burst=None):
+        self.lock = threading.Lock()
+        self.tokens = 0
+        self.updated = time.monotonic()
+        self.set_rate(rate, burst)
+    
+    def set_rate(self, rate, burst=None):
+        """Change the rate, keeping at most one burst of saved-up tokens"""
+        with self.lock:
+            self.rate = max(0, rate or 0)
+            self.burst = burst or self.rate
+            self.tokens = min(self.tokens, self.burst)
+    
+    def try_consume(self, amount):
+        """Take amount tokens unless the bucket is in debt, otherwise return the seconds until it isn't
+        
+        Chunks larger than the burst are allowed to overdraw the bucket, so the
+        average rate stays right whatever the read size.
+        """
+        with self.lock:
+            if not self.rate:
+                return 0
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 0:
+                self.tokens -= amount
+                return 0
+            return -self.tokens / self.rate
+    
+    def consume(self, amount):
+        """Block until amount tokens have been taken"""
+        while True:
+            wait = self.try_consume(amount)
+            if not wait:
+                return
+            time.sleep(wait)
+
+class BandwidthScheduler:
+    """Share bandwidth between running jobs with a global cap, per-job caps, priorities and pausing
+    
+    Downloaders call acquire(job, size) for every chunk they read. When the
+    global cap is the bottleneck, waiting priority classes are served in
+    proportion to PRIORITY_WEIGHTS, so a large low-priority job can't starve
+    small ones. Transfers that can reopen their request at an offset use a
+    JobThrottle: a pause makes them drop the connection and its host slot
+    and wait in wait_resumed. Others, like pytubefix, block in acquire.
+    """
+    
+    def __init__(self, rate=BANDWIDTH_LIMIT, job_rate=JOB_BANDWIDTH_LIMIT):
+        self.bucket = TokenBucket(rate)
+        self.job_rate = job_rate
+        self.job_buckets = {}
+        self.paused = set()
+        self.waiting = {priority: 0 for priority in PRIORITY_WEIGHTS}
+        self.virtual_time = {priority: 0.0 for priority in PRIORITY_WEIGHTS}
+        self.condition = threading.Condition()
+    
+    def set_rate(self, rate):
+        """Change the global cap in bytes per second, 0 for unlimited"""
+        self.bucket.set_rate(rate)
+        with self.condition:
+            self.condition.notify_all()
+    
+    def set_job_rate(self, job, rate):
+        """Change one job's cap in bytes per second, 0 for unlimited"""
+        job.rate_limit = rate
+        with self.condition:
+            bucket = self.job_buckets.get(job.id)
+        if bucket:
+            bucket.set_rate(rate)
+    
+    def pause(self, job):
+        """Hold the job's transfers at their next chunk"""
+        with self.condition:
+            self.paused.add(job.id)
+            self.condition.notify_all()
+    
+    def resume(self, job):
+        """Let a paused job's transfers continue"""
+        with self.condition:
+            self.paused.discard(job.id)
+            self.condition.notify_all()
+    
+    def is_paused(self, job):
+        with self.condition:
+            return job.id in self.paused
+    
+    def release(self, job):
+        """Forget a finished job's state"""
+        with self.condition:
+            self.job_buckets.pop(job.id, None)
+            self.paused.discard(job.id)
+    
+    def wait_resumed(self, job):
+        """Block while job is paused, raising JobCancelled if it is cancelled meanwhile"""
+        with self.condition:
+            while job.id in self.paused and not job.cancel_event.is_set():
+                self.condition.wait()
+            if job.cancel_event.is_set():
+                raise JobCancelled(f"Job {job.id} was cancelled")
+    
+    def acquire(self, job, amount, hold=True):
+        """Block until job may transfer amount bytes
+        
+        A paused job blocks here, or raises TransferPaused when hold is False.
+        """
+        priority = job.priority if job.priority in PRIORITY_WEIGHTS else DEFAULT_PRIORITY
+        with self.condition:
+            if not hold and job.id in self.paused:
+                raise TransferPaused(f"Job {job.id} was paused")
+            self.wait_resumed(job)
+            rate = job.rate_limit if job.rate_limit is not None else self.job_rate
+            job_bucket = self.job_buckets.get(job.id)
+            if job_bucket is None and rate:
+                job_bucket = self.job_buckets[job.id] = TokenBucket(rate)
+        
+        if job_bucket:
+            job_bucket.consume(amount)
+        if not self.bucket.rate:
+            return
+        
+        with self.condition:
+            self.join_turns(priority)
+            try:
+                while True:
+                    if job.id in self.paused:
+                        if not hold:
+                            raise TransferPaused(f"Job {job.id} was paused")
+                        # A paused job leaves the rotation, so its class can't take turns it won't use
+                        self.leave_turns(priority)
+                        try:
+                            self.wait_resumed(job)
+                        finally:
+                            self.join_turns(priority)
+                        continue
+                    # The waiting class that has received the least weighted bandwidth goes next
+                    turn = min((p for p, count in self.waiting.items() if count), key=lambda p: self.virtual_time[p])
+                    if turn != priority:
+                        self.condition.wait()
+                        continue
+                    wait = self.bucket.try_consume(amount)
+                    if not wait:
+                        self.virtual_time[priority] += amount / PRIORITY_WEIGHTS[priority]
+                        return
+                    self.condition.wait(wait)
+            finally:
+                self.leave_turns(priority)
+    
+    def join_turns(self, priority):
+        """Count a waiter in its class; call with the condition held"""
+        # A class that was idle starts level with the busiest, not with its old credit
+        if not self.waiting[priority]:
+            active = [self.virtual_time[p] for p, count in self.waiting.items() if count]
+            if active:
+                self.virtual_time[priority] = max(self.virtual_time[priority], min(active))
+        self.waiting[priority] += 1
+    
+    def leave_turns(self, priority):
+        """Stop counting a waiter and let the others recheck whose turn it is; call with the condition held"""
+        self.waiting[priority] -= 1
+        self.condition.notify_all()
+
+class JobThrottle:
+    """Per-chunk callback charging one job's transfers to a BandwidthScheduler
+    
+    Calling it with a chunk size raises TransferPaused instead of blocking
+    while the job is paused; wait() then holds the caller until it resumes.
+    """
+    
+    def __init__(self, scheduler, job):
+        self.scheduler = scheduler
+        self.job = job
+    
+    def __call__(self, size):
+        self.scheduler.acquire(self.job, size, hold=False)
+    
+    def wait(self):
+        """Block while the job is paused, before a request is opened"""
+        self.scheduler.wait_resumed(self.job)
+
+class SegmentedDownloader:
+    """Download a file over several parallel HTTP range requests into a preallocated file
+    
+    Progress is recorded in a sidecar manifest next to the partial file so an
+    interrupted download resumes from the ranges that were already completed.
+    """
+    
+    def __init__(self, connections=SEGMENT_CONNECTIONS, segment_size=SEGMENT_SIZE, session=None, throttle=None):
+        self.connections = max(1, connections)
+        self.segment_size = max(1, segment_size)
+        self.session = session or get_http_session()
+        # Called with each chunk's size before it is written, e.g. a JobThrottle
+        self.throttle = throttle
+    
+    def split_ranges(self, total_size):
+        """Split a file size into inclusive (start, end) byte ranges"""
+        return [(start, min(start + self.segment_size, total_size) - 1)
+                for start in range(0, total_size, self.segment_size)]
+    
+    @staticmethod
+    def manifest_path(path):
+        """Sidecar file holding the partial download state for path"""
+        return f"{path}{MANIFEST_SUFFIX}"
+    
+    def read_manifest(self, path):
+        """Return the saved state for path, or None when there is none or it can't be read"""
+        manifest_file = self.manifest_path(path)
+        if not os.path.exists(manifest_file) or not os.path.exists(path):
+            return None
+        
+        try:
+            with open(manifest_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable download manifest {manifest_file}: {e}")
+            return None
+    
+    @staticmethod
+    def matches_disk(path, manifest):
+        """Whether the file on disk is long enough to hold every range the manifest records"""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return False
+        return all(end < size for start, end in manifest.get('completed', []))
+    
+    def load_manifest(self, path, itag, total_size, mode):
+        """Return the saved state for path if it matches this unfinished download, otherwise None"""
+        manifest = self.read_manifest(path)
+        if (manifest is None or manifest.get('complete') or manifest.get('itag') != itag or
+                manifest.get('size') != total_size or manifest.get('mode') != mode or
+                manifest.get('segment_size') != self.segment_size):
+            return None
+        if not self.matches_disk(path, manifest):
+            logger.warning(f"Partial file is shorter than its manifest, starting over: {os.path.basename(path)}")
+            return None
+        return manifest
+    
+    def save_manifest(self, path, manifest):
+        """Atomically write the partial download state for path"""
+        manifest_file = self.manifest_path(path)
+        temp_file = f"{manifest_file}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temp_file, manifest_file)
+    
+    def mark_complete(self, path, manifest):
+        """Record that every byte of path was written, so a later run can reuse it"""
+        manifest['complete'] = True
+        self.save_manifest(path, manifest)
+    
+    @classmethod
+    def clear_manifest(cls, path):
+        """Remove the download state once the file has been used or moved"""
+        try:
+            os.remove(cls.manifest_path(path))
+        except FileNotFoundError:
+            pass
+    
+    @classmethod
+    def discard(cls, path):
+        """Remove a partial file and its state, so a preallocated file of zeros is never mistaken for data"""
+        cls.clear_manifest(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    
+    def is_complete(self, path, total_size, itag=None):
+        """A file is finished only when its manifest records a verified full write of the expected size"""
+        manifest = self.read_manifest(path)
+        return (manifest is not None and manifest.get('complete', False) and manifest.get('itag') == itag
+                and manifest.get('size') == total_size and os.path.getsize(path) == total_size
+                and self.matches_disk(path, manifest))
+    
+    def download(self, url, path, total_size, on_progress=None, itag=None):
+        """Download url to path, calling on_progress(bytes_downloaded) as data arrives
+        
+        The manifest is kept, marked complete, once the file is fully written;
+        callers clear it when they are done with the file.
+        """
+        if total_size and self.is_complete(path, total_size, itag):
+            logger.info(f"Already downloaded, skipping: {os.path.basename(path)}")
+            if on_progress:
+                on_progress(total_size)
+            return path
+        
+        if not total_size or total_size <= self.segment_size or self.connections == 1:
+            return self.download_single(url, path, total_size, on_progress, itag)
+        
+        manifest = self.load_manifest(path, itag, total_size, 'segmented')
+        if manifest is None:
+            manifest = {'url': url, 'itag': itag, 'size': total_size, 'mode': 'segmented',
+                        'segment_size': self.segment_size, 'completed': []}
+            self.save_manifest(path, manifest)
+            self.preallocate(path, total_size)
+        else:
+            # Signed URLs expire, so always resume with the freshly resolved one
+            manifest['url'] = url
+            logger.info(f"Resuming {os.path.basename(path)} with {len(manifest['completed'])} ranges done")
+        
+        completed = {tuple(completed_range) for completed_range in manifest['completed']}
+        ranges = [r for r in self.split_ranges(total_size) if r not in completed]
+        
+        lock = threading.Lock()
+        stop_event = threading.Event()
+        downloaded = [sum(end - start + 1 for start, end in completed)]
+        if on_progress:
+            on_progress(downloaded[0])
+        
+        def report(size):
+            with lock:
+                downloaded[0] += size
+                current = downloaded[0]
+            if on_progress:
+                on_progress(current)
+        
+        def fetch(start, end):
+            if self.fetch_range(url, path, start, end, report, stop_event):
+                with lock:
+                    manifest['completed'].append([start, end])
+                    self.save_manifest(path, manifest)
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(self.connections, len(ranges)))) as executor:
+            futures = [executor.submit(fetch, start, end) for start, end in ranges]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+            except RangeNotSupportedError:
+                stop_event.set()
+                for future in futures:
+                    future.cancel()
+                logger.warning("Server ignored range requests, falling back to a single connection")
+                concurrent.futures.wait(futures)
+                # Drop the preallocated file too, it would otherwise pass for a finished download
+                self.discard(path)
+                return self.download_single(url, path, total_size, on_progress, itag)
+            except Exception:
+                stop_event.set()
+                for future in futures:
+                    future.cancel()
+                raise
+        
+        self.mark_complete(path, manifest)
+        return path
+    
+    def preallocate(self, path, total_size):
+        """Create the output file at its final size so ranges can be written in place"""
+        with open(path, 'wb') as f:
+            if hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(f.fileno(), 0, total_size)
+                    return
+                except OSError:
+                    pass
+            f.truncate(total_size)
+    
+    def fetch_range(self, url, path, start, end, report, stop_event):
+        """Fetch one byte range and write it at its offset in the file, returning True when complete"""
+        expected = end - start + 1
+        written = 0
+        while True:
+            if stop_event.is_set():
+                return False
+            if self.throttle:
+                self.throttle.wait()
+            
+            headers = {'Range': f'bytes={start + written}-{end}'}
+            try:
+                with HOST_LIMITER.slot(url), self.session.get(url, headers=headers, stream=True, timeout=HTTP_TIMEOUT) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise RangeNotSupportedError(f"Expected 206 Partial Content, got {response.status_code}")
+                    
+                    with open(path, 'r+b') as f:
+                        f.seek(start + written)
+                        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                            if stop_event.is_set():
+                                return False
+                            if self.throttle:
+                                self.throttle(len(chunk))
+                            chunk = chunk[:expected - written]
+                            f.write(chunk)
+                            written += len(chunk)
+                            report(len(chunk))
+                            if written >= expected:
+                                break
+            except TransferPaused:
+                # Give up the connection and host slot while paused, then carry on from the same offset
+                continue
+            
+            if written != expected:
+                raise IOError(f"Incomplete range {start}-{end}: got {written} of {expected} bytes")
+            return True
+    
+    def download_single(self, url, path, total_size=None, on_progress=None, itag=None):
+        """Download url over one sequential connection, resuming a saved prefix when possible"""
+        manifest = self.load_manifest(path, itag, total_size, 'single') if total_size else None
+        downloaded = manifest['completed'][0][1] + 1 if manifest and manifest['completed'] else 0
+        
+        while True:
+            if self.throttle:
+                self.throttle.wait()
+            
+            offset = downloaded
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
+            try:
+                with HOST_LIMITER.slot(url), self.session.get(url, headers=headers, stream=True, timeout=HTTP_TIMEOUT) as response:
+                    response.raise_for_status()
+                    if offset and response.status_code != 206:
+                        offset = downloaded = 0
+                        if manifest is not None:
+                            # The saved prefix is about to be overwritten from byte 0
+                            manifest['completed'] = []
+                            self.save_manifest(path, manifest)
+                    
+                    if total_size and manifest is None:
+                        manifest = {'url': url, 'itag': itag, 'size': total_size, 'mode': 'single',
+                                    'segment_size': self.segment_size, 'completed': []}
+                        self.save_manifest(path, manifest)
+                    elif offset:
+                        logger.info(f"Resuming {os.path.basename(path)} at byte {offset}")
+                    
+                    last_saved = offset
+                    with open(path, 'r+b' if offset else 'wb') as f:
+                        f.seek(offset)
+                        f.truncate()
+                        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                            if self.throttle:
+                                self.throttle(len(chunk))
+                            f.write(chunk)
+                            downloaded += len(chunk)
+                            if on_progress:
+                                on_progress(downloaded)
+                            
+                            # Checkpoint the contiguous prefix every segment
+                            if manifest is not None and downloaded - last_saved >= self.segment_size:
+                                f.flush()
+                                manifest['completed'] = [[0, downloaded - 1]]
+                                self.save_manifest(path, manifest)
+                                last_saved = downloaded
+                break
+            except TransferPaused:
+                # Checkpoint, give up the connection and host slot while paused, then resume at this byte
+                if manifest is not None and downloaded:
+                    manifest['completed'] = [[0, downloaded - 1]]
+                    self.save_manifest(path, manifest)
+        
+        if total_size and downloaded != total_size:
+            raise IOError(f"Incomplete download: got {downloaded} of {total_size} bytes")
+        
+        if manifest is not None:
+            manifest['completed'] = [[0, downloaded - 1]]
+            self.mark_complete(path, manifest)
+        return path
+
+class StreamingMerger:
+    """Remux video and audio while they download by feeding ffmpeg through named pipes
+    
+    Each stream is fetched with sequential range requests and written into a
+    FIFO that ffmpeg reads as its input, so the merge overlaps with the
+    network transfer and no temporary video_/audio_ files touch the disk.
+    A range is read into memory before it is written, so a feeder blocked on
+    a full pipe never holds a host slot that its partner stream is waiting for.
+    """
+    
+    def __init__(self, segment_size=SEGMENT_SIZE, session=None, throttle=None):
+        self.segment_size = max(1, segment_size)
+        self.session = session or get_http_session()
+        self.throttle = throttle
+    
+    @staticmethod
+    def supported():
+        """Named pipes are only available on POSIX systems"""
+        return hasattr(os, 'mkfifo')
+    
+    def merge(self, video_url, video_size, audio_url, audio_size, output_path, on_progress=None, metadata=None):
+        """Stream both inputs into an ffmpeg stream-copy mux, calling on_progress(video_bytes, audio_bytes)"""
+        fifo_dir = tempfile.mkdtemp(prefix='wampytube_')
+        video_fifo = os.path.join(fifo_dir, 'video.fifo')
+        audio_fifo = os.path.join(fifo_dir, 'audio.fifo')
+        os.mkfifo(video_fifo)
+        os.mkfifo(audio_fifo)
+        
+        command = [
+            FFMPEG_PATH,
+            '-y',
+            '-hide_banner',
+            '-loglevel', 'error',
+            # Fail instead of silently dropping a stream ffmpeg can't demux from a pipe
+            '-xerror',
+            '-i', video_fifo,
+            '-i', audio_fifo,
+            '-map', '0:v:0',
+            '-map', '1:a:0',
+            '-c', 'copy',
+            *metadata_args(metadata),
+            output_path
+        ]
+        
+        lock = threading.Lock()
+        fed = [0, 0]
+        
+        def reporter(index):
+            def report(size):
+                with lock:
+                    fed[index] += size
+                    current = tuple(fed)
+                if on_progress:
+                    on_progress(*current)
+            return report
+        
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.PIPE, text=True)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                feeders = [
+                    executor.submit(self.feed, video_url, video_size, video_fifo, process, reporter(0)),
+                    executor.submit(self.feed, audio_url, audio_size, audio_fifo, process, reporter(1))
+                ]
+                
+                # ffmpeg exits on its own once both pipes are closed
+                _, stderr = process.communicate()
+                errors = []
+                for feeder in feeders:
+                    try:
+                        feeder.result()
+                    except Exception as e:
+                        errors.append(e)
+            
+            if errors:
+                raise errors[0]
+            if process.returncode != 0:
+                raise Exception(f"ffmpeg streaming merge failed: {stderr.strip()[-500:]}")
+            return output_path
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            shutil.rmtree(fifo_dir, ignore_errors=True)
+    
+    def open_fifo_writer(self, fifo_path, process):
+        """Open a FIFO for writing without blocking forever if ffmpeg never opens it"""
+        while True:
+            try:
+                fd = os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+                break
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+                if process.poll() is not None:
+                    raise IOError("ffmpeg exited before reading its input")
+                time.sleep(0.05)
+        
+        os.set_blocking(fd, True)
+        return os.fdopen(fd, 'wb')
+    
+    def feed(self, url, total_size, fifo_path, process, report):
+        """Copy a stream into a FIFO with sequential range requests, resuming after network errors"""
+        try:
+            with self.open_fifo_writer(fifo_path, process) as pipe:
+                offset = 0
+                failures = 0
+                while offset < total_size:
+                    if self.throttle:
+                        self.throttle.wait()
+                    end = min(offset + self.segment_size, total_size) - 1
+                    received = []
+                    try:
+                        with HOST_LIMITER.slot(url), \
+                                self.session.get(url, headers={'Range': f'bytes={offset}-{end}'},
+                                                 stream=True, timeout=HTTP_TIMEOUT) as response:
+                            response.raise_for_status()
+                            if response.status_code != 206 and offset > 0:
+                                raise RangeNotSupportedError(f"Expected 206 Partial Content, got {response.status_code}")
+                            
+                            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                                if self.throttle:
+                                    self.throttle(len(chunk))
+                                received.append(chunk)
+                        failures = 0
+                    except TransferPaused:
+                        # Give up the connection and host slot while paused, ffmpeg just waits on the pipe
+                        pass
+                    except (requests.ConnectionError, requests.Timeout) as e:
+                        # Bytes already received are still good, so resume right after them
+                        failures += 1
+                        if failures > DOWNLOAD_RETRIES:
+                            raise
+                        logger.warning(f"Streaming transfer interrupted ({e}), resuming at byte {offset + sum(map(len, received))}")
+                        time.sleep(backoff_delay(failures - 1))
+                    
+                    # Written only once the slot is free, as ffmpeg may not read this pipe until the other stream catches up
+                    for chunk in received:
+                        pipe.write(chunk)
+                        offset += len(chunk)
+                        report(len(chunk))
+        except Exception:
+            # Stop ffmpeg so the other feeder doesn't wait on a merge that can't finish
+            if process.poll() is None:
+                process.kill()
+            raise
+
+def get_video_id(url):
+    """Extract the YouTube video ID from a URL, or None if it isn't a video URL"""
+    try:
+        return extract.video_id(url)
+    except Exception:
+        return None
+
+def get_collection_type(url):
+    """Return 'playlist' or 'channel' for URLs that list several videos, else None"""
+    parsed = urllib.parse.urlparse(url.strip())
+    path = parsed.path.rstrip('/')
+    query = urllib.parse.parse_qs(parsed.query)
+    
+    # A watch URL that carries a list= parameter still means the one video
+    if path == '/playlist' and 'list' in query:
+        return 'playlist'
+    if re.match(r'^/(@[^/]+|channel/[^/]+|c/[^/]+|user/[^/]+)(/(videos|featured|streams|shorts))?$', path):
+        return 'channel'
+    return None
+
+class MetadataCache:
+    """In-memory cache of resolved YouTube objects keyed by video ID
+    
+    Entries stay valid until shortly before their signed stream URLs expire,
+    so analysis and download share one resolution instead of repeating it.
+    The least recently used entries are evicted once the cache grows past
+    max_entries, so large playlist and channel syncs don't keep every object.
+    """
+    
+    def __init__(self, default_ttl=METADATA_TTL, expiry_margin=URL_EXPIRY_MARGIN, max_entries=METADATA_CACHE_MAX_ENTRIES):
+        self.default_ttl = default_ttl
+        self.expiry_margin = expiry_margin
+        self.max_entries = max(1, max_entries)
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+    
+    def expires_at(self, yt):
+        """Time at which the stream URLs of a YouTube object stop being usable"""
+        try:
+            expiration = min(stream.expiration.timestamp() for stream in yt.streams)
+            return expiration - self.expiry_margin
+        except Exception:
+            return time.time() + self.default_ttl
+    
+    def get(self, video_id):
+        """Return the cached YouTube object for video_id, or None when missing or expired"""
+        with self.lock:
+            entry = self.entries.get(video_id)
+            if not entry:
+                return None
+            if time.time() >= entry['expires_at']:
+                del self.entries[video_id]
+                return None
+            self.entries.move_to_end(video_id)
+            return entry['yt']
+    
+    def put(self, video_id, yt):
+        """Cache a resolved YouTube object until its stream URLs expire"""
+        expires_at = self.expires_at(yt)
+        with self.lock:
+            self.entries[video_id] = {'yt': yt, 'expires_at': expires_at}
+            self.entries.move_to_end(video_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def invalidate(self, video_id):
+        """Drop a cached entry, e.g. after its URLs were rejected"""
+        with self.lock:
+            self.entries.pop(video_id, None)
+
+class PersistentMetadataCache:
+    """SQLite cache of video info and stream tables that survives restarts
+    
+    Only plain data is stored (title, length and the itag/resolution/abr/language
+    option tables), never signed URLs, so entries stay useful long after the
+    stream URLs have expired. The least recently used entries are evicted once
+    the cache grows past max_entries.
+    """
+    
+    def __init__(self, path=None, max_entries=PERSISTENT_CACHE_MAX_ENTRIES, max_age=PERSISTENT_CACHE_MAX_AGE):
+        self.path = path or os.path.join(get_cache_dir(), 'metadata.sqlite3')
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS videos (
+                    video_id TEXT PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    length INTEGER,
+                    streams TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            ''')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS videos_accessed ON videos (accessed_at)')
+    
+    def get(self, video_id):
+        """Return cached metadata for video_id, or None when missing or too old"""
+        try:
+            with self.lock, self.connection:
+                row = self.connection.execute(
+                    'SELECT title, length, streams, fetched_at FROM videos WHERE video_id = ?', (video_id,)
+                ).fetchone()
+                if not row:
+                    return None
+                
+                title, length, streams, fetched_at = row
+                if time.time() - fetched_at > self.max_age:
+                    self.connection.execute('DELETE FROM videos WHERE video_id = ?', (video_id,))
+                    return None
+                
+                self.connection.execute('UPDATE videos SET accessed_at = ? WHERE video_id = ?', (time.time(), video_id))
+            
+            metadata = json.loads(streams)
+            metadata.update({'title': title, 'length': length, 'fetched_at': fetched_at})
+            return metadata
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"Metadata cache read failed for {video_id}: {e}")
+            return None
+    
+    def put(self, video_id, metadata):
+        """Store the plain-data part of a metadata dict and evict old entries"""
+        streams = {key: metadata[key] for key in ('quality_options', 'stream_map', 'audio_options', 'audio_map')}
+        now = time.time()
+        try:
+            with self.lock, self.connection:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO videos (video_id, title, length, streams, fetched_at, accessed_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (video_id, metadata['title'], metadata['length'], json.dumps(streams), now, now)
+                )
+                # Least recently used entries beyond the size limit are dropped
+                self.connection.execute(
+                    'DELETE FROM videos WHERE video_id NOT IN '
+                    '(SELECT video_id FROM videos ORDER BY accessed_at DESC LIMIT ?)',
+                    (self.max_entries,)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Metadata cache write failed for {video_id}: {e}")
+
+def archive_tag(video_id, itag, mode):
+    """Comment tag identifying a finished download inside the file itself"""
+    return f"{ARCHIVE_TAG_PREFIX}{video_id}:{itag}:{mode}"
+
+def metadata_args(metadata):
+    """ffmpeg arguments writing a dict of container metadata tags"""
+    args = []
+    for key, value in (metadata or {}).items():
+        args += ['-metadata', f"{key}={value}"]
+    return args
+
+def read_archive_tag(path):
+    """Return (video_id, itag, mode) from a file's archive tag, or None if it has none"""
+    try:
+        result = subprocess.run([FFMPEG_PATH, '-v', 'error', '-i', path, '-f', 'ffmetadata', '-'],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, timeout=30)
+    except Exception as e:
+        logger.warning(f"Could not read tags from {path}: {e}")
+        return None
+    
+    for line in result.stdout.splitlines():
+        if line.startswith(f"comment={ARCHIVE_TAG_PREFIX}"):
+            parts = line[len(f"comment={ARCHIVE_TAG_PREFIX}"):].split(':')
+            if len(parts) == 3 and parts[1].isdigit():
+                return parts[0], int(parts[1]), parts[2]
+    return None
+
+class DownloadArchive:
+    """SQLite record of finished downloads keyed by video ID, itag and output mode
+    
+    All keys are also held in memory so membership checks are O(1) and can run
+    before any network request. Finished merges carry an archive tag in their
+    metadata, so the archive can be rebuilt by scanning an output folder.
+    """
+    
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_data_dir(), 'archive.sqlite3')
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS downloads (
+                    video_id TEXT NOT NULL,
+                    itag INTEGER NOT NULL,
+                    mode TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    title TEXT,
+                    downloaded_at REAL NOT NULL,
+                    PRIMARY KEY (video_id, itag, mode)
+                )
+            ''')
+        self.load()
+    
+    def load(self):
+        """Build the in-memory index from the database"""
+        with self.lock:
+            rows = self.connection.execute('SELECT video_id, itag, mode, path FROM downloads').fetchall()
+            self.entries = {(video_id, itag, mode): path for video_id, itag, mode, path in rows}
+            self.videos = {(video_id, mode): path for video_id, itag, mode, path in rows}
+    
+    def find(self, video_id, mode, itag=None):
+        """Return the archived path for a download, or None
+        
+        Without an itag any archived download of the video in this mode matches;
+        callers only ask that for jobs that want the best quality on offer.
+        """
+        if not video_id:
+            return None
+        with self.lock:
+            if itag is None:
+                return self.videos.get((video_id, mode))
+            return self.entries.get((video_id, itag, mode))
+    
+    def add(self, video_id, itag, mode, path, title=None):
+        """Record a finished download"""
+        try:
+            with self.lock, self.connection:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO downloads (video_id, itag, mode, path, title, downloaded_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (video_id, itag, mode, os.path.abspath(path), title, time.time())
+                )
+                self.entries[(video_id, itag, mode)] = os.path.abspath(path)
+                self.videos[(video_id, mode)] = os.path.abspath(path)
+        except sqlite3.Error as e:
+            logger.warning(f"Download archive write failed for {video_id}: {e}")
+    
+    def rebuild(self, folder):
+        """Sync the folder's archive entries with the files in it, returning how many are archived
+        
+        Tagged files are added, entries whose files are gone are dropped, and
+        untagged files that are still recorded, such as direct downloads that
+        never went through ffmpeg, are kept.
+        """
+        folder = os.path.abspath(folder)
+        paths = [entry.path for entry in os.scandir(folder)
+                 if entry.is_file() and entry.name.lower().endswith('.mp4')]
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, CPU_THREADS)) as executor:
+            tags = list(executor.map(read_archive_tag, paths))
+        
+        now = time.time()
+        rows = []
+        for path, tag in zip(paths, tags):
+            if tag:
+                video_id, itag, mode = tag
+                rows.append((video_id, itag, mode, path, Path(path).stem, now))
+        
+        with self.lock, self.connection:
+            # Entries whose files were deleted or moved away are dropped along the way
+            stale = [key for key, path in self.entries.items()
+                     if os.path.dirname(path) == folder and not os.path.exists(path)]
+            self.connection.executemany('DELETE FROM downloads WHERE video_id = ? AND itag = ? AND mode = ?', stale)
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO downloads (video_id, itag, mode, path, title, downloaded_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)', rows)
+        self.load()
+        return sum(1 for path in self.entries.values() if os.path.dirname(path) == folder)
+
+def format_bytes(size):
+    """Format a byte count as a short human readable string"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+class Span:
+    """One timed phase of a job, with attributes such as bytes, speed and encoder"""
+    
+    def __init__(self, name, job_id=None, **attributes):
+        self.name = name
+        self.job_id = job_id
+        self.attributes = attributes
+        self.started = time.time()
+        self.clock = time.perf_counter()
+        self.duration = None
+        self.status = 'ok'
+    
+    def set(self, **attributes):
+        """Add or update attributes while the span is open"""
+        self.attributes.update(attributes)
+    
+    def finish(self):
+        """Close the span, deriving speed from its byte count"""
+        self.duration = time.perf_counter() - self.clock
+        if self.attributes.get('bytes') and self.duration > 0:
+            self.attributes['speed'] = self.attributes['bytes'] / self.duration
+    
+    def to_dict(self):
+        return {'name': self.name, 'job_id': self.job_id, 'start': round(self.started, 3),
+                'duration': round(self.duration or 0, 6), 'status': self.status, 'attributes': self.attributes}
+
+class Tracer:
+    """Time job phases as spans and hand each finished span to every registered sink
+    
+    A sink is anything with an emit(span) method; a failing sink is logged
+    and never breaks the download it is measuring.
+    """
+    
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+        self.lock = threading.Lock()
+    
+    def add_sink(self, sink):
+        with self.lock:
+            self.sinks.append(sink)
+        return sink
+    
+    def remove_sink(self, sink):
+        with self.lock:
+            if sink in self.sinks:
+                self.sinks.remove(sink)
+    
+    @contextlib.contextmanager
+    def span(self, name, job=None, **attributes):
+        """Time the enclosed block, marking the span cancelled or errored if it raises"""
+        span = Span(name, job.id if job else None, **attributes)
+        try:
+            yield span
+        except JobCancelled:
+            span.status = 'cancelled'
+            raise
+        except Exception as e:
+            span.status = 'error'
+            span.set(error=str(e))
+            raise
+        finally:
+            span.finish()
+            self.emit(span)
+    
+    def emit(self, span):
+        with self.lock:
+            sinks = list(self.sinks)
+        for sink in sinks:
+            try:
+                sink.emit(span)
+            except Exception as e:
+                logger.warning(f"Metrics sink {type(sink).__name__} failed: {e}")
+
+class JsonLinesSink:
+    """Append each span as one JSON object per line, rotating the file once it grows too large"""
+    
+    def __init__(self, path=None, max_bytes=METRICS_FILE_MAX_BYTES):
+        self.path = path or os.path.join(get_log_dir(), METRICS_FILE)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+    
+    def emit(self, span):
+        line = json.dumps(span.to_dict(), default=str) + '\n'
+        with self.lock:
+            if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, f"{self.path}.1")
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+class CallbackSink:
+    """Pass each span to an in-process callback"""
+    
+    def __init__(self, callback):
+        self.callback = callback
+    
+    def emit(self, span):
+        self.callback(span)
+
+class LoggingSink:
+    """Log each span as JSON to a logger that propagates, so host log pipelines can collect spans"""
+    
+    def __init__(self, name='wampytube.metrics', level=logging.INFO):
+        self.logger = logging.getLogger(name)
+        self.level = level
+    
+    def emit(self, span):
+        self.logger.log(self.level, json.dumps(span.to_dict(), default=str))
+
+class PrometheusSink:
+    """Aggregate spans into Prometheus counters and histograms, served as text on /metrics
+    
+    The endpoint binds to localhost by default; pass port=None to only
+    aggregate and read render() directly.
+    """
+    
+    def __init__(self, port=METRICS_PORT, host='127.0.0.1', buckets=METRICS_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()  # (phase, status) -> spans
+        self.byte_totals = collections.Counter()  # phase -> bytes
+        self.histograms = {}  # phase -> [bucket counts..., count, sum]
+        self.server = None
+        if port is not None:
+            self.start(host, port)
+    
+    def emit(self, span):
+        with self.lock:
+            self.counts[(span.name, span.status)] += 1
+            self.byte_totals[span.name] += span.attributes.get('bytes') or 0
+            histogram = self.histograms.setdefault(span.name, [0] * len(self.buckets) + [0, 0.0])
+            for index, bound in enumerate(self.buckets):
+                if span.duration <= bound:
+                    histogram[index] += 1
+            histogram[-2] += 1
+            histogram[-1] += span.duration
+    
+    def render(self):
+        """Current metrics in the Prometheus text exposition format"""
+        lines = ['# HELP wampytube_phase_duration_seconds Time spent in each job phase.',
+                 '# TYPE wampytube_phase_duration_seconds histogram']
+        with self.lock:
+            for phase, histogram in sorted(self.histograms.items()):
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f'wampytube_phase_duration_seconds_bucket{{phase="{phase}",le="{bound}"}} {count}')
+                lines.append(f'wampytube_phase_duration_seconds_bucket{{phase="{phase}",le="+Inf"}} {histogram[-2]}')
+                lines.append(f'wampytube_phase_duration_seconds_count{{phase="{phase}"}} {histogram[-2]}')
+                lines.append(f'wampytube_phase_duration_seconds_sum{{phase="{phase}"}} {histogram[-1]:.6f}')
+            lines += ['# HELP wampytube_phase_total Finished job phases by outcome.',
+                      '# TYPE wampytube_phase_total counter']
+            for (phase, status), count in sorted(self.counts.items()):
+                lines.append(f'wampytube_phase_total{{phase="{phase}",status="{status}"}} {count}')
+            lines += ['# HELP wampytube_phase_bytes_total Bytes moved by each job phase.',
+                      '# TYPE wampytube_phase_bytes_total counter']
+            for phase, total in sorted(self.byte_totals.items()):
+                lines.append(f'wampytube_phase_bytes_total{{phase="{phase}"}} {total}')
+        return '\n'.join(lines) + '\n'
+    
+    def start(self, host, port):
+        """Serve /metrics on a daemon thread"""
+        sink = self
+        
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = sink.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='metrics-http', daemon=True).start()
+        logger.info(f"Serving metrics on http://{host}:{self.server.server_address[1]}/metrics")
+    
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+class ProgressAggregator:
+    """Latest progress of every job, written by workers and polled by the UI
+    
+    Workers only overwrite a small per-job state under a lock, so the cost of
+    reporting doesn't grow with the number of chunks. The UI collects the jobs
+    that changed at a fixed frame rate. Transfer speed is smoothed with an
+    exponential moving average to give a stable ETA.
+    """
+    
+    def __init__(self, smoothing=SPEED_SMOOTHING, sample_interval=SPEED_SAMPLE_INTERVAL):
+        self.smoothing = smoothing
+        self.sample_interval = sample_interval
+        self.states = {}
+        self.dirty = set()
+        self.lock = threading.Lock()
+    
+    def update(self, job):
+        """Record a job's current progress, message and byte counts"""
+        now = time.monotonic()
+        bytes_done = job.bytes_done
+        bytes_total = job.bytes_total
+        
+        with self.lock:
+            state = self.states.get(job.id)
+            if state is None:
+                state = {'speed': 0.0, 'eta': None, 'sample_time': now, 'sample_bytes': bytes_done}
+                self.states[job.id] = state
+            
+            # Resample speed at a fixed interval so bursts of small chunks don't skew it
+            elapsed = now - state['sample_time']
+            if elapsed >= self.sample_interval:
+                instant = max(0, bytes_done - state['sample_bytes']) / elapsed
+                if state['speed']:
+                    state['speed'] = self.smoothing * instant + (1 - self.smoothing) * state['speed']
+                else:
+                    state['speed'] = instant
+                state['sample_time'] = now
+                state['sample_bytes'] = bytes_done
+            
+            if bytes_done < state['sample_bytes']:
+                # A restarted transfer reports fewer bytes, start sampling again
+                state['sample_bytes'] = bytes_done
+            
+            remaining = max(0, bytes_total - bytes_done)
+            state['eta'] = remaining / state['speed'] if state['speed'] > 0 and bytes_total else None
+            state.update({
+                'status': job.status,
+                'progress': job.progress,
+                'message': job.message,
+                'bytes_done': bytes_done,
+                'bytes_total': bytes_total
+            })
+            self.dirty.add(job.id)
+    
+    def collect(self):
+        """Return {job_id: state} for jobs that changed since the last call"""
+        with self.lock:
+            changed = {job_id: dict(self.states[job_id]) for job_id in self.dirty}
+            self.dirty.clear()
+        return changed
+    
+    def get(self, job_id):
+        """Return a copy of one job's latest state"""
+        with self.lock:
+            state = self.states.get(job_id)
+            return dict(state) if state else None
+    
+    def totals(self, job_ids):
+        """Combined (speed, remaining bytes) for the given jobs"""
+        with self.lock:
+            states = [self.states[job_id] for job_id in job_ids if job_id in self.states]
+            speed = sum(state['speed'] for state in states if state['status'] == 'running')
+            remaining = sum(max(0, state['bytes_total'] - state['bytes_done']) for state in states)
+        return speed, remaining
+
+class DownloadJob:
+    """A queued download with its own stream selection, progress and status"""
+    _ids = itertools.count(1)
+    
+    def __init__(self, url, output_folder, video_choice=None, audio_choice=None, title=None,
+                 output_mode=DEFAULT_OUTPUT_MODE, quality='best', audio_language=None,
+                 priority=DEFAULT_PRIORITY, rate_limit=None):
+        self.id = next(DownloadJob._ids)
+        self.url = url
+        self.output_folder = output_folder
+        self.output_mode = output_mode
+        # Snapshot of the selector entries at the time the job was queued
+        self.video_choice = video_choice
+        self.audio_choice = audio_choice
+        # Selection rules applied when the job was queued without a snapshot
+        self.quality = quality
+        self.audio_language = audio_language
+        # Bandwidth share under a global cap, and this job's own cap (None uses JOB_BANDWIDTH_LIMIT)
+        self.priority = priority
+        self.rate_limit = rate_limit
+        self.title = title or url
+        self.status = 'queued'  # queued, running, waiting (parked for disk space), completed, skipped, failed, cancelled
+        self.progress = 0
+        self.message = 'Waiting in queue...'
+        self.final_path = None
+        self.error = None
+        self.itag = None  # Video stream actually downloaded, recorded in the archive
+        self.work_folder = None  # Where partial downloads go, fixed once the streams are selected
+        self.stream_merge_failed = False  # Set after a streaming merge failed, so reruns go straight to temp files
+        self.cancel_event = threading.Event()
+        self.started = None  # perf_counter() when a worker picked the job up, for the job span
+        # Bytes downloaded and expected size per stream itag
+        self.component_bytes = {}
+        self.component_sizes = {}
+        self.lock = threading.Lock()
+    
+    @property
+    def finished(self):
+        return self.status in ('completed', 'skipped', 'failed', 'cancelled')
+    
+    @property
+    def bytes_done(self):
+        with self.lock:
+            return sum(self.component_bytes.values())
+    
+    @property
+    def bytes_total(self):
+        with self.lock:
+            return sum(self.component_sizes.values())
+    
+    def track_components(self, streams):
+        """Start tracking combined progress for the streams this job downloads"""
+        with self.lock:
+            self.component_bytes = {stream.itag: 0 for stream in streams}
+            self.component_sizes = {stream.itag: stream.filesize or 0 for stream in streams}
+    
+    def record_component(self, itag, bytes_downloaded):
+        """Record progress for one stream, returning the overall percentage weighted by filesize"""
+        with self.lock:
+            self.component_bytes[itag] = bytes_downloaded
+            total_size = sum(self.component_sizes.values())
+            if total_size <= 0:
+                return 0
+            return min(100, sum(self.component_bytes.values()) / total_size * 100)
+
+class DownloadQueue:
+    """Scheduler that runs queued download jobs on a bounded worker pool"""
+    
+    def __init__(self, runner, max_workers=DOWNLOAD_THREADS):
+        self.runner = runner
+        self.max_workers = max(1, max_workers)
+        self.jobs = []
+        self.pending = queue.Queue()
+        self.workers = []
+        self.lock = threading.Lock()
+    
+    def submit(self, job):
+        """Add a job to the queue and make sure a worker is available for it"""
+        with self.lock:
+            self.jobs.append(job)
+            if len(self.workers) < self.max_workers:
+                worker = threading.Thread(target=self._worker_loop, name=f"download-worker-{len(self.workers) + 1}")
+                worker.daemon = True
+                self.workers.append(worker)
+                worker.start()
+        self.pending.put(job)
+        return job
+    
+    def _worker_loop(self):
+        """Pull jobs from the queue forever, running one at a time"""
+        while True:
+            job = self.pending.get()
+            handed_off = False
+            try:
+                job.status = 'running'
+                outcome = self.runner(job)
+                if isinstance(outcome, concurrent.futures.Future):
+                    # The job finishes in post-processing; it stays pending until then so join() waits for it
+                    outcome.add_done_callback(lambda _: self.pending.task_done())
+                    handed_off = True
+            except JobDeferred as e:
+                # The job stays pending while parked, so join() keeps waiting for it
+                job.status = 'waiting'
+                handed_off = True
+                e.register(lambda job=job: self.requeue(job))
+            except Exception as e:
+                logger.error(f"Download worker error on job {job.id}: {e}")
+                job.status = 'failed'
+                job.error = str(e)
+            finally:
+                if not handed_off:
+                    self.pending.task_done()
+    
+    def requeue(self, job):
+        """Put a parked job back in line, settling the turn it was parked on"""
+        job.status = 'queued'
+        self.pending.put(job)
+        self.pending.task_done()
+    
+    def counts(self):
+        """Return (running, queued) job counts, counting parked jobs as queued"""
+        with self.lock:
+            running = sum(1 for job in self.jobs if job.status == 'running')
+            queued = sum(1 for job in self.jobs if job.status in ('queued', 'waiting'))
+        return running, queued
+    
+    def active_jobs(self):
+        """Jobs that have not finished yet"""
+        with self.lock:
+            return [job for job in self.jobs if not job.finished]
+
+# Audio language codes and their display names
+LANGUAGE_NAMES = {
+    'en': 'English',
+    'es': 'Spanish', 
+    'es-ES': 'Spanish',
+    'es-419': 'Spanish (Latin America)',
+    'fr': 'French',
+    'de': 'German',
+    'it': 'Italian',
+    'pt': 'Portuguese',
+    'pt-BR': 'Portuguese (Brazil)',
+    'ru': 'Russian',
+    'ja': 'Japanese',
+    'ko': 'Korean',
+    'zh': 'Chinese',
+    'zh-CN': 'Chinese (Simplified)',
+    'zh-TW': 'Chinese (Traditional)',
+    'ar': 'Arabic',
+    'hi': 'Hindi',
+    'tr': 'Turkish',
+    'pl': 'Polish',
+    'nl': 'Dutch',
+    'sv': 'Swedish',
+    'da': 'Danish',
+    'no': 'Norwegian',
+    'fi': 'Finnish'
+}
+
+def format_duration(seconds):
+    """Format duration in seconds to readable string"""
+    if not seconds:
+        return "Unknown"
+    
+    hours = seconds // 3600
+    minutes = (seconds % 3600) // 60
+    secs = seconds % 60
+    
+    if hours > 0:
+        return f"{hours}h {minutes}m {secs}s"
+    elif minutes > 0:
+        return f"{minutes}m {secs}s"
+    else:
+        return f"{secs}s"
+
+def choose_quality(quality_options, stream_map, quality='best'):
+    """Pick the quality label to download: the highest resolution at or below `quality`, adaptive first"""
+    candidates = [label for label in quality_options if label in stream_map]
+    if not candidates:
+        return None
+    
+    if quality and quality != 'best':
+        limit = int(str(quality).lower().rstrip('p'))
+        # Nothing small enough, settle for the lowest resolution on offer
+        candidates = [label for label in candidates if int(label.split('p')[0]) <= limit] or \
+                     [min(candidates, key=lambda label: int(label.split('p')[0]))]
+    
+    return max(candidates, key=lambda label: (int(label.split('p')[0]), stream_map[label]['type'] == 'adaptive'))
+
+def choose_audio(audio_options, audio_map, language=None):
+    """Pick the audio label to download: the first track in `language`, else the best track"""
+    candidates = [label for label in audio_options if label in audio_map]
+    if language:
+        language = language.lower()
+        for label in candidates:
+            # A bare language code also matches its regional variants, e.g. es -> es-419
+            track_language = (audio_map[label].get('language') or '').lower()
+            if track_language == language or track_language.split('-')[0] == language:
+                return label
+    return candidates[0] if candidates else None
+
+def log_to_logger(message, level="info"):
+    """Default engine log callback writing to the WampyTube logger"""
+    logger.log({'warning': logging.WARNING, 'error': logging.ERROR}.get(level, logging.INFO), message)
+
+class DownloadEngine:
+    """GUI-free download engine: metadata resolution, stream selection, downloading and merging
+    
+    `log(message, level)` receives activity messages and `on_update(job)` is
+    called from worker threads whenever a job's progress or message changes.
+    Downloads already in the archive are skipped unless use_archive is False.
+    """
+    
+    def __init__(self, log=log_to_logger, on_update=None, use_archive=True, tracer=None, scratch_dir=SCRATCH_DIR):
+        self.log = log
+        self.scratch_dir = scratch_dir
+        self.on_update = on_update
+        self.tracer = tracer or Tracer()
+        self.metadata_cache = MetadataCache()
+        try:
+            self.persistent_cache = PersistentMetadataCache()
+        except Exception as e:
+            logger.warning(f"Persistent metadata cache unavailable: {e}")
+            self.persistent_cache = None
+        self.archive = None
+        if use_archive:
+            try:
+                self.archive = DownloadArchive()
+            except Exception as e:
+                logger.warning(f"Download archive unavailable: {e}")
+        self.scheduler = BandwidthScheduler()
+        self.postprocessor = PostProcessor()
+        self.disk_gate = DiskSpaceGate()
+    
+    def log_message(self, message, level="info"):
+        """Forward an activity message to the log callback"""
+        self.log(message, level)
+    
+    def update_job(self, job, progress=None, message=None):
+        """Record job progress from a worker thread and notify the update callback"""
+        if progress is not None:
+            job.progress = progress
+        if message is not None:
+            job.message = message
+        if self.on_update:
+            self.on_update(job)
+    
+    def throttle(self, job):
+        """Return a per-chunk callback that charges the job's transfers to the bandwidth scheduler"""
+        return JobThrottle(self.scheduler, job)
+    
+    def pause_job(self, job):
+        """Hold a running job's transfers without discarding what it has downloaded"""
+        if job.finished:
+            return
+        self.scheduler.pause(job)
+        self.log_message(f"Paused: {job.title}")
+        self.update_job(job, message="Paused")
+    
+    def resume_job(self, job):
+        """Let a paused job carry on from where it stopped"""
+        self.scheduler.resume(job)
+        self.log_message(f"Resumed: {job.title}")
+        self.update_job(job, message="Resuming...")
+    
+    def cancel_job(self, job):
+        """Stop a job's transfers and any ffmpeg run at the next chance, keeping partial downloads"""
+        if job.finished:
+            return
+        job.cancel_event.set()
+        # Wake the job if it is paused or waiting for disk space so it can notice the cancellation
+        self.scheduler.resume(job)
+        self.disk_gate.wake()
+        if job.status in ('queued', 'waiting'):
+            job.status = 'cancelled'
+            self.update_job(job, 0, "Cancelled")
+        else:
+            self.update_job(job, message="Cancelling...")
+    
+    def resolve_metadata(self, url, is_stale=None):
+        """Fetch video metadata and stream options, returning None once `is_stale()` turns true"""
+        yt, _ = self.get_video(url)
+        if is_stale and is_stale():
+            return None
+        
+        quality_options, stream_map = self.build_quality_options(yt)
+        if is_stale and is_stale():
+            return None
+        
+        audio_options, audio_map = self.build_audio_options(yt)
+        
+        metadata = {
+            'title': yt.title,
+            'length': yt.length,
+            'quality_options': quality_options,
+            'stream_map': stream_map,
+            'audio_options': audio_options,
+            'audio_map': audio_map
+        }
+        
+        video_id = get_video_id(url)
+        if video_id and self.persistent_cache and stream_map:
+            self.persistent_cache.put(video_id, metadata)
+        return metadata
+    
+    def cached_metadata(self, url):
+        """Return stream options from the on-disk cache without touching the network, or None"""
+        video_id = get_video_id(url)
+        if video_id and self.persistent_cache:
+            return self.persistent_cache.get(video_id)
+        return None
+    
+    def expand_url(self, url):
+        """Yield the video URLs behind a playlist or channel URL as pages load, or just `url`"""
+        collection_type = get_collection_type(url)
+        if not collection_type:
+            yield url
+            return
+        
+        collection_class = Channel if collection_type == 'channel' else Playlist
+        collection = collection_class(url, use_oauth=False, allow_oauth_cache=True)
+        self.log_message(f"Expanding {collection_type}: {url}")
+        yield from collection.video_urls
+    
+    def resolve_jobs(self, urls, output_folder, output_mode=DEFAULT_OUTPUT_MODE, quality='best',
+                     audio_language=None, is_cancelled=None):
+        """Expand playlists and channels and resolve every video on a bounded pool
+        
+        Yields a DownloadJob with its quality and audio already chosen as soon as
+        each video resolves, so downloads start while the rest are still resolving.
+        Videos that fail to resolve are yielded without a choice and retried
+        (and reported) when the job runs.
+        """
+        def resolve(url):
+            metadata = self.cached_metadata(url) or self.resolve_metadata(url)
+            video_label = choose_quality(metadata['quality_options'], metadata['stream_map'], quality)
+            audio_label = choose_audio(metadata['audio_options'], metadata['audio_map'], audio_language)
+            return DownloadJob(url, output_folder, metadata['stream_map'].get(video_label),
+                               metadata['audio_map'].get(audio_label), metadata['title'], output_mode,
+                               quality, audio_language)
+        
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=BATCH_RESOLVE_THREADS,
+                                                         thread_name_prefix="resolve")
+        skipped = 0
+        try:
+            futures = {}
+            for url in urls:
+                if is_cancelled and is_cancelled():
+                    break
+                try:
+                    for video_url in self.expand_url(url):
+                        if is_cancelled and is_cancelled():
+                            break
+                        # Archived videos are skipped before spending a request on their metadata
+                        if self.archive_lookup(get_video_id(video_url), output_mode, quality):
+                            skipped += 1
+                            continue
+                        futures[executor.submit(resolve, video_url)] = video_url
+                        # Hand over finished entries while a long playlist is still paginating
+                        for future in [future for future in futures if future.done()]:
+                            yield self.resolved_job(future, futures.pop(future), output_folder, output_mode,
+                                                    quality, audio_language)
+                except Exception as e:
+                    self.log_message(f"Could not expand {url}: {e}", "error")
+            
+            if skipped:
+                self.log_message(f"Skipped {skipped} already downloaded video(s)")
+            
+            for future in concurrent.futures.as_completed(list(futures)):
+                yield self.resolved_job(future, futures.pop(future), output_folder, output_mode,
+                                        quality, audio_language)
+        finally:
+            # Don't keep resolving entries nobody will download once the caller stops
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def resolved_job(self, future, url, output_folder, output_mode, quality, audio_language):
+        """Return the job from a finished resolve, or an unresolved job if it failed"""
+        try:
+            return future.result()
+        except Exception as e:
+            self.log_message(f"Could not resolve {url} ({e}), it will be retried when downloaded", "warning")
+            return DownloadJob(url, output_folder, output_mode=output_mode, quality=quality,
+                               audio_language=audio_language)
+    
+    def default_choices(self, yt, quality='best', language=None):
+        """Apply the selection rules to a YouTube object, returning (video choice, audio choice)"""
+        quality_options, stream_map = self.build_quality_options(yt)
+        audio_options, audio_map = self.build_audio_options(yt)
+        video_label = choose_quality(quality_options, stream_map, quality)
+        audio_label = choose_audio(audio_options, audio_map, language)
+        return stream_map.get(video_label), audio_map.get(audio_label)
+    
+    def get_video(self, url):
+        """Return (YouTube object, cached) from the metadata cache or a fresh resolution"""
+        video_id = get_video_id(url)
+        yt = self.metadata_cache.get(video_id) if video_id else None
+        if yt:
+            return yt, True
+        
+        for attempt in range(HTTP_RETRIES + 1):
+            try:
+                yt = YouTube(url, use_oauth=False, allow_oauth_cache=True)
+                yt.check_availability()
+                # Fetch the stream table now so transient failures are retried here too
+                yt.streams
+                break
+            except (urllib.error.URLError, http.client.HTTPException, ConnectionError, TimeoutError) as e:
+                status = getattr(e, 'code', None)
+                if attempt == HTTP_RETRIES or (status and status not in HTTP_RETRY_STATUSES):
+                    raise
+                delay = backoff_delay(attempt)
+                self.log_message(f"Fetching video info failed ({e}), retrying in {delay:.1f}s...", "warning")
+                time.sleep(delay)
+        
+        if video_id:
+            self.metadata_cache.put(video_id, yt)
+        return yt, False
+    
+    def build_quality_options(self, yt):
+        """Collect available resolutions, returning (sorted labels, stream map)"""
+        try:
+            # Get all video streams (both progressive and adaptive)
+            progressive_streams = yt.streams.filter(progressive=True, file_extension="mp4").order_by("resolution").desc()
+            adaptive_streams = yt.streams.filter(adaptive=True, only_video=True, file_extension="mp4").order_by("resolution").desc()
+            
+            # Collect unique resolutions
+            resolutions = set()
+            stream_map = {}
+            
+            # Add progressive streams
+            for stream in progressive_streams:
+                if stream.resolution:
+                    res_key = f"{stream.resolution} (Progressive)"
+                    resolutions.add(res_key)
+                    stream_map[res_key] = {'type': 'progressive', 'itag': stream.itag, 'resolution': stream.resolution}
+            
+            # Add adaptive streams (higher quality)
+            for stream in adaptive_streams:
+                if stream.resolution:
+                    res_key = f"{stream.resolution} (Best Quality)"
+                    resolutions.add(res_key)
+                    stream_map[res_key] = {'type': 'adaptive', 'itag': stream.itag, 'resolution': stream.resolution}
+            
+            # Sort resolutions by quality (descending)
+            sorted_resolutions = sorted(list(resolutions), key=lambda x: int(x.split('p')[0]), reverse=True)
+            return sorted_resolutions, stream_map
+            
+        except Exception as e:
+            self.log_message(f"Error getting quality options: {str(e)}", "error")
+            return ["Best Available"], {}
+    
+    def build_audio_options(self, yt):
+        """Collect available audio tracks, returning (labels, audio map)"""
+        try:
+            audio_options = []
+            audio_map = {}
+            
+            # Try to get language info from video metadata first
+            try:
+                # Access the video's raw data to get language information
+                if hasattr(yt, 'vid_info') and yt.vid_info:
+                    # Look for adaptive formats which might have language info
+                    adaptive_formats = yt.vid_info.get('streamingData', {}).get('adaptiveFormats', [])
+                    
+                    for fmt in adaptive_formats:
+                        if fmt.get('mimeType', '').startswith('audio/'):
+                            lang_code = fmt.get('languageCode', '').lower()
+                            quality = fmt.get('averageBitrate', 0)
+                            quality_str = f"{quality//1000}kbps" if quality > 0 else "Unknown"
+                            
+                            if lang_code and lang_code in LANGUAGE_NAMES:
+                                lang_name = LANGUAGE_NAMES[lang_code]
+                                label = f"{lang_name} ({quality_str})"
+                                
+                                # Create a corresponding stream object
+                                audio_streams = yt.streams.filter(only_audio=True, file_extension="mp4")
+                                if audio_streams:
+                                    # Match by quality or use best available
+                                    matching_stream = None
+                                    for stream in audio_streams:
+                                        if stream.abr and quality_str in stream.abr:
+                                            matching_stream = stream
+                                            break
+                                    
+                                    if not matching_stream:
+                                        matching_stream = audio_streams.order_by("abr").desc().first()
+                                    
+                                    if matching_stream and label not in [opt for opt in audio_options]:
+                                        audio_options.append(label)
+                                        audio_map[label] = {'itag': matching_stream.itag, 'abr': matching_stream.abr,
+                                                            'language': lang_code}
+            except Exception as e:
+                self.log_message(f"Could not extract language info from metadata: {str(e)}", "warning")
+            
+            # If no languages found from metadata, fall back to stream analysis
+            if not audio_options:
+                audio_streams = yt.streams.filter(only_audio=True, file_extension="mp4").order_by("abr").desc()
+                
+                # Try to detect language from video title or description
+                detected_lang = self.detect_video_language(yt)
+                
+                for i, stream in enumerate(audio_streams[:3]):  # Limit to top 3
+                    quality = stream.abr or 'Unknown'
+                    
+                    if i == 0 and detected_lang:
+                        # Use detected language for the first (best quality) stream
+                        lang_name = LANGUAGE_NAMES.get(detected_lang, detected_lang.upper())
+                        label = f"{lang_name} ({quality})"
+                    elif i == 0:
+                        label = f"Default ({quality})"
+                    else:
+                        label = f"Alternative {i} ({quality})"
+                    
+                    audio_options.append(label)
+                    audio_map[label] = {'itag': stream.itag, 'abr': stream.abr,
+                                        'language': detected_lang if i == 0 else None}
+            
+            return audio_options, audio_map
+            
+        except Exception as e:
+            self.log_message(f"Error getting audio options: {str(e)}", "error")
+            return ["Default Audio"], {}
+    
+    def detect_video_language(self, yt):
+        """Try to detect video language from title, description, or channel"""
+        try:
+            # Simple language detection based on common patterns
+            title = yt.title.lower() if yt.title else ""
+            description = yt.description.lower() if yt.description else ""
+            
+            # Spanish indicators
+            spanish_words = ['español', 'spanish', 'latino', 'castellano', 'méxico', 'argentina', 'colombia']
+            if any(word in title or word in description for word in spanish_words):
+                return 'es'
+            
+            # English is default for most content
+            return 'en'
+            
+        except Exception:
+            return 'en'  # Default to English
+    
+    def download_in_thread(self, job):
+        """Handle a queued download on a worker thread, returning a Future if it continues in post-processing"""
+        if job.cancel_event.is_set():
+            # A job cancelled while parked may hold the space it was woken with
+            self.disk_gate.release(job)
+            job.status = 'cancelled'
+            return
+        deferred = False
+        try:
+            # Archived downloads are skipped before any network request
+            archived_path = self.archived_path(job)
+            if archived_path:
+                job.final_path = archived_path
+                job.status = 'skipped'
+                self.log_message(f"Already downloaded, skipping: {job.title}")
+                self.update_job(job, 100, "Already downloaded")
+                return
+            
+            self.log_message(f"Starting download: {job.title}")
+            self.update_job(job, 0, "Starting download...")
+            # Reruns of parked jobs keep the first start, so the job span includes the wait
+            job.started = job.started or time.perf_counter()
+            
+            # Create output directory if needed, and fail before any transfer if it can't be written
+            os.makedirs(job.output_folder, exist_ok=True)
+            check_writable(job.output_folder)
+            
+            # Reuse the YouTube object resolved during analysis when it is still fresh
+            yt, _ = self.resolve_video(job)
+            try:
+                outcome = self.download_job_streams(job, yt)
+            except requests.HTTPError as e:
+                # Signed URLs can be rejected before their advertised expiry, cached or not, so refresh once
+                if e.response is None or e.response.status_code != 403:
+                    raise
+                self.log_message("Stream URLs expired, refreshing video metadata...", "warning")
+                self.metadata_cache.invalidate(get_video_id(job.url))
+                yt, _ = self.resolve_video(job)
+                outcome = self.download_job_streams(job, yt)
+            
+            if isinstance(outcome, concurrent.futures.Future):
+                # The download worker moves on while the merge finishes on the post-processing pool
+                outcome.add_done_callback(lambda future: self.finish_job(job, future))
+                return outcome
+            self.complete_job(job, outcome)
+            
+        except JobDeferred:
+            # Parked in the queue until the disk gate calls back, keeping its pause state
+            deferred = True
+            raise
+        except Exception as e:
+            self.fail_job(job, e)
+        finally:
+            if not deferred:
+                self.scheduler.release(job)
+    
+    def resolve_video(self, job):
+        """get_video for a job, timed as its resolve span"""
+        with self.tracer.span('resolve', job) as span:
+            yt, cached = self.get_video(job.url)
+            span.set(cached=cached)
+        return yt, cached
+    
+    def record_job_span(self, job, status, final_path=None):
+        """Emit the whole-job span once a job has settled"""
+        span = Span('job', job.id, mode=job.output_mode, itag=job.itag, title=job.title)
+        span.clock = job.started or span.clock
+        span.status = status
+        if final_path and os.path.exists(final_path):
+            span.set(bytes=os.path.getsize(final_path))
+        if job.error:
+            span.set(error=job.error)
+        span.finish()
+        self.tracer.emit(span)
+    
+    def finish_job(self, job, future):
+        """Complete or fail a job once its post-processing future settles"""
+        try:
+            self.complete_job(job, future.result())
+        except Exception as e:
+            self.fail_job(job, e)
+    
+    def complete_job(self, job, final_path):
+        """Record a finished download in the archive and mark the job complete"""
+        self.disk_gate.release(job)
+        if job.work_folder and job.work_folder != job.output_folder:
+            # Partial downloads of failed jobs stay in the scratch folder so a retry can resume them
+            with contextlib.suppress(OSError):
+                os.rmdir(job.work_folder)
+        if self.archive and job.itag:
+            self.archive.add(get_video_id(job.url), job.itag, job.output_mode, final_path, job.title)
+        
+        # Update UI
+        job.final_path = str(final_path)
+        job.status = 'completed'
+        self.update_job(job, 100, "Complete")
+        self.record_job_span(job, 'ok', final_path)
+    
+    def fail_job(self, job, error):
+        """Mark a job failed and report why"""
+        self.disk_gate.release(job)
+        if job.cancel_event.is_set():
+            job.status = 'cancelled'
+            self.log_message(f"Cancelled: {job.title}", "warning")
+            self.update_job(job, message="Cancelled")
+            self.record_job_span(job, 'cancelled')
+            return
+        job.status = 'failed'
+        job.error = str(error)
+        self.log_message(f"Download failed: {str(error)}", "error")
+        self.update_job(job, 0, f"Failed: {str(error)}")
+        self.record_job_span(job, 'error')
+    
+    def choose_work_folder(self, job):
+        """Folder for a job's partial downloads and merge inputs, on the scratch volume when one is set
+        
+        The subfolder is keyed by video, itag and mode, so jobs for the same
+        video in different modes don't share inputs while a retry of the same
+        download finds its partials again.
+        """
+        if not self.scratch_dir:
+            return job.output_folder
+        video_id = get_video_id(job.url)
+        name = f"{video_id}-{job.itag}-{job.output_mode}" if video_id else f"job-{job.id}"
+        return os.path.join(self.scratch_dir, name)
+    
+    def stream_path(self, job, stream, prefix=""):
+        """Where a stream downloads to, under a hidden partial name when it is the output itself"""
+        folder = job.work_folder
+        path = stream.get_file_path(output_path=folder, filename_prefix=prefix)
+        if not prefix and folder == job.output_folder:
+            return str(partial_path(path))
+        return path
+    
+    def archived_path(self, job):
+        """Return where the archive says this job was already saved, or None"""
+        itag = job.video_choice['itag'] if job.video_choice else None
+        return self.archive_lookup(get_video_id(job.url), job.output_mode, job.quality, itag)
+    
+    def archive_lookup(self, video_id, mode, quality='best', itag=None):
+        """Return the archived path for a video in the quality that would be downloaded, or None
+        
+        Without a chosen stream the itag comes from the cached stream table. When
+        that isn't cached only a 'best' job can match any archived quality; a job
+        asking for e.g. 720p isn't skipped because a higher quality was saved.
+        """
+        if not self.archive or not video_id:
+            return None
+        if itag is None:
+            metadata = self.persistent_cache.get(video_id) if self.persistent_cache else None
+            if metadata:
+                label = choose_quality(metadata['quality_options'], metadata['stream_map'], quality)
+                itag = metadata['stream_map'][label]['itag'] if label else None
+            if itag is None and quality not in (None, 'best'):
+                return None
+        return self.archive.find(video_id, mode, itag)
+    
+    def download_job_streams(self, job, yt):
+        """Download the job's selected streams, returning the final path or a Future of it while merging"""
+        yt.register_on_progress_callback(lambda stream, chunk, remaining: self.on_download_progress(job, stream, chunk, remaining))
+        if job.title == job.url:
+            job.title = yt.title
+        
+        # Get selected streams
+        self.log_message("Preparing selected streams...")
+        with self.tracer.span('select', job) as span:
+            video_stream, audio_stream, needs_merge = self.get_selected_streams(yt, job)
+            span.set(video_itag=getattr(video_stream, 'itag', None), audio_itag=getattr(audio_stream, 'itag', None),
+                     resolution=getattr(video_stream, 'resolution', None), needs_merge=needs_merge)
+        
+        if not video_stream:
+            raise Exception("No suitable stream found")
+        
+        resolution = video_stream.resolution
+        self.log_message(f"Best quality found: {resolution}")
+        
+        # Merged files carry an archive tag so the archive can be rebuilt from the folder
+        job.itag = video_stream.itag
+        video_id = get_video_id(job.url)
+        tags = {'comment': archive_tag(video_id, job.itag, job.output_mode)} if video_id else None
+        
+        # Fixed for the rest of the job, so changing the scratch folder meanwhile doesn't split its files
+        if not job.work_folder:
+            job.work_folder = self.choose_work_folder(job)
+        if job.work_folder != job.output_folder:
+            os.makedirs(job.work_folder, exist_ok=True)
+            check_writable(job.work_folder)
+        
+        streaming = needs_merge and self.can_stream_merge(job, video_stream, audio_stream)
+        self.reserve_space(job, video_stream, audio_stream if needs_merge else None, staged=needs_merge and not streaming)
+        if streaming:
+            final_path = self.stream_merge(job, video_stream, audio_stream, tags)
+        else:
+            final_path = None
+        
+        if final_path:
+            self.log_message(f"Download complete! Saved to: {final_path.name}", "success")
+        elif needs_merge:
+            if streaming:
+                # The fallback keeps both inputs on disk next to the merged output
+                self.reserve_space(job, video_stream, audio_stream, staged=True)
+            # Download video and audio at the same time
+            self.update_job(job, message=f"Downloading video ({resolution}) and audio...")
+            job.track_components([video_stream, audio_stream])
+            
+            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+                video_future = executor.submit(self.download_stream, job, video_stream, "video_")
+                audio_future = executor.submit(self.download_stream, job, audio_stream, "audio_")
+                video_path = video_future.result()
+                audio_path = audio_future.result()
+            
+            # Merge with ffmpeg on the post-processing pool
+            stem = Path(video_path).stem.replace('video_', '')
+            plan = self.plan_merge(job.output_mode, video_stream, video_path)
+            if job.output_mode == 'transcode':
+                suffix = f"_{plan['codec'].upper()}" if plan['codec'] else ""
+                final_path = Path(job.output_folder) / f"{stem}{suffix}.mp4"
+            else:
+                final_path = Path(job.output_folder) / f"{stem}.mp4"
+            self.log_message(f"Video plan: {plan['summary']}")
+            
+            lane = PostProcessor.lane_for(plan['encoder'])
+            self.update_job(job, message="Waiting for encoder..." if lane != 'remux' else "Waiting to remux...")
+            return self.postprocessor.submit(lane, self.merge_job, job, video_path, audio_path, final_path,
+                                             plan, video_stream.codecs, audio_stream.codecs, tags,
+                                             getattr(yt, 'length', None))
+        else:
+            # Direct download
+            job.track_components([video_stream])
+            path = self.download_stream(job, video_stream)
+            final_path = Path(video_stream.get_file_path(output_path=job.output_folder))
+            if tags and self.tag_download(job, path, final_path, tags):
+                SegmentedDownloader.discard(path)
+            else:
+                atomic_move(path, final_path)
+                SegmentedDownloader.clear_manifest(path)
+            self.log_message(f"Download complete! Saved to: {final_path.name}", "success")
+        
+        return final_path
+    
+    def space_needed(self, job, video_stream, audio_stream=None, staged=False):
+        """Estimate the bytes a job still needs in each folder, {folder: bytes}
+        
+        Downloads land in the work folder and outputs in the output folder. A
+        staged merge keeps its inputs until ffmpeg has written the output, so
+        it peaks at about twice the stream sizes, as does a direct download,
+        which is copied next to the output to tag it. Partial files already on
+        disk were preallocated at full size and are subtracted.
+        """
+        streams = [stream for stream in (video_stream, audio_stream) if stream]
+        total = sum(stream.filesize or 0 for stream in streams)
+        if audio_stream:
+            prefixes = ('video_', 'audio_') if staged else ()
+        else:
+            prefixes = ('',)
+        existing = 0
+        for stream, prefix in zip(streams, prefixes):
+            path = self.stream_path(job, stream, prefix)
+            if os.path.exists(path):
+                existing += os.path.getsize(path)
+        
+        work_folder = job.work_folder
+        needs = collections.Counter()
+        if staged:
+            needs[work_folder] += total - existing
+            needs[job.output_folder] += total * MERGE_SIZE_FACTOR
+        elif audio_stream:
+            needs[job.output_folder] += total * MERGE_SIZE_FACTOR
+        else:
+            needs[work_folder] += total - existing
+            # The tagged copy, or the copy a move across volumes makes if tagging fails
+            needs[job.output_folder] += total
+        return {folder: int(max(0, size)) for folder, size in needs.items()}
+    
+    def reserve_space(self, job, video_stream, audio_stream=None, staged=False):
+        """Preflight: hold room for the downloads and the merged output, or park the job in the queue
+        
+        A job that doesn't fit raises JobDeferred, freeing its worker for jobs
+        that do. It runs again from the start, re-resolving its stream URLs if
+        they expired meanwhile, once the disk gate has reserved its space.
+        """
+        needs = self.space_needed(job, video_stream, audio_stream, staged)
+        with self.tracer.span('preflight', job, bytes_needed=sum(needs.values())) as span:
+            missing = self.disk_gate.try_acquire(job, needs)
+            span.set(waited=bool(missing))
+        if not missing:
+            return
+        
+        # Space held for an earlier phase of the job would only hold up others while it waits
+        self.disk_gate.release(job)
+        folder, size, available = missing[0]
+        self.log_message(f"Not enough disk space in {folder} for {job.title} "
+                         f"(needs {format_bytes(size)}, {format_bytes(available)} available), waiting in the queue...", "warning")
+        self.update_job(job, message=f"Waiting for disk space ({format_bytes(size)} needed)...")
+        
+        def register(callback):
+            def ready():
+                if not job.cancel_event.is_set():
+                    self.log_message(f"Disk space available, resuming {job.title}")
+                    self.update_job(job, message="Waiting in queue...")
+                callback()
+            self.disk_gate.defer(job, needs, ready)
+        
+        raise JobDeferred(f"Job {job.id} is waiting for disk space", register)
+    
+    def can_stream_merge(self, job, video_stream, audio_stream):
+        """Streaming merges need a pure remux of two plain HTTP streams with known sizes"""
+        if (not STREAMING_MERGE or job.output_mode != 'remux' or job.stream_merge_failed or
+                not StreamingMerger.supported()):
+            return False
+        for stream in (video_stream, audio_stream):
+            if getattr(stream, 'is_sabr', False) or getattr(stream, 'is_otf', False) or not stream.filesize:
+                return False
+        return can_stream_copy(video_stream.codecs) and can_stream_copy(audio_stream.codecs)
+    
+    def stream_merge(self, job, video_stream, audio_stream, tags=None):
+        """Remux while downloading, returning the final path or None to fall back to temp files"""
+        stem = Path(video_stream.get_file_path(output_path=job.output_folder)).stem
+        final_path = Path(job.output_folder) / f"{stem}.mp4"
+        output_path = partial_path(final_path)
+        
+        self.update_job(job, message=f"Downloading and remuxing ({video_stream.resolution})...")
+        job.track_components([video_stream, audio_stream])
+        
+        def on_progress(video_bytes, audio_bytes):
+            job.record_component(video_stream.itag, video_bytes)
+            self.update_job(job, job.record_component(audio_stream.itag, audio_bytes))
+        
+        try:
+            with self.tracer.span('stream_merge', job, bytes=video_stream.filesize + audio_stream.filesize,
+                                  encoder='copy'):
+                StreamingMerger(throttle=self.throttle(job)).merge(video_stream.url, video_stream.filesize,
+                                        audio_stream.url, audio_stream.filesize,
+                                        str(output_path), on_progress, tags)
+            os.replace(output_path, final_path)
+            return final_path
+        except Exception as e:
+            try:
+                os.remove(output_path)
+            except OSError:
+                pass
+            if job.cancel_event.is_set():
+                raise JobCancelled(f"Job {job.id} was cancelled")
+            job.stream_merge_failed = True
+            self.log_message(f"Streaming merge failed ({e}), using temporary files", "warning")
+            self.update_job(job, 0)
+            return None
+    
+    def download_stream(self, job, stream, prefix=""):
+        """Download one stream, timed as a download_video or download_audio span"""
+        phase = 'download_audio' if getattr(stream, 'abr', None) and not getattr(stream, 'resolution', None) else 'download_video'
+        with self.tracer.span(phase, job, itag=stream.itag, bytes=stream.filesize) as span:
+            path = self.fetch_stream(job, stream, prefix)
+            if path and os.path.exists(path):
+                span.set(bytes=os.path.getsize(path))
+        return path
+    
+    def fetch_stream(self, job, stream, prefix=""):
+        """Download one stream with the segmented downloader, falling back to pytubefix"""
+        path = self.stream_path(job, stream, prefix)
+        folder, filename = os.path.split(path)
+        
+        # SABR and OTF streams can't be fetched with plain range requests
+        if getattr(stream, 'is_sabr', False) or getattr(stream, 'is_otf', False):
+            return stream.download(folder, filename=filename)
+        
+        def on_progress(bytes_downloaded):
+            self.update_job(job, job.record_component(stream.itag, bytes_downloaded))
+        
+        downloader = SegmentedDownloader(throttle=self.throttle(job))
+        attempt = 0
+        while True:
+            try:
+                return downloader.download(stream.url, path, stream.filesize, on_progress, stream.itag)
+            except Exception as e:
+                # Client errors such as expired URLs won't be fixed by retrying the same URL
+                if isinstance(e, JobCancelled):
+                    raise
+                if isinstance(e, requests.HTTPError) and e.response is not None and 400 <= e.response.status_code < 500:
+                    raise
+                if self.scheduler.is_paused(job):
+                    # A connection lost while paused isn't a network failure, so it doesn't spend a retry
+                    self.scheduler.wait_resumed(job)
+                    continue
+                if attempt < DOWNLOAD_RETRIES:
+                    # Completed ranges are kept on disk, so the next attempt resumes
+                    delay = backoff_delay(attempt)
+                    attempt += 1
+                    self.log_message(f"Download interrupted ({e}), resuming in {delay:.1f}s...", "warning")
+                    time.sleep(delay)
+                    continue
+                
+                self.log_message(f"Segmented download failed ({e}), retrying with pytubefix", "warning")
+                downloader.discard(path)
+                job.record_component(stream.itag, 0)
+                return stream.download(folder, filename=filename, skip_existing=False)
+    
+    def get_selected_streams(self, yt, job):
+        """Get streams based on the selection queued with the job"""
+        try:
+            # Resolve the queued choices against this job's YouTube object by itag
+            if not job.video_choice:
+                # Queued without analysis, apply the same rules the GUI selectors default to
+                job.video_choice, job.audio_choice = self.default_choices(yt, job.quality, job.audio_language)
+                if not job.video_choice:
+                    return self.get_best_streams_fallback(yt)
+            
+            video_stream = yt.streams.get_by_itag(job.video_choice['itag'])
+            needs_merge = job.video_choice['type'] == 'adaptive'
+            
+            # Get audio stream based on selection
+            audio_stream = None
+            if needs_merge:
+                if job.audio_choice:
+                    audio_stream = yt.streams.get_by_itag(job.audio_choice['itag'])
+                else:
+                    # Fallback to best audio
+                    audio_stream = yt.streams.filter(only_audio=True, file_extension="mp4")\
+                                        .order_by("abr").desc().first()
+            
+            return video_stream, audio_stream, needs_merge
+            
+        except Exception as e:
+            self.log_message(f"Error getting selected streams, using defaults: {str(e)}", "warning")
+            # Fallback to original logic
+            return self.get_best_streams_fallback(yt)
+    
+    def get_best_streams_fallback(self, yt):
+        """Fallback method for getting streams"""
+        streams = yt.streams.filter(progressive=True, file_extension="mp4").order_by("resolution").desc()
+        
+        if not streams:
+            return None, None, False
+            
+        best_progressive = streams.first()
+        progressive_resolution = int(best_progressive.resolution[:-1]) if best_progressive else 0
+        
+        # If best progressive is less than 1080p, try adaptive
+        if progressive_resolution < 1080:
+            video_stream = yt.streams.filter(adaptive=True, file_extension="mp4", only_video=True)\
+                                .order_by("resolution").desc().first()
+            audio_stream = yt.streams.filter(only_audio=True, file_extension="mp4")\
+                                .order_by("abr").desc().first()
+            
+            if video_stream and audio_stream:
+                return video_stream, audio_stream, True
+        
+        return best_progressive, None, False
+    
+    def on_download_progress(self, job, stream, chunk, bytes_remaining):
+        """Progress callback for download, combined across the job's streams"""
+        # pytubefix reads before calling back, so throttling here still paces the transfer
+        self.scheduler.acquire(job, len(chunk))
+        bytes_downloaded = stream.filesize - bytes_remaining
+        percentage = job.record_component(stream.itag, bytes_downloaded)
+        
+        # Update progress in main thread
+        self.update_job(job, percentage)
+    
+    def merge_job(self, job, video_path, audio_path, final_path, plan, video_codecs, audio_codecs, tags,
+                  duration=None):
+        """Post-processing task: merge a job's downloaded streams and remove the temporary files
+        
+        ffmpeg writes under a hidden partial name in the output folder, renamed
+        into place once the merge succeeds.
+        """
+        if job.cancel_event.is_set():
+            raise JobCancelled(f"Job {job.id} was cancelled")
+        encoder = plan['encoder']
+        if PostProcessor.lane_for(encoder) == 'remux':
+            action = "Remuxing"
+        else:
+            action = f"Encoding with {encoder['label']}"
+            self.log_message(f"Encoding with {encoder['label']} ({encoder['name']})")
+        self.update_job(job, 0, f"{action}...")
+        
+        def on_progress(progress):
+            details = [f"{progress['fps']:.0f} fps" if progress['fps'] else None,
+                       f"{progress['speed']:.1f}x" if progress['speed'] else None]
+            message = ' • '.join([f"{action}...", *filter(None, details)])
+            self.update_job(job, progress['percent'], message)
+        
+        input_bytes = os.path.getsize(video_path) + os.path.getsize(audio_path)
+        output_path = partial_path(final_path)
+        with self.tracer.span('merge', job, bytes=input_bytes, mode=job.output_mode,
+                              encoder=encoder['name'] if encoder else 'copy') as span:
+            success = self.merge_audio_video(video_path, audio_path, str(output_path), job.output_mode,
+                                             video_codecs, audio_codecs, tags, on_progress, job.cancel_event,
+                                             duration, plan)
+            if not success:
+                # A cancelled or failed run leaves a truncated output behind
+                try:
+                    os.remove(output_path)
+                except OSError:
+                    pass
+                if job.cancel_event.is_set():
+                    raise JobCancelled(f"Job {job.id} was cancelled")
+                raise Exception("Failed to merge audio and video")
+            span.set(output_bytes=os.path.getsize(output_path))
+            os.replace(output_path, final_path)
+        
+        # Clean up temp files
+        with self.tracer.span('cleanup', job, files=2):
+            SegmentedDownloader.discard(video_path)
+            SegmentedDownloader.discard(audio_path)
+        self.log_message(f"Download complete! Saved to: {final_path.name}", "success")
+        return final_path
+    
+    @staticmethod
+    def plan_merge(mode, video_stream, video_path, container='mp4'):
+        """Plan the video side of a merge from the stream's metadata, probing the file for anything missing"""
+        source = video_source(video_stream)
+        # Remuxes of copyable codecs never look at the numbers, so skip the probe
+        if not (mode == 'remux' and can_stream_copy(source['codecs'], container)) and None in source.values():
+            probed = probe_video_source(video_path)
+            source = {key: source[key] or probed[key] for key in source}
+        return plan_video_encode(mode, source, container)
+    
+    def tag_download(self, job, path, final_path, tags):
+        """Stream copy a direct download into place with its archive tag, returning False if ffmpeg failed"""
+        # The download itself may already sit under final_path's partial name
+        output_path = partial_path(final_path.with_name(f"{final_path.stem}.tagged{final_path.suffix}"))
+        command = [FFMPEG_PATH, '-y', '-i', path, '-map', '0', '-c', 'copy', *metadata_args(tags), str(output_path)]
+        self.update_job(job, message="Tagging...")
+        with self.tracer.span('tag', job, bytes=os.path.getsize(path)) as span:
+            try:
+                runner = FFmpegProcess(command, cancel_event=job.cancel_event)
+                success = runner.run() == 0 and not runner.cancelled and not runner.timed_out
+                error = runner.error_text()[-500:]
+            except Exception as e:
+                success, error = False, str(e)
+            span.set(tagged=success)
+        
+        if success:
+            os.replace(output_path, final_path)
+            return True
+        try:
+            os.remove(output_path)
+        except OSError:
+            pass
+        if job.cancel_event.is_set():
+            raise JobCancelled(f"Job {job.id} was cancelled")
+        logger.warning(f"Could not tag {final_path.name}, saving it untagged: {error}")
+        return False
+    
+    def merge_audio_video(self, video_path, audio_path, output_path, mode=DEFAULT_OUTPUT_MODE,
+                          video_codecs=None, audio_codecs=None, metadata=None, on_progress=None,
+                          cancel_event=None, duration=None, plan=None):
+        """Merge audio and video using FFmpeg, stream copying when remuxing or when the source needs no encode"""
+        try:
+            container = Path(output_path).suffix.lstrip('.').lower()
+            
+            if plan is None:
+                source = probe_video_source(video_path)
+                source['codecs'] = list(video_codecs or source['codecs'])
+                plan = plan_video_encode(mode, source, container)
+            input_args = plan['input_args']
+            video_args = plan['args']
+            threads = PostProcessor.encoder_threads(plan['encoder'])
+            if threads:
+                video_args = [*video_args, '-threads', str(threads)]
+            
+            if mode == 'remux' and can_stream_copy(audio_codecs, container):
+                audio_args = ['-c:a', 'copy']
+            else:
+                audio_args = ['-c:a', 'aac', '-b:a', '192k']
+            
+            command = [
+                FFMPEG_PATH,
+                '-y',
+                *input_args,
+                '-i', video_path,
+                '-i', audio_path,
+                '-map', '0:v:0',
+                '-map', '1:a:0',
+                *video_args,
+                *audio_args,
+                *metadata_args(metadata),
+                output_path
+            ]
+            
+            runner = FFmpegProcess(command, duration, on_progress, cancel_event)
+            returncode = runner.run()
+            if runner.cancelled:
+                logger.info(f"FFmpeg merge cancelled: {os.path.basename(output_path)}")
+                return False
+            if runner.timed_out:
+                logger.error(f"FFmpeg merge timed out: {runner.error_text()[-500:]}")
+                return False
+            if returncode != 0:
+                logger.error(f"FFmpeg merge failed: {runner.error_text()[-500:]}")
+            return returncode == 0
+            
+        except Exception as e:
+            logger.error(f"Error merging: {str(e)}")
+            return False
+
+STARTUP_TIMER.mark('core_import')